@@ -57,12 +57,31 @@ INSTALLED_APPS = [
 #  ------------
 
 MIDDLEWARE = [
+    # Gives every request an id (X-Request-ID) attached to the log records it produces
+    'base.logs.RequestIdMiddleware',
+
+    # Opens the trace of every request (spans written to TRACE_FILE)
+    'base.tracing.TracingMiddleware',
+
+    # Records latency and query metrics per view (served on /metrics)
+    'base.instrumentation.MetricsMiddleware',
+
+    # Flags requests repeating the same query shape (N+1), see NPLUSONE_DETECTION
+    'base.querycheck.NPlusOneMiddleware',
+
     # Enables CORS for APIs
     'corsheaders.middleware.CorsMiddleware',
 
+    # Sheds load per route class (503 + Retry-After) when a class is saturated, see ADMISSION_LIMITS;
+    # below CorsMiddleware so the frontend can read shed responses
+    'base.admission.AdmissionControlMiddleware',
+
     # Enhances security features
     'django.middleware.security.SecurityMiddleware',
 
+    # Scopes read-replica routing to a single request
+    'base.routers.ReplicaRoutingMiddleware',
+
     # Manages user sessions
     'django.contrib.sessions.middleware.SessionMiddleware',
 
@@ -127,6 +146,51 @@ DATABASES = {
     }
 }
 
+# Tuned SQLite profile: on by default in production, force with SQLITE_TUNED=True/False
+SQLITE_TUNED = os.getenv('SQLITE_TUNED', str(IS_PRODUCTION)) == 'True'
+
+# Connection options of the tuned profile (`manage.py stress` always uses them)
+SQLITE_TUNED_OPTIONS = {
+    # PRAGMAs executed on every new connection
+    'init_command': ';'.join([
+        # Readers no longer block the writer (and vice versa)
+        f"PRAGMA journal_mode={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')}",
+        # Safe with WAL: fsync at checkpoints instead of every commit
+        f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        # Memory-map up to this many bytes of the database file
+        f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))}",
+        # Page cache per connection (negative values are KiB)
+        f"PRAGMA cache_size={int(os.getenv('SQLITE_CACHE_SIZE', -64000))}",
+        # Wait this many ms for a lock instead of failing with "database is locked"
+        f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT', 5000))}",
+        # Keep temporary tables and indices in memory
+        f"PRAGMA temp_store={os.getenv('SQLITE_TEMP_STORE', 'MEMORY')}",
+    ]),
+    # Take the write lock when a transaction starts, so busy_timeout applies
+    # instead of failing on a read-to-write lock upgrade
+    'transaction_mode': os.getenv('SQLITE_TRANSACTION_MODE', 'IMMEDIATE'),
+}
+
+if SQLITE_TUNED:
+    DATABASES['default']['OPTIONS'] = SQLITE_TUNED_OPTIONS
+    # Reuse connections across requests (seconds), checking them before reuse
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('DB_CONN_MAX_AGE', 600))
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replicas: comma-separated SQLite paths (copy the primary with `manage.py syncreplicas`)
+DATABASE_REPLICAS = []
+for index, path in enumerate(filter(None, os.getenv('DATABASE_REPLICA_PATHS', '').split(',')), start=1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'NAME': path,
+        # Tests read replicas through the test primary
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+# Safe reads go to a replica unless the request wrote or its view needs the primary
+DATABASE_ROUTERS = ['base.routers.ReplicaRouter']
+
 
 #  ---------------------
 # | Password Validation |
@@ -147,6 +211,12 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Serve login, register and profile update from async views (worth it under ASGI)
+ASYNC_AUTH_VIEWS = os.getenv('ASYNC_AUTH_VIEWS', 'False') == 'True'
+# Threads hashing/verifying passwords for the async views, and how many jobs may wait for them
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 32))
+
 
 #  ----------------------
 # | Internationalization |
@@ -175,6 +245,21 @@ else:
     STATIC_ROOT = os.path.join(BASE_DIR, 'static')
     MEDIA_URL = '/media/'
     MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+STORAGES = {
+    # Media files are named by content hash and deduplicated (see base/storage.py)
+    'default': {'BACKEND': 'base.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# Unreferenced media files are swept this long after a deletion (0: only via `manage.py sweepmedia`)
+MEDIA_SWEEP_DELAY_SECONDS = int(os.getenv('MEDIA_SWEEP_DELAY_SECONDS', 60))
+# Files younger than this are never swept (uploaded but not yet saved on a product)
+MEDIA_SWEEP_GRACE_SECONDS = int(os.getenv('MEDIA_SWEEP_GRACE_SECONDS', 60 * 60))
+# How MEDIA_URL is served: 'direct' (Django streams it, with ranges and sendfile),
+# 'x-accel' (nginx, via X-Accel-Redirect) or 'x-sendfile' (Apache/lighttpd, via X-Sendfile)
+MEDIA_SERVE_MODE = os.getenv('MEDIA_SERVE_MODE', 'direct')
+# nginx `internal` location aliased to MEDIA_ROOT (x-accel mode)
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
     
     
 #  --------------------------------
@@ -205,6 +290,9 @@ else:
     # Allows all origins during development for ease of testing APIs
     CORS_ALLOW_ALL_ORIGINS = True
 
+# Response headers the frontend may read: when to retry a shed request (503)
+CORS_EXPOSE_HEADERS = ['Retry-After']
+
 
 #  --------------------------------
 # | Security Cookies Configuration |
@@ -223,11 +311,65 @@ if IS_PRODUCTION:
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        # Enable JWT authentication
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+        # Enable JWT authentication (the token's user is cached, see AUTH_USER_CACHE_TIMEOUT)
+        'base.authentication.CachedJWTAuthentication',
+    ],
+    # JSON rendering time is reported in the Server-Timing header
+    'DEFAULT_RENDERER_CLASSES': [
+        'base.instrumentation.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    # Token-bucket rates of the password hashing endpoints (see base/throttling.py)
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': os.getenv('THROTTLE_AUTH_IP', '20/min'),  # Per client IP
+        'auth_account': os.getenv('THROTTLE_AUTH_ACCOUNT', '5/min'),  # Per account and client IP
+    },
+    # Reverse proxies in front of the app: 0 identifies clients by REMOTE_ADDR and ignores a
+    # client-supplied X-Forwarded-For; behind N proxies the Nth address from its end is used
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
 }
 
+# SQLite file holding the throttle buckets shared by all workers
+THROTTLE_DB_PATH = os.getenv('THROTTLE_DB_PATH', BASE_DIR / 'database/throttle.sqlite3')
+
+# Interface the app is served with and threads per WSGI worker process (read by gunicorn.conf.py too)
+SERVER_INTERFACE = os.getenv('SERVER_INTERFACE', 'wsgi')
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', 4))
+
+
+# Default limit of a route class under WSGI: about `share` of the worker threads, never all of
+# them (a queued request blocks its thread too), so a class stuck on a dependency leaves threads
+# to the others
+def _thread_share(share: float, wait: int) -> str:
+    held = max(1, min(WORKER_THREADS - 1, round(WORKER_THREADS * share)))
+    queue = 1 if held > 1 else 0
+    return f'{held - queue}/{queue}/{wait}'
+
+
+# Per-process concurrency limits by route class (base/admission.py), as "limit/queue/wait":
+# requests handled at once, requests waiting for a slot, and seconds one may wait before a 503.
+# Under ASGI requests wait in the event loop, not in threads, and the limits only bound the work
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'True') == 'True'
+if SERVER_INTERFACE == 'asgi':
+    ADMISSION_LIMITS = {
+        'catalog': os.getenv('ADMISSION_CATALOG', '64/128/2'),  # Product list and details
+        'checkout': os.getenv('ADMISSION_CHECKOUT', '16/32/2'),  # Placing and reading orders
+        'payment': os.getenv('ADMISSION_PAYMENT', '8/16/1'),  # Zibal requests, inquiries and callbacks
+        'auth': os.getenv('ADMISSION_AUTH', '16/32/1'),  # Login, registration and profiles
+        'events': os.getenv('ADMISSION_EVENTS', '256/0/0'),  # Open payment status streams
+    }
+else:
+    # 4 threads: catalog 2/1/2, checkout 1/1/2, payment 1/1/1, auth 1/1/1, events 1/0/0
+    ADMISSION_LIMITS = {
+        'catalog': os.getenv('ADMISSION_CATALOG', _thread_share(0.75, 2)),
+        'checkout': os.getenv('ADMISSION_CHECKOUT', _thread_share(0.5, 2)),
+        'payment': os.getenv('ADMISSION_PAYMENT', _thread_share(0.5, 1)),
+        'auth': os.getenv('ADMISSION_AUTH', _thread_share(0.5, 1)),
+        'events': os.getenv('ADMISSION_EVENTS', _thread_share(0.25, 0)),
+    }
+# Seconds a shed client is told to wait (Retry-After)
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 1))
+
 
 #  -------------------------
 # | SimpleJWT Configuration |
@@ -245,8 +387,112 @@ SIMPLE_JWT = {
     "ALGORITHM": "HS256",  # Algorithm used to encode JWTs
     # Custom serializer for obtaining tokens
     "TOKEN_OBTAIN_SERIALIZER": "base.serializers.MyTokenObtainPairSerializer",
+    # Custom serializer for refreshing tokens (checks the blacklist filter first)
+    "TOKEN_REFRESH_SERIALIZER": "base.serializers.MyTokenRefreshSerializer",
 }
 
+# Per-process filter of blacklisted refresh tokens (see base/blacklist.py)
+# Expected number of blacklisted tokens and the accepted false-positive rate
+JWT_BLACKLIST_FILTER_CAPACITY = int(os.getenv('JWT_BLACKLIST_FILTER_CAPACITY', 100000))
+JWT_BLACKLIST_FILTER_ERROR_RATE = float(os.getenv('JWT_BLACKLIST_FILTER_ERROR_RATE', 0.001))
+# Seconds between pulls of tokens blacklisted by other workers (one primary-key range query, read
+# outside the filter's lock). A token rotated on one worker can be replayed against another for up
+# to this long; tokens rotated on the same worker are rejected at once. 0 pulls on every refresh
+JWT_BLACKLIST_SYNC_SECONDS = float(os.getenv('JWT_BLACKLIST_SYNC_SECONDS', 1))
+# Seconds between deletions of expired outstanding/blacklisted tokens by the mail worker's periodic
+# pass (or run `python manage.py flushexpiredtokens` from cron)
+JWT_BLACKLIST_PRUNE_SECONDS = float(os.getenv('JWT_BLACKLIST_PRUNE_SECONDS', 60 * 60))
+
+
+#  ----------------
+# | Cache Settings |
+#  ----------------
+
+# Per-process memory cache by default; set CACHE_LOCATION to a directory to share
+# one file-based cache between all workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache'
+        if os.getenv('CACHE_LOCATION') else 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', 'default'),
+    }
+}
+
+# Seconds a JWT-authenticated user is served from the cache (bounds staleness
+# in other workers; the saving worker invalidates immediately)
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 60))
+
+
+#  ---------------------
+# | Metrics and Profiling |
+#  ---------------------
+
+# Directory where every worker process writes its metrics snapshot, so /metrics can add
+# them together (unset: each process reports only itself); empty it when the server starts
+METRICS_DIR = os.getenv('METRICS_DIR')
+# Minimum interval between two snapshot writes of one process
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+# Add a Server-Timing header (db, serialization, gateway, email, total) to every response
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+# Request profiles (cProfile .prof files) are written here; unset disables profiling
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+# Staff requests sending this header are profiled
+PROFILE_HEADER = os.getenv('PROFILE_HEADER', 'X-Profile')
+# Fraction of all requests profiled at random
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# Only the newest profiles are kept
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 100))
+# Log (or raise, NPLUSONE_RAISE) requests that run one query shape NPLUSONE_THRESHOLD times or more
+NPLUSONE_DETECTION = os.getenv('NPLUSONE_DETECTION', str(DEBUG)) == 'True'
+NPLUSONE_THRESHOLD = int(os.getenv('NPLUSONE_THRESHOLD', 5))
+NPLUSONE_RAISE = os.getenv('NPLUSONE_RAISE', 'False') == 'True'
+# Trace spans (request, ORM queries, Zibal, email, serializers) are appended to this JSONL
+# file by a background thread; unset disables tracing
+TRACE_FILE = os.getenv('TRACE_FILE')
+# Fraction of requests traced (requests with a traceparent header follow the caller's decision)
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1))
+# Finished spans waiting to be written; more are dropped
+TRACE_BUFFER_SIZE = int(os.getenv('TRACE_BUFFER_SIZE', 10000))
+# Pause between two writes of the exporter (spans are written in batches)
+TRACE_FLUSH_SECONDS = float(os.getenv('TRACE_FLUSH_SECONDS', 1))
+
+
+#  ---------
+# | Logging |
+#  ---------
+
+# Records are stamped with request/trace ids, rate-limited, and written as JSON lines by a
+# background thread (base/logs.py): a failing dependency logging on every request only costs a queue put
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# Log file (unset: stderr)
+LOG_FILE = os.getenv('LOG_FILE')
+# Records waiting to be written; more are dropped
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+# Identical records (same logger, level and message template) let through per window; 0 disables the limit
+LOG_RATE_LIMIT_BURST = int(os.getenv('LOG_RATE_LIMIT_BURST', 10))
+LOG_RATE_LIMIT_SECONDS = float(os.getenv('LOG_RATE_LIMIT_SECONDS', 60))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'request_context': {'()': 'base.logs.RequestContextFilter'},
+        'rate_limit': {
+            '()': 'base.logs.RateLimitFilter',
+            'burst': LOG_RATE_LIMIT_BURST,
+            'window': LOG_RATE_LIMIT_SECONDS,
+        },
+    },
+    'handlers': {
+        'background': {
+            '()': 'base.logs.BackgroundHandler',
+            'filename': LOG_FILE,
+            'capacity': LOG_QUEUE_SIZE,
+            'filters': ['request_context', 'rate_limit'],
+        },
+    },
+    'root': {'handlers': ['background'], 'level': LOG_LEVEL},
+}
 
 #  -------------------------------
 # | Application-Specific Settings |
@@ -256,6 +502,9 @@ SIMPLE_JWT = {
 BACKEND_DOMAIN = os.getenv('BACKEND_DOMAIN')
 # Frontend domain loaded from environment variables
 FRONTEND_DOMAIN = os.getenv('FRONTEND_DOMAIN')
+# Account activation links expire after this long
+ACCOUNT_ACTIVATION_TOKEN_MAX_AGE = timedelta(
+    seconds=int(os.getenv('ACCOUNT_ACTIVATION_TOKEN_MAX_AGE', 60 * 60 * 24)))
 
 
 #  ---------------------
@@ -277,6 +526,20 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 # Email password from environment variables
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
+# Emails are written to the EmailOutbox table and delivered in the background (base/mailqueue.py):
+# 'thread' runs a delivery thread in every web process, 'off' leaves it to `manage.py sendqueuedemail`
+EMAIL_QUEUE_WORKER = os.getenv('EMAIL_QUEUE_WORKER', 'thread')
+EMAIL_QUEUE_BATCH_SIZE = int(os.getenv('EMAIL_QUEUE_BATCH_SIZE', 50))  # Messages per SMTP session
+EMAIL_QUEUE_POLL_SECONDS = int(os.getenv('EMAIL_QUEUE_POLL_SECONDS', 30))  # Idle wake-up for retries
+EMAIL_QUEUE_MAX_ATTEMPTS = int(os.getenv('EMAIL_QUEUE_MAX_ATTEMPTS', 6))  # Then the message is marked failed
+EMAIL_QUEUE_RETRY_SECONDS = int(os.getenv('EMAIL_QUEUE_RETRY_SECONDS', 30))  # First retry delay, doubled each time
+
+# Admin new-user/new-order alerts: 'immediate' sends one email per event, 'digest' sends one
+# summary once ADMIN_ALERT_DIGEST_THRESHOLD events are pending or the oldest is this many seconds old
+ADMIN_ALERT_MODE = os.getenv('ADMIN_ALERT_MODE', 'immediate')
+ADMIN_ALERT_DIGEST_SECONDS = int(os.getenv('ADMIN_ALERT_DIGEST_SECONDS', 300))
+ADMIN_ALERT_DIGEST_THRESHOLD = int(os.getenv('ADMIN_ALERT_DIGEST_THRESHOLD', 100))
+
 
 #  -------------------
 # | IPG Configuration |
@@ -284,3 +547,17 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
 # Zibal merchant key loaded from environment variables
 ZIBAL_MERCHANT = os.getenv('ZIBAL_MERCHANT')
+# Zibal gateway base URL (point it at `manage.py fakezibal` for offline load tests)
+ZIBAL_GATEWAY = os.getenv('ZIBAL_GATEWAY', 'https://gateway.zibal.ir/')
+# Payment result tokens: 'signed' (stateless HMAC, no database row) or 'db' (PaymentToken rows)
+PAYMENT_TOKEN_MODE = os.getenv('PAYMENT_TOKEN_MODE', 'signed')
+# Payment result tokens expire (and PaymentToken rows get purged) after this long
+PAYMENT_TOKEN_MAX_AGE = timedelta(
+    seconds=int(os.getenv('PAYMENT_TOKEN_MAX_AGE', 60 * 60 * 24)))
+# Payment status streams (payEvents) re-read the status this often when no change was published
+# in this process (the callback may hit another worker), and end after PAYMENT_EVENTS_TIMEOUT
+PAYMENT_EVENTS_POLL_SECONDS = float(os.getenv('PAYMENT_EVENTS_POLL_SECONDS', 2))
+PAYMENT_EVENTS_TIMEOUT = int(os.getenv('PAYMENT_EVENTS_TIMEOUT', 60))
+# Under WSGI a stream holds a worker thread: it ends after the first change or this many seconds
+# and the client reconnects (the timeout still counts from its first connection)
+PAYMENT_EVENTS_LONGPOLL_SECONDS = float(os.getenv('PAYMENT_EVENTS_LONGPOLL_SECONDS', 10))
@@ -1,7 +1,10 @@
+import re
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from base.views.media_views import serveMedia
+from base.views.metrics_views import getMetrics
 
 # Define URL patterns for the project
 urlpatterns = [
@@ -19,8 +22,15 @@ urlpatterns = [
 
     # API endpoint for air-related operations
     path('api/v1/air/', include('base.urls.air_urls')),
+
+    # Prometheus metrics (staff only)
+    path('metrics', getMetrics, name='metrics'),
+]
+
+# Serve media files (handed to the front proxy or streamed, see MEDIA_SERVE_MODE)
+urlpatterns += [
+    re_path(rf'^{re.escape(settings.MEDIA_URL.lstrip("/"))}(?P<path>.*)$', serveMedia, name='media'),
 ]
 
-# Serve media files in development mode
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Serve static files in development mode
 urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
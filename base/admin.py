@@ -1,7 +1,7 @@
 from django.contrib import admin
 from .models import (
     Zibal, PaymentToken, Product,
-    Review, Order, OrderItem, ShippingAddress
+    Review, Order, OrderItem, ShippingAddress, EmailOutbox, AlertEvent
 )
 
 
@@ -32,9 +32,9 @@ class ZibalAdmin(admin.ModelAdmin):
 class PaymentTokenAdmin(admin.ModelAdmin):
     # Make the following fields read-only in the admin interface
     readonly_fields = (
-        'token',     # The unique payment token
-        'trackId',   # The track ID associated with the token
-        'orderId'    # The order ID associated with the payment
+        'token',        # The unique payment token
+        'transaction',  # The transaction associated with the token
+        'order'         # The order associated with the payment
     )
 
 
@@ -44,3 +44,5 @@ admin.site.register(Review)           # Register the Review model
 admin.site.register(Order)            # Register the Order model
 admin.site.register(OrderItem)        # Register the OrderItem model
 admin.site.register(ShippingAddress)  # Register the ShippingAddress model
+admin.site.register(EmailOutbox)      # Register the EmailOutbox model
+admin.site.register(AlertEvent)       # Register the AlertEvent model
@@ -0,0 +1,223 @@
+import asyncio
+import threading
+from collections import deque
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from base.instrumentation import metrics
+from base.strConst import ERROR_OVERLOADED
+
+# Route class of every gated URL name; other routes (admin, metrics, media) are never shed. The
+# payment status streams (payEvents) hold a slot of the "events" class while they run instead
+ROUTE_CLASSES = {
+    'getProducts': 'catalog',
+    'getProduct': 'catalog',
+    'addOrderItems': 'checkout',
+    'getMyOrders': 'checkout',
+    'getOrderById': 'checkout',
+    'payOrder': 'payment',
+    'inquiryPay': 'payment',
+    'zibalCallback': 'payment',
+    'token-obtain-pair': 'auth',
+    'token-refresh': 'auth',
+    'register': 'auth',
+    'verifyEmail': 'auth',
+    'users-profile': 'auth',
+    'user-profile-update': 'auth',
+    'users': 'auth',
+}
+
+
+# "limit/queue/wait" -> (requests handled at once, requests waiting for a slot, seconds one may wait)
+def parse_limit(spec: str) -> tuple[int, int, float]:
+    limit, queue, wait = spec.split('/')
+    return int(limit), int(queue), float(wait)
+
+
+# Route classes whose running and queued requests could take every thread of a WSGI worker
+# (a queued request blocks its thread): such a class starves the others instead of being shed
+def thread_budget_errors(limits: dict, threads: int) -> list:
+    errors = []
+    for name, spec in limits.items():
+        limit, queue, _ = parse_limit(spec)
+        if limit + queue >= threads:
+            errors.append(f'{name} ({spec}): {limit + queue} requests may hold all {threads} threads')
+    return errors
+
+
+# Concurrency limit of one route class: `limit` requests run, up to `queue` more wait in line
+# (first come, first served) for at most `wait` seconds, and the rest are turned away at once
+class Gate:
+    def __init__(self, name: str, limit: int, queue: int, wait: float):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiters = deque()  # Events of the waiting requests, a freed slot goes to the first
+        self.report()
+
+    # Take a slot, waiting in line if the class is full; False if the request must be shed
+    def acquire(self) -> bool:
+        waiter = threading.Event()
+        admitted = self.enter(waiter)
+        if admitted is not None:
+            return admitted
+        if waiter.wait(self.wait):
+            return True  # The releasing request handed its slot over
+        return self.leave(waiter) or self.reject()
+
+    # Same, waiting in the event loop (ASGI) instead of blocking a thread
+    async def aacquire(self) -> bool:
+        waiter = AsyncWaiter()
+        admitted = self.enter(waiter)
+        if admitted is not None:
+            return admitted
+        try:
+            await asyncio.wait_for(waiter.event.wait(), self.wait)
+            return True
+        except asyncio.TimeoutError:
+            return self.leave(waiter) or self.reject()
+        except asyncio.CancelledError:
+            # The client went away while waiting: give back a slot handed over meanwhile
+            if self.leave(waiter):
+                self.release()
+            raise
+
+    # Take a free slot (True), join the line with `waiter` (None) or refuse (False)
+    def enter(self, waiter) -> bool | None:
+        with self.lock:
+            if self.active < self.limit:
+                self.active += 1
+                self.report()
+                return True
+            if len(self.waiters) >= self.queue:
+                return self.reject()
+            self.waiters.append(waiter)
+            self.report()
+            return None
+
+    # Leave the line after waiting in vain; True if the slot was handed over meanwhile
+    def leave(self, waiter) -> bool:
+        with self.lock:
+            if waiter.is_set():
+                return True
+            self.waiters.remove(waiter)
+            self.report()
+            return False
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                # The slot passes straight to the first waiter: `active` does not change
+                self.waiters.popleft().set()
+            else:
+                self.active -= 1
+            self.report()
+
+    def reject(self) -> bool:
+        metrics.inc('admission_rejected_total', {'class': self.name})
+        return False
+
+    # Publish the occupancy (called with the lock held)
+    def report(self):
+        metrics.set('admission_in_flight', {'class': self.name}, self.active)
+        metrics.set('admission_queued', {'class': self.name}, len(self.waiters))
+
+    def occupancy(self) -> dict:
+        with self.lock:
+            return {'limit': self.limit, 'inFlight': self.active, 'queue': self.queue, 'queued': len(self.waiters)}
+
+
+# Waiter of a request queued in the event loop: the releasing thread hands the slot over
+# through the loop, like threading.Event.set() does for a blocked thread
+class AsyncWaiter:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.event = asyncio.Event()
+        self.handed_over = False
+
+    def set(self):
+        self.handed_over = True
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    def is_set(self) -> bool:
+        return self.handed_over
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+# Gate of a route class in this process, (re)built from ADMISSION_LIMITS
+def gate(name: str) -> Gate:
+    spec = parse_limit(settings.ADMISSION_LIMITS[name])
+    current = _gates.get(name)
+    if current is None or (current.limit, current.queue, current.wait) != spec:
+        with _gates_lock:
+            current = _gates.get(name)
+            if current is None or (current.limit, current.queue, current.wait) != spec:
+                current = _gates[name] = Gate(name, *spec)
+    return current
+
+
+# Current occupancy of every route class of this process
+def occupancy() -> dict:
+    return {name: gate(name).occupancy() for name in settings.ADMISSION_LIMITS}
+
+
+# Middleware shedding load per route class: when a dependency slows down (Zibal, SMTP), only
+# the classes waiting on it fill up and answer 503 + Retry-After, the others keep flowing
+class AdmissionControlMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        route_gate = self.gate(request)
+        if route_gate is None:
+            return self.get_response(request)
+        if not route_gate.acquire():
+            return self.overloaded()
+        try:
+            return self.get_response(request)
+        finally:
+            route_gate.release()
+
+    async def __acall__(self, request):
+        route_gate = self.gate(request)
+        if route_gate is None:
+            return await self.get_response(request)
+        if not await route_gate.aacquire():
+            return self.overloaded()
+        try:
+            return await self.get_response(request)
+        finally:
+            route_gate.release()
+
+    # Gate of the request's route class, None for requests that are never shed
+    def gate(self, request) -> Gate | None:
+        if not settings.ADMISSION_CONTROL:
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        name = ROUTE_CLASSES.get(match.url_name)
+        if name is None or name not in settings.ADMISSION_LIMITS:
+            return None
+        request.resolver_match = match  # Rejections are counted under their view
+        return gate(name)
+
+    def overloaded(self):
+        response = JsonResponse({'detail': ERROR_OVERLOADED}, status=503)
+        response['Retry-After'] = str(settings.ADMISSION_RETRY_AFTER)
+        return response
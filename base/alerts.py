@@ -0,0 +1,64 @@
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Min, Q, Sum
+from django.utils import timezone
+from base import mailqueue
+from base.models import AlertEvent
+from base.strConst import ADMIN_ALERT_RECIPIENTS, HTML_TEMPLATE_ALERT_DIGEST
+
+
+# Record an event for the next digest (ADMIN_ALERT_MODE = 'digest')
+def record(kind: str, object_id: int, amount=None):
+    AlertEvent.objects.create(kind=kind, objectId=object_id, amount=amount)
+    pending = AlertEvent.objects.filter(digest='').count()
+    if pending >= settings.ADMIN_ALERT_DIGEST_THRESHOLD:
+        # Let the mail worker send the digest instead of rendering it in this request
+        transaction.on_commit(mailqueue.mail_worker.wake)
+    else:
+        # The worker's periodic pass sends a smaller batch once its window has passed: it must be
+        # running even in a process that queues no other mail
+        transaction.on_commit(mailqueue.mail_worker.start)
+
+
+# Send a digest if enough events are pending or the oldest one waited a full window
+def flush_due() -> bool:
+    pending = AlertEvent.objects.filter(digest='').aggregate(count=Count('id'), oldest=Min('createdAt'))
+    if not pending['count']:
+        return False
+    window = timedelta(seconds=settings.ADMIN_ALERT_DIGEST_SECONDS)
+    if pending['count'] < settings.ADMIN_ALERT_DIGEST_THRESHOLD and pending['oldest'] > timezone.now() - window:
+        return False
+    return flush()
+
+
+# Claim every pending event and queue one summary email for them
+def flush() -> bool:
+    claim = uuid.uuid4().hex
+    with transaction.atomic():
+        # Conditional update: events claimed by another worker meanwhile no longer match
+        if not AlertEvent.objects.filter(digest='').update(digest=claim):
+            return False
+        events = AlertEvent.objects.filter(digest=claim)
+        orders = Q(kind=AlertEvent.NEW_ORDER)
+        stats = events.aggregate(
+            start=Min('createdAt'),
+            end=Max('createdAt'),
+            users=Count('id', filter=Q(kind=AlertEvent.NEW_USER)),
+            orders=Count('id', filter=orders),
+            total=Sum('amount', filter=orders),
+            average=Avg('amount', filter=orders),
+            largest=Max('amount', filter=orders),
+        )
+        mailqueue.enqueue(
+            f"E-SHOP | DIGEST | {stats['users']} NEW USERS, {stats['orders']} NEW ORDERS",  # Subject of the email
+            "",  # Plain text content (not provided in this case)
+            ADMIN_ALERT_RECIPIENTS,  # Recipient email(s)
+            html=HTML_TEMPLATE_ALERT_DIGEST(stats),  # HTML content of the email
+        )
+        events.delete()
+    return True
+
+
+mailqueue.periodic_tasks.append(flush_due)
@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+
+# User fields served from the cache; anything else is loaded from the database on access
+CACHED_USER_FIELDS = ('id', 'username', 'email', 'first_name', 'is_active', 'is_staff')
+
+
+# Cache key of a user resolved from a JWT
+def user_cache_key(user_id) -> str:
+    return f'auth:user:{user_id}'
+
+
+# Drop the cached copy of a user (called from the User post_save/post_delete signals)
+def invalidate_cached_user(user_id):
+    cache.delete(user_cache_key(user_id))
+
+
+# JWTAuthentication that resolves the token's user from a short-TTL cache instead of a query
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        # Revocation checks need the password hash, which is never cached
+        if user_id is None or api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+
+        key = user_cache_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            # Cache miss: load (and validate) the user as usual, then remember it
+            user = super().get_user(validated_token)
+            cache.set(key, {field: getattr(user, field) for field in CACHED_USER_FIELDS},
+                      settings.AUTH_USER_CACHE_TIMEOUT)
+            return user
+
+        if api_settings.CHECK_USER_IS_ACTIVE and not values['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # Build the user with only the cached fields loaded; other fields are deferred,
+        # so save() only writes the fields that were loaded or assigned
+        # (from_db() takes the values in model field order)
+        names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+        return User.from_db(router.db_for_read(User), names, [values[name] for name in names])
@@ -0,0 +1,2 @@
+# Synthetic datasets (data), requests for every route (routes) and an in-process load driver (driver);
+# run it with `manage.py benchmark`
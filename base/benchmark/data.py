@@ -0,0 +1,124 @@
+import random
+from datetime import datetime
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.utils import timezone
+from base.models import Product, Review, Order, OrderItem, ShippingAddress, Zibal
+from base.strConst import STATUS, PAID_AT, CARD_NO, REF_NO
+from base.zibal.fake_server import DATETIME_FORMAT
+
+# Dataset sizes: users, products, orders (each with `items` items), reviews
+SCALES = {
+    'tiny': {'users': 10, 'products': 10, 'orders': 20, 'items': 2, 'reviews': 10},
+    'small': {'users': 200, 'products': 100, 'orders': 1000, 'items': 3, 'reviews': 500},
+    'medium': {'users': 2000, 'products': 1000, 'orders': 20000, 'items': 3, 'reviews': 5000},
+    'large': {'users': 20000, 'products': 5000, 'orders': 200000, 'items': 4, 'reviews': 50000},
+}
+
+# Password of every generated user (hashed once, the hash is shared)
+PASSWORD = 'Bench-12345-word'
+ADMIN_EMAIL = 'admin@bench.test'
+BATCH_SIZE = 1000
+
+CATEGORIES = ('Electronics', 'Books', 'Home', 'Toys', 'Sports', 'Fashion')
+BRANDS = ('Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli')
+CITIES = ('Tehran', 'Mashhad', 'Isfahan', 'Shiraz', 'Tabriz')
+
+
+# Ids of the generated rows the benchmark routes pick their requests from
+class Dataset:
+    def __init__(self):
+        self.users = []  # User ids
+        self.emails = {}  # User id -> email (also the username)
+        self.admin = None  # Staff user id
+        self.products = []  # Product ids
+        self.orders = {}  # User id -> [order id, ...]
+        self.paid = []  # (order id, user id, trackId) of verified payments
+        self.pending = []  # (order id, user id, trackId) of payments waiting for their callback
+
+    def counts(self) -> dict:
+        return {
+            'users': len(self.users) + 1,
+            'products': len(self.products),
+            'orders': sum(len(orders) for orders in self.orders.values()),
+            'paidOrders': len(self.paid),
+            'pendingPayments': len(self.pending),
+        }
+
+
+# Insert a realistic dataset with bulk inserts; with a fake gateway `ledger`, pending payments
+# are registered there as paid-but-unverified so their callbacks verify successfully
+def generate(users: int, products: int, orders: int, items: int, reviews: int,
+             ledger=None, seed: int = 0) -> Dataset:
+    rng = random.Random(seed)
+    dataset = Dataset()
+    password = make_password(PASSWORD)
+
+    created = User.objects.bulk_create((
+        User(username=f'user{i}@bench.test', email=f'user{i}@bench.test', first_name=f'User {i}',
+             password=password, is_active=True)
+        for i in range(users)), batch_size=BATCH_SIZE)
+    dataset.users = [user.id for user in created]
+    dataset.emails = {user.id: user.email for user in created}
+    dataset.admin = User.objects.create(username=ADMIN_EMAIL, email=ADMIN_EMAIL, first_name='Admin',
+                                        password=password, is_staff=True, is_superuser=True).id
+
+    created = Product.objects.bulk_create((
+        Product(name=f'Product {i}', brand=rng.choice(BRANDS), category=rng.choice(CATEGORIES),
+                description=f'Description of product {i}. ' * 5, image='products/sample.jpg',
+                price=Decimal(rng.randint(100, 100000)) / 100, countInStock=10 ** 6,
+                rating=Decimal(rng.randint(100, 500)) / 100, numReviews=0)
+        for i in range(products)), batch_size=BATCH_SIZE)
+    dataset.products = [product._id for product in created]
+
+    Review.objects.bulk_create((
+        Review(product_id=rng.choice(dataset.products), user_id=rng.choice(dataset.users),
+               name='Reviewer', rating=rng.randint(1, 5), comment='Generated review.')
+        for _ in range(reviews)), batch_size=BATCH_SIZE)
+
+    owners = [rng.choice(dataset.users) for _ in range(orders)]
+    now = timezone.now()
+    created = Order.objects.bulk_create((
+        Order(user_id=owner, paymentMethod='Zibal', taxPrice=0, shippingPrice=0,
+              totalPrice=Decimal(rng.randint(1000, 100000)), isPaid=i % 2 == 0, paidAt=now if i % 2 == 0 else None)
+        for i, owner in enumerate(owners)), batch_size=BATCH_SIZE)
+
+    ShippingAddress.objects.bulk_create((
+        ShippingAddress(order=order, address=f'Street {order._id}', city=rng.choice(CITIES),
+                        country='Iran', postalCode=f'{order._id:010d}')
+        for order in created), batch_size=BATCH_SIZE)
+
+    OrderItem.objects.bulk_create((
+        OrderItem(order=order, product_id=product, name=f'Product {product}', qty=rng.randint(1, 3),
+                  price=Decimal(rng.randint(100, 100000)) / 100, image='/media/products/sample.jpg')
+        for order in created for product in rng.sample(dataset.products, min(items, len(dataset.products)))),
+        batch_size=BATCH_SIZE)
+
+    transactions = []
+    for i, order in enumerate(created):
+        dataset.orders.setdefault(order.user_id, []).append(order._id)
+        amount = int(order.totalPrice * 10)
+        if ledger is not None:
+            trackId = ledger.create(amount, str(order._id), '', None)
+        else:
+            trackId = 10 ** 9 + i
+        if order.isPaid:
+            transactions.append(Zibal(trackId=trackId, lastStatus=1, refNumber=rng.randint(10 ** 9, 10 ** 10 - 1),
+                                      amountCreated=amount, amountPaid=amount, paidAt=now, verifiedAt=now,
+                                      order=order, user_id=order.user_id))
+            dataset.paid.append((order._id, order.user_id, trackId))
+        else:
+            transactions.append(Zibal(trackId=trackId, lastStatus=0, amountCreated=amount,
+                                      order=order, user_id=order.user_id))
+            dataset.pending.append((order._id, order.user_id, trackId))
+        if ledger is not None:
+            # Paid on the payment page, verified by the callback
+            ledger.get(trackId).update({
+                STATUS: 1 if order.isPaid else 2,
+                PAID_AT: datetime.now().strftime(DATETIME_FORMAT),
+                CARD_NO: '603799******1234',
+                REF_NO: transactions[-1].refNumber or rng.randint(10 ** 9, 10 ** 10 - 1),
+            })
+    Zibal.objects.bulk_create(transactions, batch_size=BATCH_SIZE)
+    return dataset
@@ -0,0 +1,228 @@
+import asyncio
+import io
+import re
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from unittest import mock
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from base.zibal import server_apis, zibal_apis
+from base.zibal.fake_server import FakeZibalServer
+from .routes import ROUTES, BenchRequest, RouteContext
+
+# Query count reported by MetricsMiddleware in the Server-Timing header
+SERVER_TIMING_QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+HOST = 'testserver'
+
+
+# Percentile of an already sorted list of numbers
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+# Serve the Zibal API from an in-process fake gateway for the duration of the block
+# (without ZIBAL_MERCHANT, the gateway's sandbox merchant "zibal" is used)
+@contextmanager
+def fake_gateway():
+    server = FakeZibalServer(('127.0.0.1', 0))
+    server.start_in_thread()
+    try:
+        with mock.patch.object(server_apis, 'ZIBAL_DOMAIN_IPG', f'{server.url}v1/'), \
+                mock.patch.object(zibal_apis.server_apis, 'merchant', zibal_apis.server_apis.merchant or 'zibal'):
+            yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Run the block against a throwaway on-disk database (with the given SQLite connection `options`,
+# default: the configured ones) and the fake gateway, with settings fit for driving the app directly
+@contextmanager
+def benchmark_environment(options: dict = None):
+    with tempfile.TemporaryDirectory() as directory:
+        # On disk (not in memory) so concurrent clients use real SQLite locking
+        database = connections['default'].settings_dict
+        database['TEST']['NAME'] = f'{directory}/benchmark.sqlite3'
+        if options is not None:
+            database['OPTIONS'] = options
+        environment = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, HOST],
+            BACKEND_DOMAIN=settings.BACKEND_DOMAIN or f'http://{HOST}',  # Callback URL sent to the gateway
+            SERVER_TIMING=True,  # Query counts are read from the Server-Timing header
+            EMAIL_QUEUE_WORKER='off',
+            ADMISSION_CONTROL=False,  # Measure the app, not load shedding
+            THROTTLE_DB_PATH=f'{directory}/throttle.sqlite3',
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                            'DEFAULT_THROTTLE_RATES': {'auth_ip': '1000000/min', 'auth_account': '1000000/min'}},
+        )
+        with environment, fake_gateway() as gateway:
+            databases = setup_databases(verbosity=0, interactive=False)
+            try:
+                yield gateway
+            finally:
+                teardown_databases(databases, verbosity=0)
+
+
+# Send a request straight through the WSGI handler: (status, headers)
+def call_wsgi(handler: WSGIHandler, request: BenchRequest) -> tuple:
+    path, _, query = request.path.partition('?')
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_LENGTH': str(len(request.body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(request.body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace('-', '_')
+        environ[key if key == 'CONTENT_TYPE' else f'HTTP_{key}'] = value
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = dict(headers)
+
+    body = handler(environ, start_response)
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return started['status'], started['headers']
+
+
+# Send a request straight through the ASGI handler: (status, headers)
+async def call_asgi(handler: ASGIHandler, request: BenchRequest) -> tuple:
+    path, _, query = request.path.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': request.method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [(b'host', HOST.encode()), (b'content-length', str(len(request.body)).encode())] + [
+            (name.lower().encode(), value.encode()) for name, value in request.headers.items()],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+    messages = [{'type': 'http.request', 'body': request.body, 'more_body': False}]
+    started = {}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()  # The client never disconnects (cancelled once the response is sent)
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            started['status'] = message['status']
+            started['headers'] = {name.decode(): value.decode() for name, value in message['headers']}
+
+    await handler(scope, receive, send)
+    return started['status'], started['headers']
+
+
+# Latency, status and query count of one request
+def sample(status: int, headers: dict, latency: float) -> tuple:
+    match = SERVER_TIMING_QUERIES.search(headers.get('Server-Timing', ''))
+    return status, latency, int(match.group(1)) if match else None
+
+
+def run_wsgi(requests: list, concurrency: int) -> tuple:
+    handler = WSGIHandler()
+
+    def send(request):
+        start = time.perf_counter()
+        status, headers = call_wsgi(handler, request)
+        return sample(status, headers, time.perf_counter() - start)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(send, requests))
+    return samples, time.perf_counter() - started
+
+
+def run_asgi(requests: list, concurrency: int) -> tuple:
+    handler = ASGIHandler()
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(request):
+            async with semaphore:
+                start = time.perf_counter()
+                status, headers = await call_asgi(handler, request)
+                return sample(status, headers, time.perf_counter() - start)
+
+        return await asyncio.gather(*(send(request) for request in requests))
+
+    started = time.perf_counter()
+    samples = asyncio.run(main())
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples: list, elapsed: float) -> dict:
+    latencies = sorted(latency for _, latency, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+    statuses = Counter(status for status, _, _ in samples)
+    return {
+        'requests': len(samples),
+        'elapsedSeconds': round(elapsed, 3),
+        'throughput': round(len(samples) / elapsed, 2) if elapsed else 0,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+        'errors': sum(count for code, count in statuses.items() if code >= 500),
+        'latencyMs': {
+            'mean': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0,
+            'p50': round(percentile(latencies, 50) * 1000, 2),
+            'p95': round(percentile(latencies, 95) * 1000, 2),
+            'p99': round(percentile(latencies, 99) * 1000, 2),
+            'max': round(latencies[-1] * 1000, 2) if latencies else 0,
+        },
+        'queriesPerRequest': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+    }
+
+
+# Drive each route with `requests` requests from `concurrency` clients (after `warmup` unmeasured
+# requests) through the in-process WSGI or ASGI app; returns the per-route report
+def run_routes(context: RouteContext, routes: list, interface: str = 'wsgi', concurrency: int = 8,
+               requests: int = 200, warmup: int = 5) -> dict:
+    run = run_asgi if interface == 'asgi' else run_wsgi
+    report = {}
+    for name in routes:
+        build = ROUTES[name]
+        if warmup:
+            run([build(context) for _ in range(warmup)], concurrency)
+        # Requests are built up front: minting tokens is not part of the measurement
+        samples, elapsed = run([build(context) for _ in range(requests)], concurrency)
+        report[name] = summarize(samples, elapsed)
+    return report
@@ -0,0 +1,165 @@
+import itertools
+import json
+import random
+import threading
+from urllib.parse import urlencode
+from django.contrib.auth.models import User
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from base.models import Zibal
+from base.utils import createActivationToken
+from base.zibal import zibal_apis
+from .data import PASSWORD, Dataset
+
+SHIPPING_ADDRESS = {'address': 'Benchmark street', 'city': 'Tehran', 'country': 'Iran', 'postalCode': '0000000000'}
+
+
+# One request to send: method, path (with query string), JSON body and headers
+class BenchRequest:
+    def __init__(self, method: str, path: str, body: dict = None, token: str = None):
+        self.method = method
+        self.path = path
+        self.body = json.dumps(body).encode() if body is not None else b''
+        self.headers = {'Content-Type': 'application/json'}
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+
+
+# Picks the rows each request is about; building a request may touch the database
+# (minting tokens), which is never part of the measured time
+class RouteContext:
+    def __init__(self, dataset: Dataset, seed: int = 0):
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.tokens = {}
+        self.customers = [user for user in dataset.users if user in dataset.orders]
+
+    def choice(self, values):
+        with self.lock:
+            return self.rng.choice(values)
+
+    # Access token of a user (minted once, valid for ACCESS_TOKEN_LIFETIME)
+    def token(self, user_id: int) -> str:
+        if user_id not in self.tokens:
+            self.tokens[user_id] = str(AccessToken.for_user(User.objects.get(id=user_id)))
+        return self.tokens[user_id]
+
+
+def get_products(context):
+    return BenchRequest('GET', reverse('getProducts'))
+
+
+def get_product(context):
+    return BenchRequest('GET', reverse('getProduct', args=[context.choice(context.dataset.products)]))
+
+
+def login(context):
+    user = context.choice(context.dataset.users)
+    return BenchRequest('POST', reverse('token-obtain-pair'),
+                        {'username': context.dataset.emails[user], 'password': PASSWORD})
+
+
+# Refresh tokens rotate (and are blacklisted) on use, so every request gets a new one
+def refresh_token(context):
+    user = User.objects.get(id=context.choice(context.dataset.users))
+    return BenchRequest('POST', reverse('token-refresh'), {'refresh': str(RefreshToken.for_user(user))})
+
+
+def get_user_profile(context):
+    return BenchRequest('GET', reverse('users-profile'), token=context.token(context.choice(context.dataset.users)))
+
+
+def update_user_profile(context):
+    user = context.choice(context.dataset.users)
+    body = {'name': 'Benchmark user', 'email': context.dataset.emails[user], 'password': ''}
+    return BenchRequest('PUT', reverse('user-profile-update'), body, context.token(user))
+
+
+def get_users(context):
+    return BenchRequest('GET', reverse('users'), token=context.token(context.dataset.admin))
+
+
+def register(context):
+    email = f'new{next(context.sequence)}-{context.rng.getrandbits(32):08x}@bench.test'
+    return BenchRequest('POST', reverse('register'), {'name': 'New user', 'email': email, 'password': PASSWORD})
+
+
+def verify_email(context):
+    user = User(id=context.choice(context.dataset.users))
+    return BenchRequest('GET', reverse('verifyEmail', args=[createActivationToken(user)]))
+
+
+def add_order_items(context):
+    products = context.dataset.products
+    with context.lock:
+        items = context.rng.sample(products, min(3, len(products)))
+    body = {
+        'orderItems': [{'product': product, 'qty': 1, 'price': '10.00'} for product in items],
+        'paymentMethod': 'Zibal',
+        'shippingAddress': SHIPPING_ADDRESS,
+        'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 1000,
+    }
+    return BenchRequest('POST', reverse('addOrderItems'), body, context.token(context.choice(context.dataset.users)))
+
+
+def get_my_orders(context):
+    return BenchRequest('GET', reverse('getMyOrders'), token=context.token(context.choice(context.customers)))
+
+
+def get_order_by_id(context):
+    user = context.choice(context.customers)
+    order = context.choice(context.dataset.orders[user])
+    return BenchRequest('GET', reverse('getOrderById', args=[order]), token=context.token(user))
+
+
+def pay_order(context):
+    order, user, _ = context.choice(context.dataset.pending)
+    return BenchRequest('GET', reverse('payOrder', args=[order]), token=context.token(user))
+
+
+def inquiry_pay(context):
+    order, user, trackId = context.choice(context.dataset.paid + context.dataset.pending)
+    transaction = Zibal.objects.select_related('order').get(trackId=trackId)
+    token = zibal_apis.database_apis.generate_payment_token(transaction.order, transaction)
+    return BenchRequest('GET', reverse('inquiryPay', args=[token]), token=context.token(user))
+
+
+# Streams of settled payments send their status and end at once
+def pay_events(context):
+    order, user, trackId = context.choice(context.dataset.paid)
+    transaction = Zibal.objects.select_related('order').get(trackId=trackId)
+    token = zibal_apis.database_apis.generate_payment_token(transaction.order, transaction)
+    request = BenchRequest('GET', reverse('payEvents', args=[token]), token=context.token(user))
+    request.headers['Accept'] = 'text/event-stream'
+    return request
+
+
+# Gateway redirects after payment; repeated callbacks for one transaction are answered
+# "already verified" by the gateway, as in production
+def zibal_callback(context):
+    order, _, trackId = context.choice(context.dataset.pending)
+    query = urlencode({'success': 1, 'trackId': trackId, 'orderId': order, 'status': 2})
+    return BenchRequest('GET', f'{reverse("zibalCallback")}?{query}')
+
+
+# Every route of base/urls, by URL name
+ROUTES = {
+    'getProducts': get_products,
+    'getProduct': get_product,
+    'token-obtain-pair': login,
+    'token-refresh': refresh_token,
+    'users-profile': get_user_profile,
+    'user-profile-update': update_user_profile,
+    'users': get_users,
+    'register': register,
+    'verifyEmail': verify_email,
+    'addOrderItems': add_order_items,
+    'getMyOrders': get_my_orders,
+    'getOrderById': get_order_by_id,
+    'payOrder': pay_order,
+    'inquiryPay': inquiry_pay,
+    'payEvents': pay_events,
+    'zibalCallback': zibal_callback,
+}
@@ -0,0 +1,171 @@
+import multiprocessing
+import random
+import time
+from urllib.parse import urlencode
+from django.db import connections
+from django.db.models import Q
+from django.urls import reverse
+from base.models import Product, Order, OrderItem, Zibal
+from base.zibal import zibal_apis
+from .driver import run_wsgi, summarize
+from .routes import SHIPPING_ADDRESS, BenchRequest, RouteContext
+
+# A concurrency level "scales" while it adds at least this much throughput to the previous one
+SCALING_GAIN = 1.1
+
+
+def _client_process(requests: list, barrier, results):
+    barrier.wait()  # Every client process starts firing at the same moment
+    started = time.time()
+    try:
+        samples, _ = run_wsgi(requests, 1)
+    finally:
+        connections.close_all()
+    results.put((samples, started, time.time()))
+
+
+# Send the requests from `clients` forked processes at once (one client per process); the
+# gateway and the database stay shared, each process opens its own connections
+def run_processes(requests: list, clients: int) -> tuple:
+    context = multiprocessing.get_context('fork')
+    chunks = [chunk for chunk in (requests[i::clients] for i in range(clients)) if chunk]
+    barrier = context.Barrier(len(chunks))
+    results = context.Queue()
+    connections.close_all()  # Never share a connection with a child
+    processes = [context.Process(target=_client_process, args=(chunk, barrier, results)) for chunk in chunks]
+    for process in processes:
+        process.start()
+    samples, starts, ends = [], [], []
+    for _ in processes:
+        chunk_samples, started, ended = results.get()
+        samples += chunk_samples
+        starts.append(started)
+        ends.append(ended)
+    for process in processes:
+        process.join()
+    return samples, max(ends) - min(starts)
+
+
+# Send the requests from `clients` concurrent threads or processes: (samples, elapsed seconds)
+def fire(requests: list, clients: int, mode: str = 'threads') -> tuple:
+    if mode == 'processes':
+        return run_processes(requests, clients)
+    return run_wsgi(requests, clients)
+
+
+def checkout_request(context: RouteContext, product: int, qty: int = 1) -> BenchRequest:
+    body = {
+        'orderItems': [{'product': product, 'qty': qty, 'price': '10.00'}],
+        'paymentMethod': 'Zibal',
+        'shippingAddress': SHIPPING_ADDRESS,
+        'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 1000,
+    }
+    return BenchRequest('POST', reverse('addOrderItems'), body, context.token(context.choice(context.dataset.users)))
+
+
+# `clients` simultaneous checkouts of one unit of a product with only `stock` units left:
+# exactly min(clients, stock) succeed, the others are refused, and stock never goes negative
+def checkout_storm(context: RouteContext, clients: int, stock: int, mode: str = 'threads') -> dict:
+    product = context.choice(context.dataset.products)
+    Product.objects.filter(_id=product).update(countInStock=stock)
+    items_before = OrderItem.objects.filter(product_id=product).count()
+
+    samples, elapsed = fire([checkout_request(context, product) for _ in range(clients)], clients, mode)
+    sold = sum(status == 200 for status, _, _ in samples)
+    left = Product.objects.get(_id=product).countInStock
+    items = OrderItem.objects.filter(product_id=product).count() - items_before
+
+    violations = []
+    if left < 0:
+        violations.append(f'product {product}: negative stock {left}')
+    if sold != min(clients, stock):
+        violations.append(f'product {product}: {sold} checkouts succeeded, expected {min(clients, stock)}')
+    if left != stock - sold:
+        violations.append(f'product {product}: stock {left} after selling {sold} of {stock}')
+    if items != sold:
+        violations.append(f'product {product}: {items} order items for {sold} successful checkouts')
+    refused = [status for status, _, _ in samples if status != 200]
+    if any(status != 400 for status in refused):
+        violations.append(f'product {product}: checkouts failed with {sorted(set(refused))} instead of 400')
+    return {'scenario': 'checkoutStorm', 'mode': mode, 'clients': clients, 'stock': stock,
+            'sold': sold, **summarize(samples, elapsed), 'violations': violations}
+
+
+def callback_request(order: int, trackId: int) -> BenchRequest:
+    query = urlencode({'success': 1, 'trackId': trackId, 'orderId': order, 'status': 2})
+    return BenchRequest('GET', f'{reverse("zibalCallback")}?{query}')
+
+
+def inquiry_request(context: RouteContext, user: int, trackId: int) -> BenchRequest:
+    transaction = Zibal.objects.select_related('order').get(trackId=trackId)
+    token = zibal_apis.database_apis.generate_payment_token(transaction.order, transaction)
+    return BenchRequest('GET', reverse('inquiryPay', args=[token]), token=context.token(user))
+
+
+# `duplicates` simultaneous callbacks and as many inquiryPay calls for each of `transactions`
+# payments awaiting their callback: each is verified with the gateway exactly once and ends paid
+def callback_storm(context: RouteContext, ledger, transactions: int, duplicates: int,
+                   mode: str = 'threads') -> dict:
+    payments = [context.dataset.pending.pop() for _ in range(min(transactions, len(context.dataset.pending)))]
+    requests = []
+    for order, user, trackId in payments:
+        requests += [callback_request(order, trackId) for _ in range(duplicates)]
+        requests += [inquiry_request(context, user, trackId) for _ in range(duplicates)]
+    random.Random(len(requests)).shuffle(requests)
+
+    samples, elapsed = fire(requests, min(len(requests), duplicates * 2), mode)
+
+    violations = []
+    for order, _, trackId in payments:
+        verifies = ledger.get(trackId)['verifyCount']
+        if verifies != 1:
+            violations.append(f'transaction {trackId}: verified {verifies} times')
+        transaction = Zibal.objects.select_related('order').get(trackId=trackId)
+        if transaction.lastStatus != 1 or not transaction.refNumber:
+            violations.append(f'transaction {trackId}: status {transaction.lastStatus}, '
+                              f'reference {transaction.refNumber} after a verified payment')
+        if not transaction.order.isPaid or transaction.order.paidAt is None:
+            violations.append(f'order {order}: not paid after a verified payment')
+    errors = [status for status, _, _ in samples if status >= 500]
+    if errors:
+        violations.append(f'{len(errors)} callback/inquiry requests failed with {sorted(set(errors))}')
+    return {'scenario': 'callbackStorm', 'mode': mode, 'transactions': len(payments), 'duplicates': duplicates,
+            **summarize(samples, elapsed), 'violations': violations}
+
+
+# Database-wide invariants: no negative stock, and an order is paid exactly when one of its
+# transactions recorded a payment
+def check_invariants() -> list:
+    violations = [f'product {product}: negative stock {stock}' for product, stock in
+                  Product.objects.filter(countInStock__lt=0).values_list('_id', 'countInStock')]
+    paid = set(Zibal.objects.filter(paidAt__isnull=False).values_list('order_id', flat=True))
+    inconsistent = Order.objects.filter(Q(isPaid=True) & ~Q(_id__in=paid) | Q(isPaid=False) & Q(_id__in=paid))
+    violations += [f'order {order}: isPaid={isPaid} disagrees with its transactions'
+                   for order, isPaid in inconsistent.values_list('_id', 'isPaid')]
+    return violations
+
+
+# Checkout throughput at growing concurrency levels (plenty of stock, `per_client` checkouts each):
+# where throughput stops growing, or requests start failing, is where SQLite lock contention sets in
+def contention_ramp(context: RouteContext, levels: list, per_client: int, mode: str = 'threads') -> dict:
+    product = context.choice(context.dataset.products)
+    Product.objects.filter(_id=product).update(countInStock=10 ** 9)
+    results = []
+    for clients in levels:
+        requests = [checkout_request(context, product) for _ in range(clients * per_client)]
+        samples, elapsed = fire(requests, clients, mode)
+        summary = summarize(samples, elapsed)
+        results.append({'clients': clients, 'throughput': summary['throughput'],
+                        'p95Ms': summary['latencyMs']['p95'], 'errors': summary['errors']})
+
+    # Last level that still scaled without errors
+    best = results[0]
+    for previous, result in zip(results, results[1:]):
+        if result['errors'] or result['throughput'] < previous['throughput'] * SCALING_GAIN:
+            break
+        best = result
+    first_errors = next((result['clients'] for result in results if result['errors']), None)
+    return {'scenario': 'contentionRamp', 'mode': mode, 'perClient': per_client, 'levels': results,
+            'scalesUpToClients': best['clients'], 'throughputBeforeContention': best['throughput'],
+            'peakThroughput': max(result['throughput'] for result in results),
+            'firstErrorsAtClients': first_errors}
@@ -0,0 +1,141 @@
+import hashlib
+import math
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from base import mailqueue
+
+
+# Compact probabilistic set: no false negatives, tunable false-positive rate
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        # Optimal bit count and hash count for `capacity` items at `error_rate`
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    # Bit positions of an item (double hashing over one 128-bit digest)
+    def positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self.positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(item))
+
+
+# Per-process filter of blacklisted refresh-token JTIs, kept in sync with the database
+class BlacklistFilter:
+    def __init__(self):
+        self.lock = threading.Lock()  # Guards swaps and additions only, never held across a query
+        self.refreshing = threading.Lock()  # One thread reads the database at a time
+        self.bloom = None  # Built on first use, then only ever replaced by a complete filter
+        self.last_id = 0  # Highest BlacklistedToken.id already in the filter
+        self.added = None  # JTIs added while a rebuild is reading, replayed into the new filter
+        self.synced_at = 0.0
+        self.pruned_at = time.monotonic()
+
+    # False means "certainly not blacklisted"; True means "ask the database"
+    def might_contain(self, jti: str) -> bool:
+        self.sync()
+        return jti in self.bloom
+
+    # Record a JTI blacklisted by this process
+    def add(self, jti: str):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+            if self.added is not None:
+                self.added.append(jti)
+
+    # Pull rows blacklisted by other processes since the last sync; while another thread is
+    # already reading, readers go on with the current filter instead of waiting for it
+    def sync(self, force: bool = False):
+        now = time.monotonic()
+        if not force and self.bloom is not None and now - self.synced_at < settings.JWT_BLACKLIST_SYNC_SECONDS:
+            return
+        # Only the very first build is waited for: there is no filter to answer with before it
+        if not self.refreshing.acquire(blocking=self.bloom is None or force):
+            return
+        try:
+            if self.bloom is None:
+                self.rebuild()
+            else:
+                self.load(BlacklistedToken.objects.filter(id__gt=self.last_id))
+            self.synced_at = now
+        finally:
+            self.refreshing.release()
+
+    # Start over from the database (first use, after pruning, or when the filter fills up); the
+    # new filter is filled aside and swapped in whole, so readers never see a partial one
+    def rebuild(self):
+        with self.lock:
+            self.added = []
+        count = BlacklistedToken.objects.count()
+        capacity = max(settings.JWT_BLACKLIST_FILTER_CAPACITY, count * 2)
+        bloom = BloomFilter(capacity, settings.JWT_BLACKLIST_FILTER_ERROR_RATE)
+        last_id = self.fill(bloom, BlacklistedToken.objects.all())
+        with self.lock:
+            for jti in self.added:
+                bloom.add(jti)
+            self.bloom, self.last_id, self.added = bloom, last_id or 0, None
+
+    # Add new rows to the live filter (adding only sets bits: a reader never loses a JTI)
+    def load(self, queryset):
+        rows = list(queryset.order_by('id').values_list('id', 'token__jti'))
+        if not rows:
+            return
+        with self.lock:
+            for _, jti in rows:
+                self.bloom.add(jti)
+            self.last_id = rows[-1][0]
+            full = self.bloom.count > self.bloom.capacity
+        if full:
+            self.rebuild()
+
+    # Add the JTIs of the rows to a filter; the highest row id added, None when there were none
+    @staticmethod
+    def fill(bloom: BloomFilter, queryset):
+        last_id = None
+        for last_id, jti in queryset.order_by('id').values_list('id', 'token__jti').iterator():
+            bloom.add(jti)
+        return last_id
+
+    # Delete expired outstanding tokens (their blacklist rows cascade) and rebuild the filter without them
+    def prune(self):
+        OutstandingToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        with self.refreshing:
+            self.rebuild()
+
+    # Prune once every JWT_BLACKLIST_PRUNE_SECONDS (run by the mail worker, off the request path)
+    def prune_due(self) -> bool:
+        now = time.monotonic()
+        if now - self.pruned_at < settings.JWT_BLACKLIST_PRUNE_SECONDS:
+            return False
+        self.pruned_at = now
+        self.prune()
+        return True
+
+
+blacklist_filter = BlacklistFilter()
+mailqueue.periodic_tasks.append(blacklist_filter.prune_due)
+
+
+# RefreshToken that only queries the blacklist when the filter can't rule the JTI out
+class FilteredRefreshToken(RefreshToken):
+
+    def check_blacklist(self):
+        if blacklist_filter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
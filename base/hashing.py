@@ -0,0 +1,67 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth.hashers import make_password, verify_password
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from base.strConst import ERROR_PASSWORD_POOL_BUSY
+
+
+# Raised when the password pool already has as much work as it may queue (503 + Retry-After)
+class PasswordPoolBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = ERROR_PASSWORD_POOL_BUSY
+    default_code = 'password_pool_busy'
+    wait = 1  # Seconds sent as Retry-After
+
+
+# Thread pool that refuses work instead of queueing without limit
+class BoundedExecutor:
+    def __init__(self, max_workers: int, queue_size: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password')
+        # One slot per running or queued job
+        self.slots = threading.BoundedSemaphore(max_workers + queue_size)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.slots.acquire(blocking=False):
+            raise PasswordPoolBusy()
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    # Await fn(*args) from the event loop without blocking it
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# Process-wide pool for PBKDF2 work, created on first use from PASSWORD_HASH_WORKERS/QUEUE
+def password_executor() -> BoundedExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = BoundedExecutor(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE)
+    return _executor
+
+
+# make_password() run in the password pool
+async def amake_password(password: str) -> str:
+    return await password_executor().run(make_password, password)
+
+
+# Check a password in the password pool; the stored hash is upgraded when the hasher asks for it
+async def acheck_password(user, password: str) -> bool:
+    is_correct, must_update = await password_executor().run(verify_password, password, user.password)
+    if is_correct and must_update:
+        user.password = await amake_password(password)
+        await user.asave(update_fields=['password'])
+    return is_correct
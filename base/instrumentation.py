@@ -0,0 +1,359 @@
+import cProfile
+import glob
+import json
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.renderers import JSONRenderer
+from base.authentication import CachedJWTAuthentication
+from base.tracing import span
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the queries-per-request histogram buckets
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# Exported metrics: name -> (type, help)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests by view, method and status code.'),
+    'http_request_duration_seconds': ('histogram', 'Request latency by view.'),
+    'db_queries_total': ('counter', 'ORM queries by view.'),
+    'db_query_duration_seconds_total': ('counter', 'Time spent in ORM queries by view.'),
+    'db_queries_per_request': ('histogram', 'ORM queries per request by view.'),
+    'outbound_call_duration_seconds': ('histogram', 'Latency of calls to Zibal and SMTP.'),
+    'outbound_call_errors_total': ('counter', 'Failed calls to Zibal and SMTP.'),
+    'admission_in_flight': ('gauge', 'Requests being handled by route class.'),
+    'admission_queued': ('gauge', 'Requests waiting for a slot by route class.'),
+    'admission_rejected_total': ('counter', 'Requests shed with 503 by route class.'),
+}
+
+
+# Per-process metrics; with METRICS_DIR set, every process writes its snapshot to
+# METRICS_DIR/<pid>.json and the endpoint adds the snapshots of all workers together
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.gauges = {}  # (name, labels) -> current value
+        self.buckets = {}  # histogram name -> bucket bounds
+        self.flushed_at = 0.0
+
+    def inc(self, name: str, labels: dict, amount: float = 1.0):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0.0) + amount
+
+    def set(self, name: str, labels: dict, value: float):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name: str, labels: dict, value: float, buckets: tuple = LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.buckets[name] = buckets
+            values = self.histograms.setdefault(key, [0] * (len(buckets) + 1) + [0.0])
+            values[bisect_left(buckets, value)] += 1
+            values[-1] += value
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self.gauges.items()],
+                'buckets': dict(self.buckets),
+            }
+
+    # Write this process's snapshot (at most every METRICS_FLUSH_SECONDS unless forced)
+    def flush(self, force: bool = False):
+        directory = settings.METRICS_DIR
+        now = time.monotonic()
+        if not directory or (not force and now - self.flushed_at < settings.METRICS_FLUSH_SECONDS):
+            return
+        self.flushed_at = now
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{os.getpid()}.json')
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(f'{path}.tmp', path)
+
+
+metrics = MetricsRegistry()
+
+
+# Delete the snapshots in METRICS_DIR (at server start: workers of a previous run are gone)
+def clear_snapshots():
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json*')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Snapshot of all workers (or of this process when METRICS_DIR is not set)
+def collect() -> dict:
+    if not settings.METRICS_DIR:
+        return metrics.snapshot()
+    metrics.flush(force=True)
+    counters, histograms, gauges, buckets = {}, {}, {}, {}
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        try:
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError):
+            continue  # Being replaced by its worker
+        buckets.update(snapshot['buckets'])
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0.0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            histograms[key] = [a + b for a, b in zip(total, values)]
+        # Gauges of all workers add up too (e.g. requests in flight on the whole server)
+        for name, labels, value in snapshot.get('gauges', []):
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0.0) + value
+    return {
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+        'gauges': [[name, labels, value] for (name, labels), value in gauges.items()],
+        'buckets': buckets,
+    }
+
+
+def format_labels(labels, extra: tuple = ()) -> str:
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+# Prometheus text exposition format (version 0.0.4)
+def render(snapshot: dict) -> str:
+    series = {}
+    for name, labels, value in sorted(snapshot['counters'], key=str):
+        series.setdefault(name, []).append(f'{name}{format_labels(labels)} {value}')
+    for name, labels, value in sorted(snapshot.get('gauges', []), key=str):
+        series.setdefault(name, []).append(f'{name}{format_labels(labels)} {value}')
+    for name, labels, values in sorted(snapshot['histograms'], key=str):
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip([*snapshot['buckets'][name], '+Inf'], values[:-1]):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels, (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {values[-1]}')
+        lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    output = []
+    for name, lines in sorted(series.items()):
+        kind, help_text = METRICS[name]
+        output += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', *lines]
+    return '\n'.join(output) + '\n'
+
+
+# Server-Timing categories of the outbound services
+SERVICE_TIMINGS = {'zibal': 'gateway', 'smtp': 'email'}
+# Server-Timing categories, in header order
+TIMING_CATEGORIES = ('db', 'serialization', 'gateway', 'email')
+
+
+# Time spent per Server-Timing category during one request
+class RequestTimings:
+    def __init__(self):
+        self.durations = defaultdict(float)
+        self.active = set()  # Categories being timed (nested sections are not counted twice)
+
+    def header(self, total: float, queries: int) -> str:
+        parts = [f'{category};dur={self.durations[category] * 1000:.1f}' for category in TIMING_CATEGORIES]
+        parts[0] = f'db;desc="{queries} queries";dur={self.durations["db"] * 1000:.1f}'
+        return ', '.join([*parts, f'total;dur={total * 1000:.1f}'])
+
+
+_request_timings: ContextVar[RequestTimings | None] = ContextVar('request_timings', default=None)
+
+
+# Add the time spent in the block to the current request's Server-Timing category
+@contextmanager
+def timing(category: str):
+    timings = _request_timings.get()
+    if timings is None or category in timings.active:
+        # Outside a request, or inside a section of the same category
+        yield
+        return
+    timings.active.add(category)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.active.discard(category)
+        timings.durations[category] += time.perf_counter() - start
+
+
+# Time (and trace) a call to an external service (Zibal, SMTP); failures are counted as errors
+@contextmanager
+def timed(service: str, operation: str):
+    labels = {'service': service, 'operation': operation}
+    start = time.perf_counter()
+    try:
+        with span(f'{service} {operation}', **labels), timing(SERVICE_TIMINGS.get(service, service)):
+            yield
+    except Exception:
+        metrics.inc('outbound_call_errors_total', labels)
+        raise
+    finally:
+        metrics.observe('outbound_call_duration_seconds', labels, time.perf_counter() - start)
+
+
+# Serializer mixin reporting to_representation() time as Server-Timing "serialization"
+# (and as a span of the request trace)
+class TimedSerializerMixin:
+
+    def to_representation(self, instance):
+        with span(f'serialize {type(self).__name__}'), timing('serialization'):
+            return super().to_representation(instance)
+
+
+# JSONRenderer reporting its rendering time as Server-Timing "serialization"
+class TimedJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span('render json'), timing('serialization'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+# Count the ORM queries of a request and the time they take
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+# Name of the view that served a request (the function or class name, e.g. getProducts)
+def view_name(request) -> str:
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'view_class', None) or getattr(match.func, 'cls', None)
+    return (view_class or match.func).__name__
+
+
+# Whether this request is profiled: staff asking with PROFILE_HEADER, or sampled at PROFILE_SAMPLE_RATE
+def should_profile(request) -> bool:
+    if not settings.PROFILE_DIR:
+        return False
+    if settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+        return True
+    if settings.PROFILE_HEADER not in request.headers:
+        return False
+    try:
+        authenticated = CachedJWTAuthentication().authenticate(request)
+    except Exception:
+        return False
+    return authenticated is not None and authenticated[0].is_staff
+
+
+# Write a request profile to PROFILE_DIR, keeping only the newest PROFILE_KEEP files
+def save_profile(profiler: cProfile.Profile, view: str) -> str:
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    filename = f'{time.strftime("%Y%m%d-%H%M%S")}-{view}-{os.getpid()}-{random.getrandbits(24):06x}.prof'
+    profiler.dump_stats(os.path.join(settings.PROFILE_DIR, filename))
+    profiles = sorted(glob.glob(os.path.join(settings.PROFILE_DIR, '*.prof')), key=os.path.getmtime)
+    for old in profiles[:-settings.PROFILE_KEEP]:
+        try:
+            os.remove(old)
+        except FileNotFoundError:
+            pass  # Rotated by another worker
+    return filename
+
+
+# Middleware recording latency, status and ORM queries per view, adding the Server-Timing
+# header and (opt-in) writing a cProfile trace of the request
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = QueryCounter()
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        profiler = cProfile.Profile() if should_profile(request) else None
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.count_queries(stack, counter)
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _request_timings.reset(token)
+        return self.record(request, response, counter, timings, time.perf_counter() - start, profiler)
+
+    # Under ASGI the ORM runs in the request's sync thread (sync_to_async), so the counter goes
+    # on that thread's connections; these requests are not profiled (a profiler on the event
+    # loop thread would record every request interleaved with this one)
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        stack = ExitStack()
+        try:
+            await sync_to_async(self.count_queries)(stack, counter)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        finally:
+            _request_timings.reset(token)
+        return self.record(request, response, counter, timings, time.perf_counter() - start, None)
+
+    # Count the queries run on the connections of the current thread
+    def count_queries(self, stack: ExitStack, counter: QueryCounter):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+
+    def record(self, request, response, counter, timings, duration, profiler):
+        timings.durations['db'] = counter.duration
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timings.header(duration, counter.count)
+
+        view = view_name(request)
+        metrics.inc('http_requests_total', {'view': view, 'method': request.method, 'status': response.status_code})
+        metrics.observe('http_request_duration_seconds', {'view': view}, duration)
+        metrics.inc('db_queries_total', {'view': view}, counter.count)
+        metrics.inc('db_query_duration_seconds_total', {'view': view}, counter.duration)
+        metrics.observe('db_queries_per_request', {'view': view}, counter.count, QUERY_COUNT_BUCKETS)
+        metrics.flush()
+        if profiler is not None:
+            response['X-Profile-Id'] = save_profile(profiler, view)
+        return response
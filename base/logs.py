@@ -0,0 +1,196 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from base.tracing import current_span
+
+# Incoming X-Request-ID values are trusted only if they look like an id
+REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+_request_id: ContextVar[str | None] = ContextVar('request_id', default=None)
+
+
+# Id of the request being handled (None outside requests)
+def request_id() -> str | None:
+    return _request_id.get()
+
+
+# Formats records as one JSON object per line: time, level, logger, message, request and
+# trace ids, the exception and how many identical records were suppressed before this one
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'requestId': getattr(record, 'request_id', None),
+            'traceId': getattr(record, 'trace_id', None),
+            'spanId': getattr(record, 'span_id', None),
+            'location': f'{record.module}:{record.lineno}',
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        return json.dumps(entry, default=str)
+
+
+# Stamps every record with the request and trace ids of the code that logged it (the record is
+# written later by another thread, where these context variables are no longer set)
+class RequestContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        span = current_span()
+        record.trace_id = span.trace_id if span else None
+        record.span_id = span.span_id if span else None
+        return True
+
+
+# Lets `burst` identical records (same logger, level and message template) through per `window`
+# seconds and drops the rest; the first record of the next window carries the dropped count
+class RateLimitFilter(logging.Filter):
+    def __init__(self, burst: int = 10, window: float = 60, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.windows = {}  # Key -> [window start, records let through, records suppressed]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = self.clock()
+        with self.lock:
+            window = self.windows.get(key)
+            if window is None or now - window[0] >= self.window:
+                if len(self.windows) >= 10000:
+                    # Forget expired windows (their suppressed counts are lost)
+                    self.windows = {k: w for k, w in self.windows.items() if now - w[0] < self.window}
+                record.suppressed = window[2] if window else 0
+                self.windows[key] = [now, 1, 0]
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+# Writer thread of BackgroundHandler; stopping waits for room in a full queue instead of failing
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# Hands records to a background thread that formats and writes them (to `filename`, default
+# stderr), so requests never wait on log I/O; records are dropped when `capacity` are waiting
+class BackgroundHandler(QueueHandler):
+    def __init__(self, filename: str = None, capacity: int = 10000):
+        super().__init__(None)
+        if filename:
+            directory = os.path.dirname(filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.target = logging.FileHandler(filename, delay=True)
+        else:
+            self.target = logging.StreamHandler(sys.stderr)
+        self.target.setFormatter(JSONFormatter())
+        self.capacity = capacity
+        self.listener_lock = threading.Lock()  # Not self.lock: handle() holds that one around emit()
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        atexit.register(self.stop)
+
+    # Start the writer (on first use, and again in a forked child process)
+    def start(self):
+        if self.listener is not None and self.pid == os.getpid():
+            return
+        with self.listener_lock:
+            if self.listener is None or self.pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.capacity)
+                self.pid = os.getpid()
+                self.listener = _Listener(self.queue, self.target)
+                self.listener.start()
+
+    def enqueue(self, record: logging.LogRecord):
+        self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # Resolve the message and exception to text now: the arguments may change (or not be
+    # thread-safe) by the time the writer formats the record
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.target.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    # Wait until every queued record is written (the writer is restarted on next use)
+    def stop(self):
+        with self.listener_lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+
+    def close(self):
+        self.stop()
+        self.target.close()
+        super().close()
+
+
+# Gives every request an id (the caller's X-Request-ID when valid) that is attached to the
+# log records it produces and returned in the X-Request-ID response header
+class RequestIdMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_id.reset(token)
+        response['X-Request-ID'] = request.id
+        return response
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_id.reset(token)
+        response['X-Request-ID'] = request.id
+        return response
+
+    def start(self, request):
+        incoming = request.headers.get('X-Request-ID', '')
+        request.id = incoming if REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        return _request_id.set(request.id)
@@ -0,0 +1,157 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from base.instrumentation import timed, timing
+from base.models import EmailOutbox
+from base.routers import primary_scope
+from base.strConst import ERROR_EMAIL_QUEUE_DELIVERY, ERROR_EMAIL_QUEUE_WORKER, MORE_DETAILS
+from base.tracing import span, trace
+
+# A claimed batch is retried by another worker if it is not finished within this time
+CLAIM_LEASE = timedelta(minutes=5)
+
+# Callables run by the mail worker before each drain (e.g. flushing alert digests)
+periodic_tasks = []
+
+
+# Queue an email; it is delivered by the mail worker after the current transaction commits
+def enqueue(subject: str, body: str, to: list, html: str = '', from_email: str = None) -> EmailOutbox:
+    with span('email enqueue', recipients=len(to)), timing('email'):
+        message = EmailOutbox.objects.create(
+            subject=subject,
+            body=body,
+            htmlBody=html,
+            fromEmail=from_email or settings.EMAIL_HOST_USER or '',
+            to=list(to),
+            nextAttemptAt=timezone.now(),
+        )
+    transaction.on_commit(mail_worker.wake)
+    return message
+
+
+# Claim up to EMAIL_QUEUE_BATCH_SIZE due messages for this worker
+def claim_batch() -> list:
+    now = timezone.now()
+    due = EmailOutbox.objects.filter(status=EmailOutbox.PENDING, nextAttemptAt__lte=now)
+    ids = list(due.order_by('nextAttemptAt').values_list('id', flat=True)[:settings.EMAIL_QUEUE_BATCH_SIZE])
+    if not ids:
+        return []
+    claim = uuid.uuid4().hex
+    # Conditional update: a message claimed by another worker meanwhile no longer matches
+    due.filter(id__in=ids).update(claim=claim, nextAttemptAt=now + CLAIM_LEASE)
+    return list(EmailOutbox.objects.filter(claim=claim))
+
+
+def build_message(message: EmailOutbox, connection) -> EmailMultiAlternatives:
+    email = EmailMultiAlternatives(message.subject, message.body, message.fromEmail or None,
+                                   message.to, connection=connection)
+    if message.htmlBody:
+        email.attach_alternative(message.htmlBody, 'text/html')
+    return email
+
+
+# Schedule a retry with exponential backoff, or give up after EMAIL_QUEUE_MAX_ATTEMPTS
+def mark_failed(message: EmailOutbox, error: Exception):
+    message.attempts += 1
+    message.lastError = str(error)
+    if message.attempts >= settings.EMAIL_QUEUE_MAX_ATTEMPTS:
+        message.status = EmailOutbox.FAILED
+    else:
+        delay = settings.EMAIL_QUEUE_RETRY_SECONDS * 2 ** (message.attempts - 1)
+        message.nextAttemptAt = timezone.now() + timedelta(seconds=delay)
+    message.save(update_fields=['attempts', 'lastError', 'status', 'nextAttemptAt'])
+    logging.error(ERROR_EMAIL_QUEUE_DELIVERY + MORE_DETAILS, {'e': error})
+
+
+# Deliver one batch (traced as one job) over a single SMTP session; return the number of messages handled
+def deliver_batch() -> int:
+    batch = claim_batch()
+    if not batch:
+        return 0
+    with trace('email deliver', messages=len(batch)):
+        send_batch(batch)
+    return len(batch)
+
+
+def send_batch(batch: list):
+    connection = get_connection(fail_silently=False)
+    try:
+        with timed('smtp', 'open'):
+            connection.open()
+    except Exception as e:
+        # No session at all: every message of the batch is retried later
+        for message in batch:
+            mark_failed(message, e)
+        return
+    try:
+        for message in batch:
+            try:
+                with timed('smtp', 'send'):
+                    build_message(message, connection).send()
+            except Exception as e:
+                mark_failed(message, e)
+            else:
+                message.delete()
+    finally:
+        with timed('smtp', 'close'):
+            connection.close()
+
+
+# Deliver batches until nothing is due
+def drain():
+    # Messages were queued moments ago; never look for them on a lagging replica
+    with primary_scope():
+        for task in periodic_tasks:
+            try:
+                task()
+            except Exception as e:
+                logging.error(ERROR_EMAIL_QUEUE_WORKER + MORE_DETAILS, {'e': e})
+        while deliver_batch():
+            pass
+
+
+# Background thread delivering the outbox of this process (EMAIL_QUEUE_WORKER = 'thread')
+class MailWorker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.thread = None
+        self.pid = None
+
+    # Make sure the worker runs (started on first use, and again in a forked child process); an
+    # idle worker still runs the periodic tasks every EMAIL_QUEUE_POLL_SECONDS
+    def start(self) -> bool:
+        if settings.EMAIL_QUEUE_WORKER != 'thread':
+            return False
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.event = threading.Event()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='mail-worker', daemon=True)
+                self.thread.start()
+        return True
+
+    # Wake the worker now
+    def wake(self):
+        if self.start():
+            self.event.set()
+
+    def run(self):
+        while True:
+            self.event.wait(settings.EMAIL_QUEUE_POLL_SECONDS)
+            self.event.clear()
+            try:
+                drain()
+            except Exception as e:
+                logging.error(ERROR_EMAIL_QUEUE_WORKER + MORE_DETAILS, {'e': e})
+            finally:
+                close_old_connections()
+
+
+mail_worker = MailWorker()
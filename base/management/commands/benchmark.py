@@ -0,0 +1,56 @@
+import json
+import platform
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from base.benchmark.data import SCALES, generate
+from base.benchmark.driver import benchmark_environment, run_routes
+from base.benchmark.routes import ROUTES, RouteContext
+
+
+# Benchmark every API route against a throwaway database filled with a synthetic dataset
+class Command(BaseCommand):
+    help = ('Generate a synthetic dataset in a throwaway database and drive every API route through '
+            'the in-process WSGI/ASGI app; reports throughput, latency percentiles and queries per '
+            'request as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small', help='Dataset size.')
+        parser.add_argument('--routes', default=','.join(ROUTES),
+                            help='Comma-separated URL names to drive (default: all).')
+        parser.add_argument('--interface', choices=('wsgi', 'asgi'), default='wsgi', help='App interface.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel clients.')
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per route.')
+        parser.add_argument('--warmup', type=int, default=5, help='Unmeasured requests per route.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset and request mix.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        routes = [name.strip() for name in options['routes'].split(',') if name.strip()]
+        unknown = set(routes) - set(ROUTES)
+        if unknown:
+            raise CommandError(f'Unknown routes: {sorted(unknown)}')
+
+        with benchmark_environment() as gateway:
+            dataset = generate(**SCALES[options['scale']], ledger=gateway.ledger, seed=options['seed'])
+            results = run_routes(RouteContext(dataset, options['seed']), routes, options['interface'],
+                                 options['concurrency'], options['requests'], options['warmup'])
+
+        report = {
+            'scale': options['scale'],
+            'dataset': dataset.counts(),
+            'interface': options['interface'],
+            'concurrency': options['concurrency'],
+            'requestsPerRoute': options['requests'],
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connections['default'].vendor,
+            },
+            'routes': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        self.stdout.write(output)
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from base.zibal.fake_server import (
+    FakeZibalConfig, FakeZibalServer, RESULT_CODES, PAY_STATUSES, parse_weights
+)
+
+
+# Run a local stand-in for the Zibal IPG (set ZIBAL_GATEWAY to its URL)
+class Command(BaseCommand):
+    help = 'Run a local fake Zibal payment gateway for offline end-to-end and load testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Interface to bind.')
+        parser.add_argument('--port', type=int, default=8765, help='Port to bind.')
+        parser.add_argument('--latency', default='0',
+                            help='Artificial latency in ms per gateway call: "50" or "20-120".')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction (0-1) of gateway calls answered with HTTP 500.')
+        parser.add_argument('--request-results', default='',
+                            help='Forced result codes for request/, e.g. "102:0.05,113:0.01".')
+        parser.add_argument('--verify-results', default='',
+                            help='Forced result codes for verify/, e.g. "201:0.1".')
+        parser.add_argument('--inquiry-results', default='',
+                            help='Forced result codes for inquiry/, e.g. "203:0.02".')
+        parser.add_argument('--pay-statuses', default='2:1',
+                            help='Payment page outcomes, e.g. "2:0.9,3:0.1" (2 = paid).')
+        parser.add_argument('--verbose-log', action='store_true', help='Log every gateway hit.')
+
+    def handle(self, *args, **options):
+        low, _, high = options['latency'].partition('-')
+        latency = (float(low), float(high or low))
+
+        weights = {}
+        for option in ('request_results', 'verify_results', 'inquiry_results', 'pay_statuses'):
+            try:
+                weights[option] = parse_weights(options[option])
+            except ValueError:
+                raise CommandError(f'Invalid weights for --{option.replace("_", "-")}')
+            allowed = PAY_STATUSES if option == 'pay_statuses' else RESULT_CODES
+            unknown = set(weights[option]) - set(allowed)
+            if unknown:
+                raise CommandError(f'Unknown codes for --{option.replace("_", "-")}: {sorted(unknown)}')
+
+        config = FakeZibalConfig(
+            latency_ms=latency,
+            error_rate=options['error_rate'],
+            request_results=weights['request_results'],
+            verify_results=weights['verify_results'],
+            inquiry_results=weights['inquiry_results'],
+            pay_statuses=weights['pay_statuses'],
+        )
+        server = FakeZibalServer((options['host'], options['port']), config, options['verbose_log'])
+
+        self.stdout.write(self.style.SUCCESS(f'Fake Zibal gateway listening on {server.url}'))
+        self.stdout.write(f'Run the app with ZIBAL_GATEWAY={server.url}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
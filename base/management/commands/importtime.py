@@ -0,0 +1,92 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# "import time: <self us> | <cumulative us> | <indentation><module>" lines of `-X importtime`
+IMPORT_TIME = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+# What a worker imports before serving its first request (the app and every view behind the URLconf)
+BOOT = '''
+from django.core.{interface} import get_{interface}_application
+application = get_{interface}_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+'''
+
+# Modules deferred until first use; importing one at boot is a regression
+DEFERRED = ('PIL', 'jwt', 'base.zibal.server_apis', 'base.zibal.database_apis', 'base.benchmark')
+
+
+# Modules imported by one cold boot: [(module, self ms, cumulative ms, depth), ...]
+def profile_boot(interface: str) -> list:
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'backend.settings')}
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', BOOT.format(interface=interface)],
+                            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise CommandError(f'Booting the app failed:\n{result.stderr[-2000:]}')
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            modules.append((name, int(own) / 1000, int(cumulative) / 1000, len(indent) // 2))
+    return modules
+
+
+# Report the import cost of a cold worker start, slowest modules and packages first
+class Command(BaseCommand):
+    help = ('Boot the app in fresh interpreters under `python -X importtime` and report the cold-start '
+            'import cost as JSON: total, slowest modules and packages, and deferred modules that were '
+            'imported anyway. Fails when a deferred module is imported or the total exceeds --budget-ms.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interface', choices=('wsgi', 'asgi'), default='wsgi', help='App interface.')
+        parser.add_argument('--runs', type=int, default=3, help='Boots to measure (the fastest is reported).')
+        parser.add_argument('--top', type=int, default=15, help='Modules and packages listed.')
+        parser.add_argument('--budget-ms', type=float, help='Fail when the total import time exceeds this.')
+        parser.add_argument('--deferred', default=','.join(DEFERRED),
+                            help='Comma-separated modules (or packages) that must not be imported at boot.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        # Top-level imports add up to the total; the first boot also pays for compiling stale .pyc files
+        runs = [profile_boot(options['interface']) for _ in range(max(1, options['runs']))]
+        totals = [sum(cumulative for _, _, cumulative, depth in modules if depth == 0) for modules in runs]
+        modules = runs[totals.index(min(totals))]
+
+        packages = {}
+        for name, own, _, _ in modules:
+            package = name.split('.', 1)[0]
+            packages[package] = packages.get(package, 0) + own
+        deferred = [prefix.strip() for prefix in options['deferred'].split(',') if prefix.strip()]
+        imported = sorted({name for name, _, _, _ in modules for prefix in deferred
+                           if name == prefix or name.startswith(f'{prefix}.')})
+
+        report = {
+            'interface': options['interface'],
+            'python': sys.version.split()[0],
+            'totalMs': round(min(totals), 1),
+            'runsMs': [round(total, 1) for total in totals],
+            'modules': len(modules),
+            'slowestModules': [
+                {'module': name, 'cumulativeMs': round(cumulative, 1), 'selfMs': round(own, 1)}
+                for name, own, cumulative, _ in sorted(modules, key=lambda m: m[1], reverse=True)[:options['top']]],
+            'slowestPackages': [
+                {'package': package, 'ms': round(ms, 1)}
+                for package, ms in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:options['top']]],
+            'deferredImported': imported,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        self.stdout.write(output)
+
+        if imported:
+            raise CommandError(f'Deferred modules imported at boot: {", ".join(imported)}')
+        if options['budget_ms'] is not None and report['totalMs'] > options['budget_ms']:
+            raise CommandError(f'Boot imports took {report["totalMs"]} ms (budget {options["budget_ms"]} ms)')
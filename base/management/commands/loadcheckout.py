@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from base.benchmark.driver import percentile
+
+
+# Drive checkout-to-paid flows against a running app wired to `manage.py fakezibal`
+class Command(BaseCommand):
+    help = ('Benchmark checkout-to-paid throughput: login, addOrderItems, payOrder, '
+            'fake gateway payment + callback, inquiryPay. Run the app with ZIBAL_GATEWAY '
+            'pointing at `manage.py fakezibal`.')
+
+    stages = ('addOrderItems', 'payOrder', 'pay', 'inquiryPay')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='App base URL.')
+        parser.add_argument('--email', required=True, help='Active user used to check out.')
+        parser.add_argument('--password', required=True, help='Password of that user.')
+        parser.add_argument('--product', type=int, required=True,
+                            help='Product ID to buy (must have an image and enough stock).')
+        parser.add_argument('--qty', type=int, default=1, help='Quantity per order.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Parallel clients.')
+        parser.add_argument('--iterations', type=int, default=100, help='Total checkouts.')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        self.base = options['base_url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.email = options['email']
+        self.password = options['password']
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.latencies = {stage: [] for stage in self.stages}
+        self.outcomes = {}
+
+        try:
+            product = requests.get(f'{self.base}/api/v1/products/{options["product"]}/',
+                                   timeout=self.timeout).json()
+        except (requests.RequestException, ValueError) as e:
+            raise CommandError(f'Unable to load product: {e}')
+        if 'price' not in product:
+            raise CommandError(f'Unable to load product: {product}')
+
+        price = float(product['price'])
+        qty = options['qty']
+        order = {
+            'orderItems': [{'product': product['_id'], 'qty': qty, 'price': price}],
+            'paymentMethod': 'Zibal',
+            'shippingAddress': {
+                'address': 'Load test', 'city': 'Tehran', 'country': 'Iran', 'postalCode': '0000000000',
+            },
+            'taxPrice': 0,
+            'shippingPrice': 0,
+            'totalPrice': max(price * qty, 100),
+        }
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for _ in pool.map(lambda _: self.checkout(order), range(options['iterations'])):
+                pass
+        elapsed = time.perf_counter() - started
+
+        report = {
+            'iterations': options['iterations'],
+            'concurrency': options['concurrency'],
+            'elapsedSeconds': round(elapsed, 3),
+            'paidPerSecond': round(self.outcomes.get('paid', 0) / elapsed, 2) if elapsed else 0,
+            'outcomes': self.outcomes,
+            'latencyMs': {
+                stage: {
+                    'count': len(values),
+                    'p50': round(percentile(values, 50) * 1000, 2),
+                    'p95': round(percentile(values, 95) * 1000, 2),
+                    'p99': round(percentile(values, 99) * 1000, 2),
+                }
+                for stage, values in ((s, sorted(v)) for s, v in self.latencies.items())
+            },
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        self.stdout.write(output)
+
+    # One requests session and access token per client thread
+    def session(self) -> requests.Session:
+        if getattr(self.local, 'session', None) is None:
+            self.local.session = requests.Session()
+            self.login()
+        return self.local.session
+
+    def login(self):
+        res = self.local.session.post(f'{self.base}/api/v1/users/login/', json={
+            'username': self.email, 'password': self.password}, timeout=self.timeout)
+        if res.status_code != 200:
+            raise CommandError(f'Login failed: {res.status_code} {res.text}')
+        self.local.session.headers['Authorization'] = f'Bearer {res.json()["access"]}'
+
+    # Time one stage and re-login once when the 5 minute access token expires
+    def call(self, stage: str, method: str, url: str, **kwargs) -> requests.Response:
+        session = self.session()
+        started = time.perf_counter()
+        res = session.request(method, url, timeout=self.timeout, **kwargs)
+        if res.status_code == 401:
+            self.login()
+            res = session.request(method, url, timeout=self.timeout, **kwargs)
+        with self.lock:
+            self.latencies[stage].append(time.perf_counter() - started)
+        return res
+
+    def record(self, outcome: str):
+        with self.lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def checkout(self, order: dict):
+        try:
+            res = self.call('addOrderItems', 'POST', f'{self.base}/api/v1/orders/add/', json=order)
+            if res.status_code != 200:
+                return self.record(f'addOrderItems:{res.status_code}')
+            orderId = res.json()['_id']
+
+            res = self.call('payOrder', 'GET', f'{self.base}/api/v1/orders/{orderId}/pay/')
+            if res.status_code != 200:
+                return self.record(f'payOrder:{res.status_code}')
+            link = res.json()['paymentLink']
+
+            # The fake payment page fires the callback at the app and reports the redirect
+            res = self.call('pay', 'GET', link, params={'fire': 1})
+            if res.status_code != 200 or not res.json().get('location'):
+                return self.record(f'pay:{res.status_code}')
+            token = urlsplit(res.json()['location']).path.rstrip('/').rsplit('/', 1)[-1]
+
+            res = self.call('inquiryPay', 'GET', f'{self.base}/api/v1/orders/{token}/inquiry-pay/')
+            if res.status_code != 200:
+                return self.record(f'inquiryPay:{res.status_code}')
+            self.record('paid' if res.json().get('success') else 'unpaid')
+        except (requests.RequestException, ValueError, KeyError) as e:
+            self.record(f'error:{type(e).__name__}')
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from base.zibal import zibal_apis
+
+
+# Delete PaymentToken rows older than PAYMENT_TOKEN_MAX_AGE (schedule it, e.g. hourly via cron)
+class Command(BaseCommand):
+    help = 'Delete stored payment tokens that are past PAYMENT_TOKEN_MAX_AGE.'
+
+    def handle(self, *args, **options):
+        deleted = zibal_apis.database_apis.purge_expired_payment_tokens()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired payment token(s).'))
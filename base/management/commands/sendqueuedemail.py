@@ -0,0 +1,22 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from base import mailqueue
+
+
+# Deliver the email outbox from a dedicated process (pair it with EMAIL_QUEUE_WORKER=off)
+class Command(BaseCommand):
+    help = 'Deliver queued emails in batches; runs until stopped unless --once is given.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Deliver what is due now, then exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            mailqueue.drain()
+            close_old_connections()
+            if options['once']:
+                break
+            time.sleep(settings.EMAIL_QUEUE_POLL_SECONDS)
+        self.stdout.write(self.style.SUCCESS('Email queue drained.'))
@@ -0,0 +1,64 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from base.benchmark.data import SCALES, generate
+from base.benchmark.driver import benchmark_environment
+from base.benchmark.routes import RouteContext
+from base.benchmark.stress import checkout_storm, callback_storm, check_invariants, contention_ramp
+
+
+# Check checkout and payment invariants under parallel load against a WAL SQLite database
+class Command(BaseCommand):
+    help = ('Fire simultaneous checkouts at low-stock products and duplicate/concurrent payment callbacks '
+            'at the same transactions, from threads and processes, against a throwaway WAL SQLite '
+            'database; checks stock and payment invariants and records the checkout throughput reached '
+            'before lock contention sets in. Fails on any violated invariant.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=('threads', 'processes', 'both'), default='both',
+                            help='How the concurrent clients run.')
+        parser.add_argument('--clients', type=int, default=16, help='Simultaneous checkouts per storm.')
+        parser.add_argument('--stock', type=int, default=5, help='Units left of the stormed product.')
+        parser.add_argument('--transactions', type=int, default=5, help='Transactions per callback storm.')
+        parser.add_argument('--duplicates', type=int, default=4,
+                            help='Simultaneous callbacks (and inquiryPay calls) per transaction.')
+        parser.add_argument('--levels', default='1,2,4,8,16', help='Comma-separated concurrency levels of the ramp.')
+        parser.add_argument('--per-client', type=int, default=10, help='Checkouts per client at each ramp level.')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset and request mix.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options['levels'].split(',') if level.strip()]
+        if not levels or min(levels) < 1:
+            raise CommandError('--levels must be positive integers')
+        modes = ('threads', 'processes') if options['mode'] == 'both' else (options['mode'],)
+
+        # Always the tuned profile: WAL lets readers run alongside the single writer
+        with benchmark_environment(settings.SQLITE_TUNED_OPTIONS) as gateway:
+            # Every callback storm consumes its transactions, so enough are generated for all modes
+            scale = {**SCALES['tiny'], 'orders': max(SCALES['tiny']['orders'],
+                                                     4 * options['transactions'] * len(modes))}
+            dataset = generate(**scale, ledger=gateway.ledger, seed=options['seed'])
+            context = RouteContext(dataset, options['seed'])
+            scenarios = []
+            for mode in modes:
+                scenarios.append(checkout_storm(context, options['clients'], options['stock'], mode))
+                scenarios.append(callback_storm(context, gateway.ledger, options['transactions'],
+                                                options['duplicates'], mode))
+                scenarios.append(contention_ramp(context, levels, options['per_client'], mode))
+            invariants = check_invariants()
+
+        violations = [violation for scenario in scenarios for violation in scenario.get('violations', [])]
+        violations += invariants
+        report = {
+            'database': {'journalMode': 'wal', 'options': settings.SQLITE_TUNED_OPTIONS},
+            'scenarios': scenarios,
+            'invariantViolations': invariants,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                fp.write(output)
+        self.stdout.write(output)
+        if violations:
+            raise CommandError(f'{len(violations)} invariant violations:\n' + '\n'.join(violations))
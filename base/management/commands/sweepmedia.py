@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from base.storage import sweep_unreferenced
+
+
+# Delete media files no product or order references any more (schedule it, e.g. daily via cron)
+class Command(BaseCommand):
+    help = 'Delete product media files that nothing references.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=float, default=None,
+                            help='Keep files younger than this many seconds (default MEDIA_SWEEP_GRACE_SECONDS).')
+
+    def handle(self, *args, **options):
+        deleted = sweep_unreferenced(grace=options['grace'])
+        for name in deleted:
+            self.stdout.write(f'Deleted {name}')
+        self.stdout.write(self.style.SUCCESS(f'Deleted {len(deleted)} unreferenced media file(s).'))
@@ -0,0 +1,25 @@
+import sqlite3
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Copy the primary SQLite database onto every configured read replica file
+class Command(BaseCommand):
+    help = 'Copy the primary SQLite database onto the DATABASE_REPLICA_PATHS files (local replication).'
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError('No read replicas configured (set DATABASE_REPLICA_PATHS).')
+
+        source = sqlite3.connect(settings.DATABASES['default']['NAME'])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]['NAME'])
+                try:
+                    # The online backup API gives a consistent snapshot even while the app writes
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(f'Synced {alias}'))
+        finally:
+            source.close()
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Point existing tokens at their Order/Zibal rows; drop tokens whose rows are gone, or whose
+# transaction belongs to another order (the token would show someone else's payment)
+def link_payment_tokens(apps, schema_editor):
+    PaymentToken = apps.get_model('base', 'PaymentToken')
+    Zibal = apps.get_model('base', 'Zibal')
+    db_alias = schema_editor.connection.alias
+
+    transactions = {
+        (trackId, orderId): transactionId
+        for transactionId, trackId, orderId in Zibal.objects.using(db_alias).values_list('_id', 'trackId', 'order_id')
+    }
+
+    orphans = []
+    for payment_token in PaymentToken.objects.using(db_alias).iterator():
+        try:
+            orderId = int(payment_token.orderId)
+            transactionId = transactions[int(payment_token.trackId), orderId]
+        except (KeyError, TypeError, ValueError):
+            orphans.append(payment_token._id)
+            continue
+        PaymentToken.objects.using(db_alias).filter(_id=payment_token._id).update(
+            order_id=orderId, transaction_id=transactionId)
+
+    PaymentToken.objects.using(db_alias).filter(_id__in=orphans).delete()
+
+
+# Restore the plain orderId/trackId values from the foreign keys
+def unlink_payment_tokens(apps, schema_editor):
+    PaymentToken = apps.get_model('base', 'PaymentToken')
+    db_alias = schema_editor.connection.alias
+
+    for payment_token in PaymentToken.objects.using(db_alias).select_related('transaction').iterator():
+        PaymentToken.objects.using(db_alias).filter(_id=payment_token._id).update(
+            orderId=str(payment_token.order_id),
+            trackId=str(payment_token.transaction.trackId) if payment_token.transaction else '',
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0005_paymenttoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymenttoken',
+            name='order',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='base.order'),
+        ),
+        migrations.AddField(
+            model_name='paymenttoken',
+            name='transaction',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='base.zibal'),
+        ),
+        migrations.RunPython(link_payment_tokens, unlink_payment_tokens),
+        # Give the old columns a default so the migration can be reversed
+        migrations.AlterField(
+            model_name='paymenttoken',
+            name='orderId',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='paymenttoken',
+            name='trackId',
+            field=models.CharField(default='', max_length=255),
+        ),
+        migrations.RemoveField(
+            model_name='paymenttoken',
+            name='orderId',
+        ),
+        migrations.RemoveField(
+            model_name='paymenttoken',
+            name='trackId',
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0006_paymenttoken_foreign_keys'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymenttoken',
+            index=models.Index(fields=['createdAt'], name='paymenttoken_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-createdAt'], name='product_created_idx'),
+        ),
+    ]
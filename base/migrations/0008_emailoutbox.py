@@ -0,0 +1,34 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0007_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('htmlBody', models.TextField(blank=True)),
+                ('fromEmail', models.CharField(blank=True, max_length=254)),
+                ('to', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('nextAttemptAt', models.DateTimeField()),
+                ('claim', models.CharField(blank=True, max_length=32)),
+                ('lastError', models.TextField(blank=True)),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Email Outbox',
+                'indexes': [models.Index(fields=['status', 'nextAttemptAt'], name='emailoutbox_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.7 on 2026-10-19 05:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('user', 'New user'), ('order', 'New order')], max_length=10)),
+                ('objectId', models.IntegerField()),
+                ('amount', models.DecimalField(blank=True, decimal_places=2, max_digits=9, null=True)),
+                ('digest', models.CharField(blank=True, max_length=32)),
+                ('createdAt', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['digest', 'createdAt'], name='alertevent_pending_idx')],
+            },
+        ),
+    ]
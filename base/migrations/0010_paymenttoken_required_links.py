@@ -0,0 +1,33 @@
+# Generated by Django 5.1.7 on 2026-10-19 07:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+# Drop tokens that lost their Order/Zibal link (every code path sets both) before the columns become required
+def delete_unlinked_payment_tokens(apps, schema_editor):
+    PaymentToken = apps.get_model('base', 'PaymentToken')
+    db_alias = schema_editor.connection.alias
+    PaymentToken.objects.using(db_alias).filter(
+        models.Q(order__isnull=True) | models.Q(transaction__isnull=True)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_alertevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_unlinked_payment_tokens, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='paymenttoken',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.order'),
+        ),
+        migrations.AlterField(
+            model_name='paymenttoken',
+            name='transaction',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.zibal'),
+        ),
+    ]
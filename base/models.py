@@ -6,6 +6,12 @@ from base.strConst import ERROR_UNABLE_GENERATE_PAYMENT_TOKEN
 
 # Define the Product model to represent items in the catalog
 class Product(models.Model):
+    class Meta:
+        indexes = [
+            # getProducts lists the catalog newest first
+            models.Index(fields=['-createdAt'], name='product_created_idx'),
+        ]
+
     _id = models.AutoField(primary_key=True, editable=False)  # Auto-generated primary key
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)  # Creator of the product
     name = models.CharField(max_length=200, null=True)  # Name of the product
@@ -114,11 +120,15 @@ class PaymentToken(models.Model):
     class Meta:
         # Set the plural name for admin interface
         verbose_name_plural = 'Zibal Payments Token'
+        indexes = [
+            # purge_expired_payment_tokens deletes by age
+            models.Index(fields=['createdAt'], name='paymenttoken_created_idx'),
+        ]
 
     _id = models.AutoField(primary_key=True, editable=False)  # Auto-generated primary key
     token = models.CharField(max_length=40, unique=True)   # Unique payment token
-    trackId = models.CharField(max_length=255)  # Associated transaction track ID
-    orderId = models.CharField(max_length=255)  # Associated order ID
+    order = models.ForeignKey(Order, on_delete=models.CASCADE)  # Associated order
+    transaction = models.ForeignKey(Zibal, on_delete=models.CASCADE)  # Associated transaction
     createdAt = models.DateTimeField(auto_now_add=True)  # Creation timestamp
 
     def __str__(self):
@@ -141,3 +151,54 @@ class PaymentToken(models.Model):
                 if attempt == max_attempts:
                     # Raise an error if unable to generate a unique token
                     raise ValueError(ERROR_UNABLE_GENERATE_PAYMENT_TOKEN)
+
+
+# Define the EmailOutbox model to queue outgoing emails until the mail worker delivers them
+class EmailOutbox(models.Model):
+    class Meta:
+        verbose_name_plural = 'Email Outbox'
+        indexes = [
+            # The mail worker claims due messages in order
+            models.Index(fields=['status', 'nextAttemptAt'], name='emailoutbox_due_idx'),
+        ]
+
+    PENDING = 'pending'  # Waiting for (re)delivery
+    FAILED = 'failed'  # Gave up after EMAIL_QUEUE_MAX_ATTEMPTS; delivered messages are deleted
+    STATUS_CHOICES = [(PENDING, 'Pending'), (FAILED, 'Failed')]
+
+    subject = models.CharField(max_length=255)  # Subject of the email
+    body = models.TextField(blank=True)  # Plain text content
+    htmlBody = models.TextField(blank=True)  # HTML content (optional)
+    fromEmail = models.CharField(max_length=254, blank=True)  # Sender's email address
+    to = models.JSONField()  # Recipient email addresses
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)  # Delivery status
+    attempts = models.PositiveSmallIntegerField(default=0)  # Failed delivery attempts so far
+    nextAttemptAt = models.DateTimeField()  # Not delivered before this time (retry backoff, worker lease)
+    claim = models.CharField(max_length=32, blank=True)  # Batch of the worker that claimed the message
+    lastError = models.TextField(blank=True)  # Error of the last failed attempt
+    createdAt = models.DateTimeField(auto_now_add=True)  # Creation timestamp
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.to)}'  # String representation of the email
+
+
+# Define the AlertEvent model to collect admin alerts until they are sent as one digest email
+class AlertEvent(models.Model):
+    class Meta:
+        indexes = [
+            # Pending events (digest='') are counted and aged on every alert
+            models.Index(fields=['digest', 'createdAt'], name='alertevent_pending_idx'),
+        ]
+
+    NEW_USER = 'user'
+    NEW_ORDER = 'order'
+    KIND_CHOICES = [(NEW_USER, 'New user'), (NEW_ORDER, 'New order')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)  # What happened
+    objectId = models.IntegerField()  # ID of the new user or order
+    amount = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True)  # Order total price
+    digest = models.CharField(max_length=32, blank=True)  # Digest that claimed the event ('' while pending)
+    createdAt = models.DateTimeField(auto_now_add=True)  # Creation timestamp
+
+    def __str__(self):
+        return f'{self.kind} #{self.objectId}'  # String representation of the event
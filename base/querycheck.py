@@ -0,0 +1,119 @@
+import logging
+import os
+import re
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from base.strConst import ERROR_REPEATED_QUERIES
+
+# Literals and placeholder lists, replaced so queries of the same shape share a fingerprint
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+
+# Shape of a SQL statement: the same query for another row has the same fingerprint
+def fingerprint(sql: str) -> str:
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql).replace('%s', '?')
+    sql = VALUE_LIST.sub('(...)', sql)
+    return ' '.join(sql.split())
+
+
+# Frames of this project's code (not Django, DRF or this module) that issued a query
+def project_stack() -> list:
+    base_dir = str(settings.BASE_DIR)
+    return [
+        f'{frame.filename}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(base_dir)
+        and 'site-packages' not in frame.filename
+        and os.path.basename(frame.filename) != 'querycheck.py'
+    ]
+
+
+# Records the fingerprint of every query run inside `with recorder:`, on every database
+class QueryRecorder:
+    def __init__(self):
+        self.counts = Counter()
+        self.stacks = {}  # fingerprint -> stack of its first execution
+        self.stack = None
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = fingerprint(sql)
+        self.counts[shape] += 1
+        if shape not in self.stacks:
+            self.stacks[shape] = project_stack()
+        return execute(sql, params, many, context)
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    # Queries run at least `threshold` times, with the code that issued them
+    def repeated(self, threshold: int) -> list:
+        return [(shape, count, self.stacks[shape]) for shape, count in self.counts.most_common() if count >= threshold]
+
+    def report(self, threshold: int) -> str:
+        return '\n'.join(
+            f'{count}x {shape}\n' + ''.join(f'    {frame}\n' for frame in stack)
+            for shape, count, stack in self.repeated(threshold)
+        )
+
+
+# Raised instead of logging when NPLUSONE_RAISE is set (tests, CI)
+class RepeatedQueriesError(AssertionError):
+    pass
+
+
+# Middleware flagging requests that run the same query shape NPLUSONE_THRESHOLD times or more
+class NPlusOneMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.NPLUSONE_DETECTION:
+            return self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        return self.check(request, response, recorder)
+
+    # Under ASGI the ORM runs in the request's sync thread (sync_to_async): the recorder is
+    # started and stopped there, on the connections the queries use
+    async def __acall__(self, request):
+        if not settings.NPLUSONE_DETECTION:
+            return await self.get_response(request)
+        recorder = await sync_to_async(QueryRecorder().__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+        return self.check(request, response, recorder)
+
+    def check(self, request, response, recorder: QueryRecorder):
+        report = recorder.report(settings.NPLUSONE_THRESHOLD)
+        if report:
+            message = f'{ERROR_REPEATED_QUERIES} {request.method} {request.path}\n{report}'
+            if settings.NPLUSONE_RAISE:
+                raise RepeatedQueriesError(message)
+            logging.warning(message)
+        return response
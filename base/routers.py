@@ -0,0 +1,94 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+# True once the current request must see the primary (it wrote, or its view asked for it); None
+# outside any request or primary_scope(), where writes must not pin the context for good
+_pinned: ContextVar[bool | None] = ContextVar('pinned_to_primary', default=None)
+
+PRIMARY = 'default'
+
+
+# Pin the rest of the current request to the primary database
+def pin_to_primary():
+    _pinned.set(True)
+
+
+# Whether the current request is pinned to the primary database
+def is_pinned() -> bool:
+    return bool(_pinned.get())
+
+
+# Send every query of the block to the primary (background jobs that run outside a request)
+@contextmanager
+def primary_scope():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+# Decorator for views that write or need read-after-write consistency (checkout, payment)
+def use_primary(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        pin_to_primary()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Route reads to a random read replica and everything else to the primary
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or is_pinned():
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        # Reads that follow a write in the same request must not hit a lagging replica
+        if _pinned.get() is not None:
+            pin_to_primary()
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary and are never migrated directly
+        return db == PRIMARY
+
+
+# Middleware scoping the primary pin to one request; unsafe methods are pinned up front
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pinned.set(request.method not in ('GET', 'HEAD', 'OPTIONS'))
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+    # Pins made in sync_to_async code (writes through the ORM) are copied back into this context
+    async def __acall__(self, request):
+        token = _pinned.set(request.method not in ('GET', 'HEAD', 'OPTIONS'))
+        try:
+            return await self.get_response(request)
+        finally:
+            _pinned.reset(token)
@@ -1,12 +1,21 @@
 from rest_framework import serializers
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.contrib.auth.models import update_last_login
 from django.contrib.auth.models import User
 from base.models import Product, ShippingAddress, Order, OrderItem
+from base.blacklist import FilteredRefreshToken
+from base.instrumentation import TimedSerializerMixin
+
+
+# ModelSerializer whose rendering time shows up as "serialization" in the Server-Timing header
+class TimedModelSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    pass
 
 
 # Define a serializer for the User model to customize the JSON representation
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedModelSerializer):
     # Add custom serializer method fields for additional or transformed data
     # Custom field to retrieve the user ID
     _id = serializers.SerializerMethodField()
@@ -45,9 +54,13 @@ class UserSerializerWithToken(UserSerializer):
         model = User
         fields = ['_id', 'username', 'email', 'name', 'isAdmin', 'token']
 
+    # Reuse the access token already issued for this request (context['token']);
+    # only mint a new access token (no refresh token, no table write) when none is given
     def get_token(self, obj):
-        token = RefreshToken.for_user(obj)
-        return str(token.access_token)
+        token = self.context.get('token')
+        if token is None:
+            token = str(AccessToken.for_user(obj))
+        return token
 
 
 # Custom serializer to extend TokenObtainPairSerializer for additional functionality
@@ -68,9 +81,22 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
         # Call the parent class's validate method to get the default validation logic
         data = super().validate(attrs)
-
-        # Serialize the user object using a custom serializer (UserSerializerWithToken)
-        serializer = UserSerializerWithToken(self.user).data
+        return self.addUserData(data)
+
+    # Issue the token pair for a user the caller already authenticated (async login view)
+    def issueTokens(self, user):
+        self.user = user
+        refresh = self.get_token(user)
+        data = {'refresh': str(refresh), 'access': str(refresh.access_token)}
+        if jwt_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
+        return self.addUserData(data)
+
+    # Add the serialized user data to a token response
+    def addUserData(self, data):
+        # Serialize the user object using a custom serializer (UserSerializerWithToken),
+        # reusing the access token issued above instead of minting another token pair
+        serializer = UserSerializerWithToken(self.user, context={'token': data['access']}).data
 
         # Merge the serialized user data into the token response
         for k, v in serializer.items():
@@ -80,22 +106,27 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         return data
 
 
+# Custom serializer to skip the blacklist query for refresh tokens the filter rules out
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
+
+
 # Serializer for the Product model to convert model instances into JSON format
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedModelSerializer):
     class Meta:
         model = Product  # Specify the model to serialize
         fields = "__all__"  # Include all fields of the Product model
 
 
 # Serializer for the ShippingAddress model
-class ShippingAddressSerializer(serializers.ModelSerializer):
+class ShippingAddressSerializer(TimedModelSerializer):
     class Meta:
         model = ShippingAddress  # Specify the model to serialize
         fields = "__all__"  # Include all fields of the ShippingAddress model
 
 
 # Serializer for the OrderItem model with a custom field for the image URL
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(TimedModelSerializer):
     # Custom method field to handle image URLs
     image = serializers.SerializerMethodField()
 
@@ -114,7 +145,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
 
 
 # Serializer for the Order model with nested and custom fields
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedModelSerializer):
     # Custom field to serialize the associated shipping address
     shippingAddress = serializers.SerializerMethodField()
     # Custom field to serialize associated order items
@@ -1,15 +1,21 @@
 import logging
-import os
 from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import Signal
+from django.db import transaction
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from django.core.mail import send_mail
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 from django.conf import settings
-from base.models import Product
+from base.models import Product, AlertEvent
+from base.authentication import invalidate_cached_user
+from base.blacklist import blacklist_filter
+from base import alerts, mailqueue
+from base.storage import schedule_sweep
 from base.strConst import (
     HTML_TEMPLATE_NEW_USER_ALERT,
     HTML_TEMPLATE_NEW_ORDER_ALERT,
+    ADMIN_ALERT_RECIPIENTS,
+    ADMIN_ALERT_DIGEST,
     ERROR_ON_SENDING_EMAIL,
     MORE_DETAILS,
 )
@@ -29,25 +35,43 @@ def updateUsername(sender, instance, **kwargs):
         # print(user, 'updated!')
 
 
+# Drop the cached copy used by CachedJWTAuthentication whenever a user changes or is deleted
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidateCachedUser(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+# Add refresh tokens blacklisted by this process to the in-memory blacklist filter
+@receiver(post_save, sender=BlacklistedToken)
+def addToBlacklistFilter(sender, instance, created, **kwargs):
+    if created:
+        blacklist_filter.add(instance.token.jti)
+
+
 # Signal to trigger an alert whenever a new user is created
 @receiver(post_save, sender=User)
 def newUserAlert(sender, instance, created, **kwargs):
     user = instance  # Get the instance of the user being created
-    if created:  # Check if this is a newly created user (not an update)
-        # Generate the HTML content for the email notification
-        html_content = HTML_TEMPLATE_NEW_USER_ALERT(user)
-        try:
-            # Send a notification email to the admin for the new user
-            send_mail(
+    if not created:  # Only newly created users (not updates)
+        return
+    try:
+        if settings.ADMIN_ALERT_MODE == ADMIN_ALERT_DIGEST:
+            # Count the user in the next digest email
+            alerts.record(AlertEvent.NEW_USER, user.id)
+        else:
+            # Generate the HTML content for the email notification
+            html_content = HTML_TEMPLATE_NEW_USER_ALERT(user)
+            # Queue a notification email to the admin for the new user
+            mailqueue.enqueue(
                 "E-SHOP | NEW USER",  # Subject of the email
                 "",  # Plain text content (not provided in this case)
-                settings.EMAIL_HOST_USER,  # Sender's email address
-                ["abolfazl.hassanzade.81@gmail.com"],  # Recipient email(s)
-                html_message=html_content,  # HTML content of the email
+                ADMIN_ALERT_RECIPIENTS,  # Recipient email(s)
+                html=html_content,  # HTML content of the email
             )
-        except Exception as e:
-            # Log an error if the email fails to send
-            logging.error(ERROR_ON_SENDING_EMAIL + MORE_DETAILS % {'e': e})
+    except Exception as e:
+        # Log an error if the email fails to be queued
+        logging.error(ERROR_ON_SENDING_EMAIL + MORE_DETAILS, {'e': e})
 
 
 # Custom signal to handle order creation
@@ -61,6 +85,15 @@ def newOrderAlert(sender, **kwargs):
     order = kwargs.get("order")
     user = kwargs.get("user")
 
+    if settings.ADMIN_ALERT_MODE == ADMIN_ALERT_DIGEST:
+        try:
+            # Count the order in the next digest email (no items query, no rendering)
+            alerts.record(AlertEvent.NEW_ORDER, order._id, order.totalPrice)
+        except Exception as e:
+            # Log an error if the event fails to be recorded
+            logging.error(ERROR_ON_SENDING_EMAIL + MORE_DETAILS, {'e': e})
+        return
+
     # Get all items in the order and calculate the total price
     orderItems = order.orderitem_set.all()
     itemsPrice = sum(item.qty * item.price for item in orderItems)
@@ -70,24 +103,22 @@ def newOrderAlert(sender, **kwargs):
         user, order, orderItems, itemsPrice)
 
     try:
-        # Send a notification email to the admin about the new order
-        send_mail(
+        # Queue a notification email to the admin about the new order
+        mailqueue.enqueue(
             "E-SHOP | NEW ORDER",  # Subject of the email
             "",  # Plain text content (not provided in this case)
-            settings.EMAIL_HOST_USER,  # Sender's email address
-            ["abolfazl.hassanzade.81@gmail.com"],  # Recipient email(s)
-            html_message=html_content,  # HTML content of the email
+            ADMIN_ALERT_RECIPIENTS,  # Recipient email(s)
+            html=html_content,  # HTML content of the email
         )
     except Exception as e:
-        # Log an error if the email fails to send
-        logging.error(ERROR_ON_SENDING_EMAIL + MORE_DETAILS % {'e': e})
+        # Log an error if the email fails to be queued
+        logging.error(ERROR_ON_SENDING_EMAIL + MORE_DETAILS, {'e': e})
 
 
+# Files may be shared by several products (and by orders), so nothing is removed in the request;
+# a background sweep deletes the files no row references any more
 @receiver(post_delete, sender=Product)
 def delete_product_image(sender, instance, **kwargs):
     # Check if the instance has an image file
     if instance.image:
-        image_path = instance.image.path  # Get the image file path
-        # Check if the file exists and delete it
-        if os.path.exists(image_path):
-            os.remove(image_path)
+        transaction.on_commit(schedule_sweep)
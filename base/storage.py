@@ -0,0 +1,116 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from urllib.parse import unquote
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import close_old_connections
+from base.models import Product, OrderItem
+from base.routers import primary_scope
+from base.strConst import ERROR_MEDIA_SWEEP, MORE_DETAILS
+
+# Names given by ContentAddressedStorage: sha256 of the content plus the original extension
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}(\.\w+)?$')
+
+
+# Name a file by the hash of its content: identical uploads share one file
+def content_name(name: str, content) -> str:
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    directory, basename = os.path.split(name)
+    extension = os.path.splitext(basename)[1].lower()
+    return os.path.join(directory, digest.hexdigest() + extension).replace('\\', '/')
+
+
+# File storage that deduplicates uploads by content and never deletes in the request path;
+# files nothing references any more are removed by sweep_unreferenced()
+class ContentAddressedStorage(FileSystemStorage):
+
+    def _save(self, name, content):
+        hashed = content_name(name, content)
+        if self.exists(hashed):
+            try:
+                # Restart the sweep's grace period: the row referencing the reused file isn't saved yet
+                os.utime(self.path(hashed))
+                return hashed
+            except FileNotFoundError:
+                pass  # Swept meanwhile: store it again
+        saved = super()._save(hashed, content)
+        if saved != hashed:
+            # The same content was stored concurrently (Django picked another name); keep the hashed copy
+            super().delete(saved)
+        return hashed
+
+    # Files may be shared by several rows: deletion is left to the sweep
+    def delete(self, name):
+        schedule_sweep()
+
+
+# How many rows reference each stored file (product images and the image URLs copied into orders)
+def reference_counts() -> Counter:
+    counts = Counter(Product.objects.exclude(image='').exclude(image=None).values_list('image', flat=True))
+    for url in OrderItem.objects.exclude(image=None).values_list('image', flat=True):
+        if url.startswith(settings.MEDIA_URL):
+            # Names stored before content addressing may hold characters quoted in the URL
+            counts[unquote(url[len(settings.MEDIA_URL):])] += 1
+    return counts
+
+
+# Delete the files of `directory` nothing references, content-addressed or stored by name before
+# content addressing; files younger than `grace` seconds are kept (an upload is stored before the
+# row that references it is saved)
+def sweep_unreferenced(directory: str = 'products', grace: float = None) -> list:
+    if grace is None:
+        grace = settings.MEDIA_SWEEP_GRACE_SECONDS
+    if not default_storage.exists(directory):
+        return []
+    counts = reference_counts()
+    cutoff = time.time() - grace
+    deleted = []
+    for filename in default_storage.listdir(directory)[1]:
+        name = f'{directory}/{filename}'
+        if counts[name]:
+            continue
+        path = default_storage.path(name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+                deleted.append(name)
+        except FileNotFoundError:
+            pass  # Already removed by another process
+    return deleted
+
+
+_sweep_timer = None
+_sweep_lock = threading.Lock()
+
+
+# Debounced background sweep: many deletions in a row cause a single sweep
+def schedule_sweep():
+    global _sweep_timer
+    delay = settings.MEDIA_SWEEP_DELAY_SECONDS
+    if delay <= 0:
+        return  # Sweeps only run from `manage.py sweepmedia`
+    with _sweep_lock:
+        if _sweep_timer is not None and _sweep_timer.is_alive():
+            return
+        _sweep_timer = threading.Timer(delay, run_sweep)
+        _sweep_timer.daemon = True
+        _sweep_timer.start()
+
+
+def run_sweep():
+    # Rows were just deleted; do not count references on a lagging replica
+    try:
+        with primary_scope():
+            sweep_unreferenced()
+    except Exception as e:
+        logging.error(ERROR_MEDIA_SWEEP + MORE_DETAILS, {'e': e})
+    finally:
+        close_old_connections()
@@ -6,9 +6,14 @@ SUCCESS_NEW_REGISTER = 'Welcome to E-Shop, You should verify your email. Please
 ERROR_USER_EXISTS_IS_NOT_ACTIVE = 'Oops, User with this email already exists but is not active. You should verify your email. Please check your Inbox we sent an activation email.'
 ERROR_USER_EXISTS_IS_ACTIVE_TOO = 'Oops, User with this email already exists and is active too. Please sign in to your account !'
 ERROR_NOT_AUTHORIZED = 'Oops, Not authorized!'
+ERROR_OVERLOADED = 'Oops, The server is busy right now. Please try again in a moment.'
+ERROR_PASSWORD_POOL_BUSY = 'Oops, Too many sign-in requests right now. Please try again in a moment.'
 # Product
 ERROR_PRODUCT_NOT_FOUND = 'Oops, Product not found!'
 ERROR_PRODUCTS_NOT_REGISTERED = 'Oops, No product registered yet!'
+ERROR_MEDIA_SWEEP = 'Sweeping unreferenced media files failed.'
+ERROR_REPEATED_QUERIES = 'Repeated queries (N+1) in'
+ERROR_TRACE_EXPORT = 'Writing trace spans failed.'
 
 
 # Email
@@ -16,6 +21,9 @@ NEW_REGISTER = 'new_register'
 IS_NOT_ACTIVE = 'is_not_active'
 ERROR_ON_SENDING_EMAIL = 'Oops, there is a problem on sending email!'
 EMAIL_SUBJECT = '[ E-Shop Activation Email ]'
+ERROR_EMAIL_QUEUE_DELIVERY = 'Email delivery failed, it will be retried.'
+ERROR_EMAIL_QUEUE_WORKER = 'Email queue worker failed.'
+ACTIVATION_TOKEN_SALT = 'base.utils.activation-token'
 
 
 def EMAIL_BODY(status: str, link: str, name: str) -> str:
@@ -39,6 +47,7 @@ PRODUCT = 'product'
 ERROR_ORDER_ITEMS = 'No order items provided!. Please add items to your order.'
 ERROR_PAYMENT_METHOD = 'Payment method is required.'
 ERROR_PRICES = 'Tax price, shipping price and total price are required.'
+ERROR_OUT_OF_STOCK = 'Oops, Some items are out of stock. Please update your cart.'
 REQUIRED_SHIPPING_FIELDS = [ADDRESS, CITY, COUNTRY, POSTAL_CODE]
 
 
@@ -74,12 +83,15 @@ REF_NO = 'refNumber'
 MSG = 'message'
 INQUIRY = 'inquiry'
 
+PAYMENT_TOKEN_SALT = 'base.zibal.payment-token'
+PAYMENT_TOKEN_SIGNED = 'signed'
+
 IS_PAY_SUCCESSFUL = 'isPaySuccessful'
 IS_INQUIRY_SUCCESSFUL = 'isInquirySuccessful'
 
 
-ZIBAL_DOMAIN_IPG_START_PAY = 'https://gateway.zibal.ir/start/'
-ZIBAL_DOMAIN_IPG = 'https://gateway.zibal.ir/v1/'
+ZIBAL_DOMAIN_IPG_START_PAY = f'{settings.ZIBAL_GATEWAY}start/'
+ZIBAL_DOMAIN_IPG = f'{settings.ZIBAL_GATEWAY}v1/'
 REQUEST_PATH = 'request/'
 VERIFY_PATH = 'verify/'
 INQUIRY_PATH = 'inquiry/'
@@ -114,6 +126,10 @@ def PAY_RESULT_REDIRECT(token: str, db_status: bool | None = None) -> str:
 
 
 # Signal Constants
+ADMIN_ALERT_RECIPIENTS = ["abolfazl.hassanzade.81@gmail.com"]
+ADMIN_ALERT_DIGEST = 'digest'
+
+
 def HTML_TEMPLATE_NEW_USER_ALERT(user) -> str:
     html_content = """
     <html>
@@ -207,5 +223,50 @@ def HTML_TEMPLATE_NEW_ORDER_ALERT(user, order, orderItems, itemsPrice) -> str:
     return html_content
 
 
+def HTML_TEMPLATE_ALERT_DIGEST(stats: dict) -> str:
+    html_content = f"""\
+    <html>
+    <body style="background-color: #152238; color: #E0E0E0; font-family: 'Consolas'; padding: 20px;">
+        <div style="max-width: 600px; margin: 0 auto; background-color: #192841; border-radius: 8px; padding:10px 30px; box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);">
+            <h2 style="
+                padding-bottom:30px;
+                color: #E0E0E0;
+                text-align: center;
+                border-bottom: 2px solid #1c2e4a;">
+                Activity Digest
+            </h2>
+                <p style="color: #E3F2FD;">From: {stats['start'].strftime('%d-%m-%Y %H:%M:%S')}</p>
+                <p style="color: #E3F2FD;">To: {stats['end'].strftime('%d-%m-%Y %H:%M:%S')}</p>
+                <hr style="border: 1px solid #1c2e4a; margin: 10px 0;">
+                <table style="width: 100%; border-collapse: collapse;">
+                    <tbody>
+                        <tr>
+                            <td style="padding: 12px; color: #B0BEC5; border-bottom: 1px solid #1c2e4a;">New Users</td>
+                            <td style="padding: 12px; color: #E3F2FD; border-bottom: 1px solid #1c2e4a;">{stats['users']}</td>
+                        </tr>
+                        <tr style="background-color: #203354;">
+                            <td style="padding: 12px; color: #B0BEC5; border-bottom: 1px solid #1c2e4a;">New Orders</td>
+                            <td style="padding: 12px; color: #E3F2FD; border-bottom: 1px solid #1c2e4a;">{stats['orders']}</td>
+                        </tr>
+                        <tr>
+                            <td style="padding: 12px; color: #B0BEC5; border-bottom: 1px solid #1c2e4a;">Orders Total</td>
+                            <td style="padding: 12px; color: #E3F2FD; border-bottom: 1px solid #1c2e4a;">{stats['total'] or 0}</td>
+                        </tr>
+                        <tr style="background-color: #203354;">
+                            <td style="padding: 12px; color: #B0BEC5; border-bottom: 1px solid #1c2e4a;">Average Order</td>
+                            <td style="padding: 12px; color: #E3F2FD; border-bottom: 1px solid #1c2e4a;">{round(stats['average'] or 0, 2)}</td>
+                        </tr>
+                        <tr>
+                            <td style="padding: 12px; color: #B0BEC5;">Largest Order</td>
+                            <td style="padding: 12px; color: #E3F2FD;">{stats['largest'] or 0}</td>
+                        </tr>
+                    </tbody>
+                </table>
+            </div>
+        </body>
+    </html>\
+    """
+    return html_content
+
 
 ERROR_UNEXPECTED = "Unexpected error occurred."
\ No newline at end of file
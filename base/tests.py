@@ -1,3 +1,1733 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import runpy
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+import requests
+from requests.exceptions import RequestException
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail, signing
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.base import BaseHandler
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.utils import timezone
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from base.models import Product, Review, Order, OrderItem, ShippingAddress, Zibal, PaymentToken, EmailOutbox, AlertEvent
+from base.authentication import user_cache_key
+from base.blacklist import BloomFilter, blacklist_filter
+from base.hashing import BoundedExecutor, PasswordPoolBusy, amake_password
+from base.views import async_user_views
+from base.throttling import TokenBucketStore, parse_rate
+from base.routers import ReplicaRouter, ReplicaRoutingMiddleware, is_pinned, primary_scope, use_primary
+from base.zibal import zibal_apis
+from base.zibal.events import OPEN_STATUSES, StatusStream, payment_events
+from base.zibal.fake_server import parse_weights
+from base.zibal.server_apis import ZibalServerAPIs
+from base import alerts, mailqueue, utils
+from base.signals import order_created
+from base.strConst import ERROR_OVERLOADED, ERROR_OUT_OF_STOCK, ERROR_TRANSACTION_DETAILS_NOT_FOUND, ERROR_UPDATE_TRANSACTION, MORE_DETAILS
+from base.storage import sweep_unreferenced
+from base.instrumentation import MetricsMiddleware, MetricsRegistry, collect, metrics, render, timed
+from base.benchmark.data import generate
+from base.benchmark.driver import fake_gateway, run_routes
+from base.benchmark.routes import ROUTES, RouteContext
+from base.tracing import TracingMiddleware, exporter, parse_traceparent, trace
+from base.admission import AdmissionControlMiddleware, Gate, gate as admission_gate, parse_limit, thread_budget_errors
+from base.logs import BackgroundHandler, RateLimitFilter, RequestContextFilter, RequestIdMiddleware, request_id
+from base.querycheck import NPlusOneMiddleware, QueryRecorder, RepeatedQueriesError, fingerprint
 
-# Create your tests here.
+# Throttle buckets live in a throwaway file, with rates high enough not to trip other tests;
+# queued emails and media sweeps are run by the tests themselves, not by background threads
+THROTTLE_DIR = tempfile.TemporaryDirectory()
+TEST_SETTINGS = override_settings(
+    EMAIL_QUEUE_WORKER='off',
+    MEDIA_SWEEP_DELAY_SECONDS=0,
+    THROTTLE_DB_PATH=f'{THROTTLE_DIR.name}/throttle.sqlite3',
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                    'DEFAULT_THROTTLE_RATES': {'auth_ip': '1000/min', 'auth_account': '1000/min'}},
+)
+
+
+def setUpModule():
+    TEST_SETTINGS.enable()
+
+
+def tearDownModule():
+    TEST_SETTINGS.disable()
+    THROTTLE_DIR.cleanup()
+
+
+# "SCAN <table>" without "USING ... INDEX" is a full table scan
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+# Sorting rows in a temporary b-tree means no index serves the ORDER BY
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+# Statements that read rows (INSERTs and transaction control are skipped)
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE')
+
+
+# Mixin that runs captured queries through SQLite's EXPLAIN QUERY PLAN
+class QueryPlanMixin:
+
+    # Return the EXPLAIN QUERY PLAN detail lines of a statement
+    def explain(self, sql: str) -> list:
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    # Fail if any query executed inside `captured` scans a whole table or sorts without an index
+    def assertNoFullTableScan(self, captured: CaptureQueriesContext, allowed: tuple = ()):
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                continue
+            for detail in self.explain(sql):
+                scan = FULL_SCAN.match(detail)
+                if scan and scan.group(1) not in allowed:
+                    self.fail(f'Full table scan of {scan.group(1)}:\n{sql}')
+                if detail == TEMP_SORT:
+                    self.fail(f'ORDER BY not served by an index:\n{sql}')
+
+
+# Every hot view must be served by indexes, never by full table scans
+# (queries are captured on the primary, so replicas are switched off)
+@override_settings(DATABASE_REPLICAS=[])
+class ViewQueryPlanTests(QueryPlanMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer@test.com', 'buyer@test.com', 'Pass-12345-word')
+        cls.admin = User.objects.create_user('admin@test.com', 'admin@test.com', 'Pass-12345-word',
+                                             is_staff=True)
+        User.objects.bulk_create(
+            User(username=f'user{i}@test.com', email=f'user{i}@test.com') for i in range(20))
+
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=100 + i, countInStock=50, image='products/sample.jpg')
+            for i in range(20))
+        for product in cls.products[:5]:
+            Review.objects.create(product=product, user=cls.user, name='buyer', rating=4)
+
+        for i in range(10):
+            owner = cls.user if i % 2 else cls.admin
+            order = Order.objects.create(user=owner, paymentMethod='Zibal', taxPrice=0,
+                                         shippingPrice=0, totalPrice=200)
+            ShippingAddress.objects.create(order=order, address='Street', city='Tehran',
+                                           country='Iran', postalCode='123')
+            for product in cls.products[i:i + 3]:
+                OrderItem.objects.create(product=product, order=order, name=product.name,
+                                         qty=1, price=product.price, image='/media/products/sample.jpg')
+            Zibal.objects.create(trackId=1000 + i, lastStatus=0, amountCreated=2000,
+                                 order=order, user=owner)
+
+        cls.order = Order.objects.filter(user=cls.user).first()
+        cls.transaction = Zibal.objects.get(order=cls.order)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    # Authenticate the client with a real JWT so the authentication query is explained too
+    def login(self, user: User):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+    def get(self, url: str, allowed: tuple = ()):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertLess(response.status_code, 500, response.content)
+        self.assertNoFullTableScan(captured, allowed)
+        return response
+
+    def test_get_products(self):
+        self.get(reverse('getProducts'))
+
+    def test_get_product(self):
+        self.get(reverse('getProduct', args=[self.products[0]._id]))
+
+    def test_get_user_profile(self):
+        self.login(self.user)
+        self.get(reverse('users-profile'))
+
+    def test_get_users(self):
+        # Listing every user is a deliberate full scan (admin only)
+        self.login(self.admin)
+        self.get(reverse('users'), allowed=('auth_user',))
+
+    def test_get_my_orders(self):
+        self.login(self.user)
+        self.get(reverse('getMyOrders'))
+
+    def test_get_order_by_id(self):
+        self.login(self.user)
+        self.get(reverse('getOrderById', args=[self.order._id]))
+
+    def test_add_order_items(self):
+        self.login(self.user)
+        payload = {
+            'orderItems': [{'product': p._id, 'qty': 1, 'price': str(p.price)} for p in self.products[:3]],
+            'paymentMethod': 'Zibal',
+            'shippingAddress': {'address': 'Street', 'city': 'Tehran', 'country': 'Iran', 'postalCode': '1'},
+            'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 300,
+        }
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('addOrderItems'), payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNoFullTableScan(captured)
+
+    def test_pay_order(self):
+        self.login(self.user)
+        order = Order.objects.create(user=self.user, paymentMethod='Zibal', totalPrice=200)
+        with mock.patch.object(zibal_apis.server_apis, 'request',
+                               return_value={'result': 100, 'trackId': 5000}):
+            self.get(reverse('payOrder', args=[order._id]))
+
+    def test_zibal_callback(self):
+        verify = {'result': 100, 'status': 1, 'amount': 2000, 'refNumber': 1234,
+                  'paidAt': '2025-01-01T10:00:00.000000', 'cardNumber': '603799******1234'}
+        url = reverse('zibalCallback') + (
+            f'?success=1&trackId={self.transaction.trackId}&orderId={self.order._id}&status=2')
+        with mock.patch.object(zibal_apis.server_apis, 'verify', return_value=verify):
+            self.get(url)
+
+    def test_inquiry_pay(self):
+        self.login(self.user)
+        inquiry = {'result': 100, 'status': 1, 'amount': 2000, 'refNumber': 1234,
+                   'paidAt': '2025-01-01T10:00:00.000000'}
+        for mode in ('signed', 'db'):
+            with self.subTest(mode=mode), self.settings(PAYMENT_TOKEN_MODE=mode):
+                token = zibal_apis.database_apis.generate_payment_token(self.order, self.transaction)
+                with mock.patch.object(zibal_apis.server_apis, 'inquiry', return_value=inquiry):
+                    response = self.get(reverse('inquiryPay', args=[token]))
+                self.assertEqual(response.status_code, 200, response.content)
+
+    def test_purge_expired_payment_tokens(self):
+        with CaptureQueriesContext(connection) as captured:
+            zibal_apis.database_apis.purge_expired_payment_tokens()
+        self.assertNoFullTableScan(captured)
+
+
+# Safe reads go to replicas; writes and pinned views stay on the primary for the whole request
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    # Run `view` behind the routing middleware and return what it returned
+    def dispatch(self, method: str, view):
+        middleware = ReplicaRoutingMiddleware(view)
+        return middleware(getattr(self.factory, method)('/'))
+
+    def test_safe_request_reads_from_replica(self):
+        db = self.dispatch('get', lambda request: self.router.db_for_read(Product))
+        self.assertIn(db, ['replica1', 'replica2'])
+
+    def test_unsafe_request_reads_from_primary(self):
+        db = self.dispatch('post', lambda request: self.router.db_for_read(Product))
+        self.assertEqual(db, 'default')
+
+    def test_read_after_write_uses_primary(self):
+        def view(request):
+            self.router.db_for_write(Order)
+            return self.router.db_for_read(Order)
+        self.assertEqual(self.dispatch('get', view), 'default')
+
+    def test_use_primary_pins_view(self):
+        db = self.dispatch('get', use_primary(lambda request: self.router.db_for_read(Order)))
+        self.assertEqual(db, 'default')
+
+    def test_pin_does_not_leak_into_next_request(self):
+        self.dispatch('post', lambda request: None)
+        db = self.dispatch('get', lambda request: self.router.db_for_read(Product))
+        self.assertIn(db, ['replica1', 'replica2'])
+
+    def test_async_read_after_write_uses_primary(self):
+        async def view(request):
+            before = self.router.db_for_read(Order)
+            await sync_to_async(self.router.db_for_write)(Order)
+            return before, self.router.db_for_read(Order)
+
+        middleware = ReplicaRoutingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        before, after = async_to_sync(middleware)(self.factory.get('/'))
+        self.assertIn(before, ['replica1', 'replica2'])
+        self.assertEqual(after, 'default')
+        self.assertFalse(is_pinned())  # The pin ended with the request
+
+    def test_write_outside_a_request_does_not_pin(self):
+        self.router.db_for_write(Order)
+        self.assertFalse(is_pinned())
+        self.assertIn(self.router.db_for_read(Product), ['replica1', 'replica2'])
+
+    def test_primary_scope_pins_background_jobs(self):
+        with primary_scope():
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+        self.assertFalse(is_pinned())
+
+    def test_only_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'base'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'base'))
+
+
+# Authenticated requests resolve the user from the cache after the first hit
+class CachedJWTAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('cached@test.com', 'cached@test.com', 'Pass-12345-word',
+                                            first_name='Cached')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    # Number of queries against auth_user while fetching `url`
+    def user_queries(self, url: str) -> int:
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return sum('"auth_user"' in query['sql'] for query in captured.captured_queries)
+
+    def test_second_request_skips_user_query(self):
+        self.assertEqual(self.user_queries(reverse('users-profile')), 1)
+        self.assertEqual(self.user_queries(reverse('users-profile')), 0)
+
+    def test_cached_user_has_its_own_field_values(self):
+        self.user_queries(reverse('users-profile'))
+        response = self.client.get(reverse('users-profile'))
+        self.assertEqual(response.data['name'], 'Cached')
+        self.assertEqual(response.data['email'], 'cached@test.com')
+        self.assertFalse(response.data['isAdmin'])
+
+    def test_user_save_invalidates_cache(self):
+        self.user_queries(reverse('users-profile'))
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        response = self.client.get(reverse('users-profile'))
+        self.assertEqual(response.data['name'], 'Renamed')
+
+    def test_inactive_cached_user_is_rejected(self):
+        self.user_queries(reverse('users-profile'))
+        key = user_cache_key(self.user.pk)
+        cache.set(key, {**cache.get(key), 'is_active': False})
+        response = self.client.get(reverse('users-profile'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_profile_update_from_cached_user_keeps_other_fields(self):
+        self.user_queries(reverse('users-profile'))
+        response = self.client.put(reverse('user-profile-update'), {
+            'name': 'Updated', 'email': 'cached@test.com', 'password': ''}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.first_name, 'Updated')
+        self.assertEqual(user.date_joined, self.user.date_joined)
+        self.assertTrue(user.check_password('Pass-12345-word'))
+        self.assertTrue(user.is_active)
+        self.assertFalse(user.is_staff)
+
+
+# Refreshing only queries the blacklist when the in-memory filter can't rule the token out
+class BlacklistFilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('refresh@test.com', 'refresh@test.com', 'Pass-12345-word')
+
+    def setUp(self):
+        self.client = APIClient()
+        blacklist_filter.bloom = None  # Warm from this test's database
+
+    def login(self) -> str:
+        response = self.client.post(reverse('token-obtain-pair'), {
+            'username': 'refresh@test.com', 'password': 'Pass-12345-word'}, format='json')
+        return response.data['refresh']
+
+    def refresh(self, token: str):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(reverse('token-refresh'), {'refresh': token}, format='json')
+        checks = [q for q in captured.captured_queries
+                  if 'token_blacklist_blacklistedtoken' in q['sql'] and q['sql'].startswith('SELECT 1')]
+        return response, len(checks)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        items = [f'jti-{i}' for i in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_fresh_token_skips_blacklist_query(self):
+        token = self.login()
+        blacklist_filter.sync(force=True)
+        response, checks = self.refresh(token)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(checks, 0)
+
+    def test_rotated_token_is_rejected(self):
+        token = self.login()
+        self.assertEqual(self.refresh(token)[0].status_code, 200)
+        response, checks = self.refresh(token)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(checks, 1)
+
+    def test_token_blacklisted_elsewhere_is_picked_up_on_sync(self):
+        token = self.login()
+        blacklist_filter.sync(force=True)
+        # Simulate another worker: the row exists but this process never saw the signal
+        outstanding = OutstandingToken.objects.get(jti=RefreshToken(token)['jti'])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        blacklist_filter.sync(force=True)
+        self.assertEqual(self.refresh(token)[0].status_code, 401)
+
+    def test_token_blacklisted_elsewhere_is_rejected_after_the_sync_interval(self):
+        token = self.login()
+        blacklist_filter.sync(force=True)
+        outstanding = OutstandingToken.objects.get(jti=RefreshToken(token)['jti'])
+        BlacklistedToken.objects.bulk_create([BlacklistedToken(token=outstanding)])
+        blacklist_filter.synced_at -= settings.JWT_BLACKLIST_SYNC_SECONDS
+        self.assertEqual(self.refresh(token)[0].status_code, 401)
+
+    def test_readers_do_not_wait_for_a_sync(self):
+        blacklist_filter.sync(force=True)
+        blacklist_filter.synced_at = 0.0
+        # Another thread is reading the database: readers answer from the current filter
+        with blacklist_filter.refreshing, CaptureQueriesContext(connection) as captured:
+            self.assertFalse(blacklist_filter.might_contain('jti'))
+        self.assertEqual(len(captured.captured_queries), 0)
+
+    def test_prune_runs_in_the_mail_worker(self):
+        self.login()
+        OutstandingToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertIn(blacklist_filter.prune_due, mailqueue.periodic_tasks)
+        self.assertFalse(blacklist_filter.prune_due())
+        blacklist_filter.pruned_at -= settings.JWT_BLACKLIST_PRUNE_SECONDS
+        self.assertTrue(blacklist_filter.prune_due())
+        self.assertFalse(OutstandingToken.objects.exists())
+
+    def test_prune_deletes_expired_tokens(self):
+        self.login()
+        OutstandingToken.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        blacklist_filter.prune()
+        self.assertFalse(OutstandingToken.objects.exists())
+        self.assertIsNotNone(blacklist_filter.bloom)
+        self.assertFalse(blacklist_filter.might_contain('jti'))
+
+    def test_rebuild_swaps_in_a_complete_filter(self):
+        token = self.login()
+        self.assertEqual(self.refresh(token)[0].status_code, 200)
+        jti = RefreshToken(token, verify=False)['jti']
+        seen = []
+        fill = blacklist_filter.fill
+
+        # Readers during the rebuild still see the previous, complete filter
+        def read_while_filling(bloom, queryset):
+            seen.append(blacklist_filter.might_contain(jti))
+            return fill(bloom, queryset)
+
+        blacklist_filter.sync(force=True)
+        with mock.patch.object(blacklist_filter, 'fill', side_effect=read_while_filling), \
+                self.settings(JWT_BLACKLIST_SYNC_SECONDS=60):
+            blacklist_filter.rebuild()
+        self.assertEqual(seen, [True])
+        self.assertTrue(blacklist_filter.might_contain(jti))
+
+
+# Registration, activation and login write no redundant token rows
+class TokenIssuingTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def register(self):
+        return self.client.post(reverse('register'), {
+            'name': 'New', 'email': 'new@test.com', 'password': 'Pass-12345-word'}, format='json')
+
+    def test_register_and_activate_without_token_rows(self):
+        self.assertEqual(self.register().status_code, 201)
+        user = User.objects.get(email='new@test.com')
+        self.assertFalse(user.is_active)
+        self.assertFalse(OutstandingToken.objects.exists())
+
+        response = self.client.get(reverse('verifyEmail', args=[utils.createActivationToken(user)]))
+        self.assertTrue(response['Location'].endswith('token=valid'))
+        self.assertTrue(User.objects.get(pk=user.pk).is_active)
+
+    def test_tampered_activation_token_is_rejected(self):
+        self.register()
+        token = utils.createActivationToken(User.objects.get(email='new@test.com')) + 'x'
+        response = self.client.get(reverse('verifyEmail', args=[token]))
+        self.assertTrue(response['Location'].endswith('token=invalid'))
+
+    def test_login_reuses_issued_access_token(self):
+        User.objects.create_user('login@test.com', 'login@test.com', 'Pass-12345-word')
+        response = self.client.post(reverse('token-obtain-pair'), {
+            'username': 'login@test.com', 'password': 'Pass-12345-word'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['token'], response.data['access'])
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+
+
+# Login, register and password change are rate limited per IP and per account
+class AuthThrottleTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        User.objects.create_user('login@test.com', 'login@test.com', 'Pass-12345-word')
+
+    def login(self, username, password='wrong'):
+        return self.client.post(reverse('token-obtain-pair'), {
+            'username': username, 'password': password}, format='json')
+
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('5/min'), (5, 5 / 60))
+        self.assertEqual(parse_rate('100/hour'), (100, 100 / 3600))
+
+    def test_bucket_refills_over_time(self):
+        store = TokenBucketStore()
+        with mock.patch('base.throttling.time.time', return_value=1000.0):
+            self.assertEqual(store.consume('test:refill', 2, 1), 0)
+            self.assertEqual(store.consume('test:refill', 2, 1), 0)
+            self.assertAlmostEqual(store.consume('test:refill', 2, 1), 1)
+        with mock.patch('base.throttling.time.time', return_value=1001.0):
+            self.assertEqual(store.consume('test:refill', 2, 1), 0)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                       'DEFAULT_THROTTLE_RATES': {'auth_ip': '100/min', 'auth_account': '3/min'}})
+    def test_account_bucket_rejects_with_retry_after(self):
+        for _ in range(3):
+            self.assertEqual(self.login('Account@test.com').status_code, 401)
+        response = self.login('account@test.com ')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # Other accounts from the same IP still get through
+        self.assertEqual(self.login('login@test.com', 'Pass-12345-word').status_code, 200)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                       'DEFAULT_THROTTLE_RATES': {'auth_ip': '100/min', 'auth_account': '3/min'}})
+    def test_account_bucket_cannot_lock_out_the_owner(self):
+        self.client.defaults['REMOTE_ADDR'] = '10.0.0.7'
+        for _ in range(4):
+            self.login('login@test.com')
+        self.assertEqual(self.login('login@test.com').status_code, 429)
+        # The owner, on another address, still logs in
+        self.client.defaults['REMOTE_ADDR'] = '10.0.0.8'
+        self.assertEqual(self.login('login@test.com', 'Pass-12345-word').status_code, 200)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                       'DEFAULT_THROTTLE_RATES': {'auth_ip': '2/min', 'auth_account': '100/min'}})
+    def test_forwarded_for_does_not_reset_the_ip_bucket(self):
+        self.client.defaults['REMOTE_ADDR'] = '10.0.0.6'
+        for i in range(2):
+            self.login(f'user{i}@test.com')
+        response = self.client.post(reverse('token-obtain-pair'), {
+            'username': 'user2@test.com', 'password': 'wrong'}, format='json', HTTP_X_FORWARDED_FOR='203.0.113.5')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                       'DEFAULT_THROTTLE_RATES': {'auth_ip': '2/min', 'auth_account': '100/min'}})
+    def test_ip_bucket_covers_register(self):
+        self.client.defaults['REMOTE_ADDR'] = '10.0.0.9'
+        for i in range(2):
+            self.login(f'user{i}@test.com')
+        response = self.client.post(reverse('register'), {
+            'name': 'New', 'email': 'new@test.com', 'password': 'Pass-12345-word'}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(User.objects.filter(email='new@test.com').exists())
+
+
+# The async auth views hash and verify passwords in the bounded password pool
+class AsyncAuthViewTests(TestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+
+    def call(self, view, method, data, user=None):
+        request = getattr(self.factory, method)('/', data, format='json')
+        if user is not None:
+            request.META['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(user)}'
+        response = async_to_sync(view)(request)
+        response.render()
+        return response
+
+    def test_login(self):
+        User.objects.create_user('login@test.com', 'login@test.com', 'Pass-12345-word')
+        view = async_user_views.MyTokenObtainPairView.as_view()
+        response = self.call(view, 'post', {'username': 'login@test.com', 'password': 'Pass-12345-word'})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.data['token'], response.data['access'])
+        self.assertEqual(response.data['email'], 'login@test.com')
+
+        response = self.call(view, 'post', {'username': 'login@test.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = self.call(view, 'post', {'username': 'nobody@test.com', 'password': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.call(view, 'post', {'username': 'login@test.com'}).status_code, 400)
+
+    def test_register_and_update_profile(self):
+        response = self.call(async_user_views.registerUser, 'post', {
+            'name': 'New', 'email': 'new@test.com', 'password': 'Pass-12345-word'})
+        self.assertEqual(response.status_code, 201, response.content)
+        user = User.objects.get(email='new@test.com')
+        self.assertFalse(user.is_active)
+        self.assertTrue(user.check_password('Pass-12345-word'))
+        user.is_active = True
+        user.save()
+
+        response = self.call(async_user_views.updateUserProfile, 'put', {
+            'name': 'Renamed', 'email': 'new@test.com', 'password': 'Other-12345-word'}, user=user)
+        self.assertEqual(response.status_code, 200, response.content)
+        user.refresh_from_db()
+        self.assertEqual(user.first_name, 'Renamed')
+        self.assertTrue(user.check_password('Other-12345-word'))
+
+    def test_update_profile_requires_authentication(self):
+        response = self.call(async_user_views.updateUserProfile, 'put', {
+            'name': 'x', 'email': 'x@test.com', 'password': ''})
+        self.assertEqual(response.status_code, 401, response.content)
+
+    def test_hashing_runs_in_password_pool(self):
+        threads = []
+
+        def record(password):
+            threads.append(threading.current_thread().name)
+            return 'hash'
+
+        with mock.patch('base.hashing.make_password', record):
+            self.assertEqual(async_to_sync(amake_password)('secret'), 'hash')
+        self.assertTrue(threads[0].startswith('password'))
+
+    def test_full_pool_refuses_work(self):
+        executor = BoundedExecutor(max_workers=1, queue_size=1)
+        release = threading.Event()
+        running = executor.submit(release.wait)
+        queued = executor.submit(lambda: None)
+        with self.assertRaises(PasswordPoolBusy):
+            executor.submit(lambda: None)
+        release.set()
+        running.result()
+        queued.result()
+        # Slots are released once jobs finish
+        executor.submit(lambda: None).result()
+
+    def test_middleware_chain_stays_async_under_asgi(self):
+        adapted = []
+        adapt_method_mode = BaseHandler.adapt_method_mode
+
+        # Record every middleware Django has to wrap in sync_to_async/async_to_sync
+        def spy(handler, is_async, method, method_is_async=None, debug=False, name=None):
+            if method_is_async is None:
+                method_is_async = iscoroutinefunction(method)
+            if name and is_async != method_is_async:
+                adapted.append(name)
+            return adapt_method_mode(handler, is_async, method, method_is_async, debug, name)
+
+        with mock.patch.object(BaseHandler, 'adapt_method_mode', spy):
+            ASGIHandler()
+        self.assertEqual(adapted, [])
+
+
+# Emails are queued in the request and delivered in batches over one SMTP session
+class MailQueueTests(TestCase):
+
+    def test_registration_queues_instead_of_sending(self):
+        response = APIClient().post(reverse('register'), {
+            'name': 'New', 'email': 'new@test.com', 'password': 'Pass-12345-word'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        # Activation email and admin alert
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+
+        mailqueue.drain()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['abolfazl.hassanzade.81@gmail.com', 'new@test.com'])
+        self.assertFalse(EmailOutbox.objects.exists())
+
+    def test_batch_reuses_one_connection(self):
+        for i in range(3):
+            mailqueue.enqueue('Subject', 'Body', [f'user{i}@test.com'], html='<p>Body</p>')
+        with mock.patch('base.mailqueue.get_connection', wraps=mailqueue.get_connection) as get_connection:
+            self.assertEqual(mailqueue.deliver_batch(), 3)
+        get_connection.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+
+    def test_failed_delivery_backs_off_then_gives_up(self):
+        message = mailqueue.enqueue('Subject', 'Body', ['user@test.com'])
+        with mock.patch('base.mailqueue.EmailMultiAlternatives.send', side_effect=OSError('smtp down')), \
+                self.assertLogs(level='ERROR'):
+            mailqueue.deliver_batch()
+            message.refresh_from_db()
+            self.assertEqual(message.attempts, 1)
+            self.assertEqual(message.lastError, 'smtp down')
+            self.assertGreater(message.nextAttemptAt, timezone.now())
+            # Not due again until the backoff has passed
+            self.assertEqual(mailqueue.deliver_batch(), 0)
+
+            EmailOutbox.objects.update(nextAttemptAt=timezone.now(), attempts=settings.EMAIL_QUEUE_MAX_ATTEMPTS - 1)
+            mailqueue.deliver_batch()
+        message.refresh_from_db()
+        self.assertEqual(message.status, EmailOutbox.FAILED)
+        self.assertEqual(mailqueue.deliver_batch(), 0)
+
+
+# In digest mode admin alerts are collected and sent as one summary email
+@override_settings(ADMIN_ALERT_MODE='digest', ADMIN_ALERT_DIGEST_THRESHOLD=3, ADMIN_ALERT_DIGEST_SECONDS=300)
+class AlertDigestTests(TestCase):
+
+    def test_threshold_sends_one_summary(self):
+        user = User.objects.create_user('a@test.com', 'a@test.com', 'Pass-12345-word')
+        User.objects.create_user('b@test.com', 'b@test.com', 'Pass-12345-word')
+        self.assertFalse(EmailOutbox.objects.exists())
+        self.assertFalse(alerts.flush_due())
+
+        order = Order.objects.create(user=user, totalPrice='120.50')
+        order_created.send(sender=Order, order=order, user=user)
+        mailqueue.drain()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('2 NEW USERS, 1 NEW ORDERS', mail.outbox[0].subject)
+        self.assertIn('120.50', mail.outbox[0].alternatives[0][0])
+        self.assertFalse(AlertEvent.objects.exists())
+
+    def test_window_flushes_below_threshold(self):
+        User.objects.create_user('a@test.com', 'a@test.com', 'Pass-12345-word')
+        self.assertFalse(alerts.flush_due())
+        AlertEvent.objects.update(createdAt=timezone.now() - timedelta(seconds=301))
+        self.assertTrue(alerts.flush_due())
+        self.assertEqual(EmailOutbox.objects.count(), 1)
+        self.assertFalse(alerts.flush_due())
+
+    @override_settings(EMAIL_QUEUE_WORKER='thread')
+    def test_batch_below_threshold_starts_the_worker(self):
+        with mock.patch.object(mailqueue.mail_worker, 'start') as start, \
+                mock.patch.object(mailqueue.mail_worker, 'wake') as wake, \
+                self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user('a@test.com', 'a@test.com', 'Pass-12345-word')
+        start.assert_called_once()
+        wake.assert_not_called()
+
+        # Started without being woken: the first pass runs after the poll interval
+        worker = mailqueue.MailWorker()
+        with mock.patch.object(worker, 'run') as run:
+            self.assertTrue(worker.start())
+            worker.thread.join()
+        run.assert_called_once()
+        self.assertFalse(worker.event.is_set())
+
+    @override_settings(ADMIN_ALERT_MODE='immediate')
+    def test_immediate_mode_sends_per_event(self):
+        User.objects.create_user('a@test.com', 'a@test.com', 'Pass-12345-word')
+        self.assertEqual(EmailOutbox.objects.get().subject, 'E-SHOP | NEW USER')
+        self.assertFalse(AlertEvent.objects.exists())
+
+
+# Product images are stored once per distinct content and swept when nothing references them
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def product(self, filename, content=b'same image bytes'):
+        return Product.objects.create(name=filename, image=SimpleUploadedFile(filename, content))
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.product('a.PNG')
+        second = self.product('b.png')
+        other = self.product('c.png', b'other image bytes')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertRegex(first.image.name, r'^products/[0-9a-f]{64}\.png$')
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(len(default_storage.listdir('products')[1]), 2)
+
+    def test_reused_file_gets_a_new_grace_period(self):
+        name = default_storage.save('products/a.png', SimpleUploadedFile('a.png', b'same image bytes'))
+        old = time.time() - 3600
+        os.utime(default_storage.path(name), (old, old))
+        # A new upload of the same content, its product not saved yet
+        self.assertEqual(default_storage.save('products/b.png', SimpleUploadedFile('b.png', b'same image bytes')), name)
+        self.assertEqual(sweep_unreferenced(grace=60), [])
+        self.assertTrue(default_storage.exists(name))
+
+    def test_sweep_keeps_referenced_files(self):
+        first = self.product('a.png')
+        second = self.product('b.png')
+        name = first.image.name
+        first.delete()
+        self.assertEqual(sweep_unreferenced(grace=0), [])
+        self.assertTrue(default_storage.exists(name))
+
+        # Orders keep the images of the products they were placed with
+        OrderItem.objects.create(name='b', image=second.image.url)
+        second.delete()
+        self.assertEqual(sweep_unreferenced(grace=0), [])
+        OrderItem.objects.all().delete()
+        # Fresh files are kept for the grace period
+        self.assertEqual(sweep_unreferenced(grace=3600), [])
+        self.assertEqual(sweep_unreferenced(grace=0), [name])
+        self.assertFalse(default_storage.exists(name))
+
+    def test_sweep_removes_files_stored_before_content_addressing(self):
+        os.makedirs(f'{settings.MEDIA_ROOT}/products')
+        for filename in ('legacy one.png', 'kept.png', 'ordered.png'):
+            with open(f'{settings.MEDIA_ROOT}/products/{filename}', 'wb') as file:
+                file.write(filename.encode())
+        legacy = Product.objects.create(name='legacy', image='products/legacy one.png')
+        Product.objects.create(name='kept', image='products/kept.png')
+        OrderItem.objects.create(name='ordered', image=settings.MEDIA_URL + 'products/ordered.png')
+        self.assertEqual(sweep_unreferenced(grace=0), [])
+        # Orders placed with a deleted product keep its file (its URL is quoted)
+        OrderItem.objects.create(name='legacy', image=legacy.image.url)
+        legacy.delete()
+        self.assertEqual(sweep_unreferenced(grace=0), [])
+        OrderItem.objects.filter(name='legacy').delete()
+        self.assertEqual(sweep_unreferenced(grace=0), ['products/legacy one.png'])
+        self.assertEqual(sorted(default_storage.listdir('products')[1]), ['kept.png', 'ordered.png'])
+
+
+# Media is served with validators, immutable caching for hashed names, ranges and proxy offload
+class MediaServingTests(TestCase):
+    NAME = 'products/' + 'a' * 64 + '.png'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        os.makedirs(f'{media.name}/products')
+        # Stored by name before content addressing
+        with open(f'{media.name}/products/legacy.png', 'wb') as file:
+            file.write(b'legacy')
+        with open(f'{media.name}/{self.NAME}', 'wb') as file:
+            file.write(b'0123456789')
+        self.url = reverse('media', args=[self.NAME])
+
+    def test_full_response(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['ETag'], '"' + 'a' * 64 + '"')
+        legacy = self.client.get(reverse('media', args=['products/legacy.png']))
+        self.assertNotIn('immutable', legacy['Cache-Control'])
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        # A stale If-Range gets the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_and_missing(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(reverse('media', args=['products/missing.png'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('media', args=['../settings.py'])).status_code, 404)
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+    def test_proxy_modes(self):
+        with override_settings(MEDIA_SERVE_MODE='x-accel', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.NAME}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('immutable', response['Cache-Control'])
+        with override_settings(MEDIA_SERVE_MODE='x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertTrue(response['X-Sendfile'].endswith(self.NAME))
+
+
+# Latency, query and outbound call metrics are exported in Prometheus format to staff
+class MetricsTests(TestCase):
+
+    def test_staff_only_endpoint_reports_views(self):
+        client = APIClient()
+        client.get(reverse('getProducts'))
+        self.assertIn(client.get(reverse('metrics')).status_code, (401, 403))
+
+        staff = User.objects.create_user('staff@test.com', 'staff@test.com', 'Pass-12345-word', is_staff=True)
+        client.force_authenticate(staff)
+        response = client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', text)
+        self.assertIn('http_requests_total{method="GET",status="200",view="getProducts"}', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="getProducts",le="+Inf"}', text)
+        self.assertIn('db_queries_total{view="getProducts"}', text)
+
+    def test_async_view_queries_are_counted(self):
+        async def view(request):
+            await sync_to_async(list)(Product.objects.all())
+            await Product.objects.acount()
+            return HttpResponse()
+
+        middleware = MetricsMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/'))
+        self.assertIn('db;desc="2 queries"', response['Server-Timing'])
+
+    def test_outbound_calls_are_timed(self):
+        with self.assertRaises(OSError), timed('smtp', 'test'):
+            raise OSError('down')
+        text = render(metrics.snapshot())
+        self.assertIn('outbound_call_errors_total{operation="test",service="smtp"}', text)
+        self.assertIn('outbound_call_duration_seconds_count{operation="test",service="smtp"} ', text)
+
+    def test_worker_snapshots_are_added_together(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(METRICS_DIR=directory.name):
+            for pid in (1, 2):
+                worker = MetricsRegistry()
+                worker.inc('db_queries_total', {'view': 'merged'}, 3)
+                worker.observe('http_request_duration_seconds', {'view': 'merged'}, 0.2)
+                with open(f'{directory.name}/{pid}.json', 'w') as file:
+                    file.write(json.dumps(worker.snapshot()))
+            text = render(collect())
+        self.assertIn('db_queries_total{view="merged"} 6.0', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="merged",le="0.25"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="merged",le="0.1"} 0', text)
+        self.assertIn('http_request_duration_seconds_count{view="merged"} 2', text)
+
+
+# Responses break their time down in Server-Timing; staff can ask for a cProfile trace
+class ServerTimingTests(TestCase):
+
+    def setUp(self):
+        self.staff = User.objects.create_user('staff@test.com', 'staff@test.com', 'Pass-12345-word', is_staff=True)
+        self.user = User.objects.create_user('user@test.com', 'user@test.com', 'Pass-12345-word')
+        profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(profiles.cleanup)
+        self.profiles = profiles.name
+
+    def get(self, user=None, **headers):
+        if user is not None:
+            headers['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(user)}'
+        return self.client.get(reverse('getProducts'), **headers)
+
+    def test_server_timing_header(self):
+        Product.objects.create(name='p', price=1)
+        header = self.get()['Server-Timing']
+        self.assertRegex(header, r'^db;desc="1 queries";dur=[\d.]+, serialization;dur=[\d.]+, '
+                                 r'gateway;dur=0.0, email;dur=0.0, total;dur=[\d.]+$')
+
+    def test_staff_profiling_on_request(self):
+        with override_settings(PROFILE_DIR=self.profiles, PROFILE_KEEP=1):
+            self.assertNotIn('X-Profile-Id', self.get(self.user, HTTP_X_PROFILE='1'))
+            self.assertNotIn('X-Profile-Id', self.get(self.staff))
+            first = self.get(self.staff, HTTP_X_PROFILE='1')['X-Profile-Id']
+            second = self.get(self.staff, HTTP_X_PROFILE='1')['X-Profile-Id']
+        self.assertIn('getProducts', second)
+        # Older profiles are rotated out
+        self.assertEqual(os.listdir(self.profiles), [second])
+        self.assertNotEqual(first, second)
+
+    def test_sampled_profiling(self):
+        with override_settings(PROFILE_DIR=self.profiles, PROFILE_SAMPLE_RATE=1.0):
+            name = self.get()['X-Profile-Id']
+        pstats.Stats(os.path.join(self.profiles, name))
+
+
+# Mixin failing a test when the number of queries of a request grows with the data it returns
+class QueryScalingMixin:
+
+    # Run `request` before and after `grow` adds rows: the query count must not change
+    # (a first, unmeasured request fills the caches, e.g. of the authenticated user)
+    def assertConstantQueries(self, request, grow):
+        request()
+        with QueryRecorder() as small:
+            request()
+        grow()
+        with QueryRecorder() as large:
+            request()
+        if large.total != small.total:
+            self.fail(f'{small.total} queries before growing, {large.total} after; repeated:\n{large.report(2)}')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class NPlusOneTests(QueryScalingMixin, TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer@test.com', 'buyer@test.com', 'Pass-12345-word')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=100, countInStock=50, image='products/sample.jpg') for i in range(5))
+
+    def create_orders(self, count: int):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user, paymentMethod='Zibal', totalPrice=200)
+            ShippingAddress.objects.create(order=order, address='Street', city='Tehran', country='Iran', postalCode='1')
+            for product in self.products[:2]:
+                OrderItem.objects.create(product=product, order=order, name=product.name, qty=1, price=100)
+
+    def add_order(self, products: list):
+        payload = {
+            'orderItems': [{'product': p._id, 'qty': 2, 'price': '100'} for p in products],
+            'paymentMethod': 'Zibal',
+            'shippingAddress': {'address': 'Street', 'city': 'Tehran', 'country': 'Iran', 'postalCode': '1'},
+            'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 200,
+        }
+        response = self.client.post(reverse('addOrderItems'), payload, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT * FROM t WHERE id = 5 AND name = \'a\'\'b\''),
+                         fingerprint('SELECT * FROM t WHERE id = 12  AND name = \'c\''))
+        self.assertEqual(fingerprint('SELECT * FROM t1 WHERE id IN (%s, %s, %s)'),
+                         'SELECT * FROM t1 WHERE id IN (...)')
+
+    def test_my_orders(self):
+        self.create_orders(1)
+        self.assertConstantQueries(lambda: self.client.get(reverse('getMyOrders')), lambda: self.create_orders(4))
+
+    def test_add_order_items(self):
+        products = self.products[:1]
+        self.assertConstantQueries(lambda: self.add_order(products), lambda: products.extend(self.products[1:]))
+        self.assertEqual(OrderItem.objects.count(), 7)
+        self.assertEqual(Product.objects.get(_id=self.products[0]._id).countInStock, 44)
+        self.assertEqual(Product.objects.get(_id=self.products[4]._id).countInStock, 48)
+
+    def test_order_by_id_is_not_flagged(self):
+        self.create_orders(1)
+        order = Order.objects.get()
+        with self.settings(NPLUSONE_DETECTION=True, NPLUSONE_THRESHOLD=2, NPLUSONE_RAISE=True):
+            self.assertEqual(self.client.get(reverse('getOrderById', args=[order._id])).status_code, 200)
+
+    def test_middleware_reports_repeated_queries(self):
+        def get_response(request):
+            for product in self.products:
+                Product.objects.get(_id=product._id)
+            return None
+
+        middleware = NPlusOneMiddleware(get_response)
+        request = RequestFactory().get('/api/products/')
+        with self.settings(NPLUSONE_DETECTION=True, NPLUSONE_THRESHOLD=5):
+            with self.assertLogs(level='WARNING') as logs:
+                middleware(request)
+            with self.settings(NPLUSONE_RAISE=True), self.assertRaises(RepeatedQueriesError):
+                middleware(request)
+        self.assertIn('5x SELECT', logs.output[0])
+        # The report points at the code that issued the queries
+        self.assertIn('tests.py', logs.output[0])
+        self.assertIn('get_response', logs.output[0])
+
+    def test_async_middleware_reports_repeated_queries(self):
+        async def get_response(request):
+            for product in self.products:
+                await Product.objects.aget(_id=product._id)
+            return None
+
+        middleware = NPlusOneMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        with self.settings(NPLUSONE_DETECTION=True, NPLUSONE_THRESHOLD=5, NPLUSONE_RAISE=True):
+            with self.assertRaisesMessage(RepeatedQueriesError, '5x SELECT'):
+                async_to_sync(middleware)(RequestFactory().get('/api/products/'))
+
+
+# Requests are traced into a JSONL file: a root span per request, children for queries,
+# serializers and gateway calls, continuing (and propagating) the caller's traceparent
+class TracingTests(TestCase):
+    TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+    PARENT_ID = '00f067aa0ba902b7'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        tracing = override_settings(TRACE_FILE=f'{directory.name}/spans.jsonl', TRACE_FLUSH_SECONDS=0)
+        tracing.enable()
+        self.addCleanup(tracing.disable)
+
+    def spans(self) -> list:
+        exporter.flush()
+        with open(settings.TRACE_FILE) as file:
+            return [json.loads(line) for line in file]
+
+    def test_request_continues_incoming_trace(self):
+        Product.objects.create(name='p', price=1)
+        response = self.client.get(reverse('getProducts'),
+                                   HTTP_TRACEPARENT=f'00-{self.TRACE_ID}-{self.PARENT_ID}-01')
+        spans = self.spans()
+        root = next(span for span in spans if span['parent'] == self.PARENT_ID)
+        self.assertEqual(response['traceresponse'], f'00-{self.TRACE_ID}-{root["span"]}-01')
+        self.assertEqual(root['attributes']['status'], 200)
+        self.assertEqual(root['attributes']['view'], 'getProducts')
+        names = {span['name'] for span in spans if span['parent'] == root['span']}
+        self.assertIn('db', names)
+        self.assertIn('serialize ProductSerializer', names)
+        self.assertIn('render json', names)
+        self.assertTrue(all(span['trace'] == self.TRACE_ID for span in spans))
+
+    def test_async_request_traces_its_queries(self):
+        async def view(request):
+            await Product.objects.acount()
+            return HttpResponse()
+
+        middleware = TracingMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().get('/', HTTP_TRACEPARENT=f'00-{self.TRACE_ID}-{self.PARENT_ID}-01')
+        response = async_to_sync(middleware)(request)
+        spans = self.spans()
+        root = next(span for span in spans if span['parent'] == self.PARENT_ID)
+        self.assertEqual(response['traceresponse'], f'00-{self.TRACE_ID}-{root["span"]}-01')
+        self.assertEqual([span['name'] for span in spans if span['parent'] == root['span']], ['db'])
+
+    def test_unsampled_trace_is_not_recorded(self):
+        response = self.client.get(reverse('getProducts'),
+                                   HTTP_TRACEPARENT=f'00-{self.TRACE_ID}-{self.PARENT_ID}-00')
+        self.assertNotIn('traceresponse', response)
+        with override_settings(TRACE_SAMPLE_RATE=0):
+            self.assertNotIn('traceresponse', self.client.get(reverse('getProducts')))
+        exporter.flush()
+        self.assertFalse(os.path.exists(settings.TRACE_FILE))
+
+    def test_gateway_call_propagates_traceparent(self):
+        with mock.patch('requests.post') as post, trace('checkout') as root:
+            post.return_value.json.return_value = {'result': 100}
+            ZibalServerAPIs().postTo('/v1/request', {})
+        headers = post.call_args.kwargs['headers']
+        trace_id, parent_id, sampled = parse_traceparent(headers['traceparent'])
+        self.assertEqual(trace_id, root.trace_id)
+        self.assertTrue(sampled)
+        call = next(span for span in self.spans() if span['span'] == parent_id)
+        self.assertEqual((call['name'], call['parent']), ('zibal v1/request', root.span_id))
+
+    def test_parse_traceparent(self):
+        self.assertEqual(parse_traceparent(f'00-{self.TRACE_ID}-{self.PARENT_ID}-01'),
+                         (self.TRACE_ID, self.PARENT_ID, True))
+        for header in (None, '', 'garbage', f'00-{"0" * 32}-{self.PARENT_ID}-01', f'01-{self.TRACE_ID}-{self.PARENT_ID}-01'):
+            self.assertIsNone(parse_traceparent(header))
+
+
+# The fake gateway answers the Zibal API like the real one, and loadcheckout drives full
+# checkout-to-paid flows against a running app wired to it
+@override_settings(BACKEND_DOMAIN='http://testserver', DATABASE_REPLICAS=[])
+class FakeZibalTests(LiveServerTestCase):
+
+    def test_gateway_flow(self):
+        with fake_gateway() as gateway:
+            order = Order.objects.create(user=User.objects.create_user('fake@test.com'), totalPrice=200)
+            res = zibal_apis.server_apis.request(order)
+            self.assertEqual(res['result'], 100)
+            trackId = res['trackId']
+            # The payment page sends the browser back to the callback with the outcome
+            page = requests.get(f'{gateway.url}start/{trackId}/', allow_redirects=False, timeout=5)
+            self.assertEqual(page.status_code, 302)
+            query = parse_qs(urlsplit(page.headers['Location']).query)
+            self.assertEqual((query['success'], query['status'], query['orderId']), (['1'], ['2'], [str(order._id)]))
+
+            self.assertEqual(zibal_apis.server_apis.verify(trackId)['result'], 100)
+            self.assertEqual(zibal_apis.server_apis.verify(trackId)['result'], 201)
+            inquiry = zibal_apis.server_apis.inquiry(trackId)
+            self.assertEqual((inquiry['result'], inquiry['status']), (100, 1))
+            self.assertEqual(zibal_apis.server_apis.verify(trackId + 1)['result'], 203)
+
+            # Forced result codes and payment outcomes
+            gateway.config.pay_statuses = parse_weights('3:1')
+            gateway.config.inquiry_results = parse_weights('203')
+            trackId = zibal_apis.server_apis.request(order)['trackId']
+            requests.get(f'{gateway.url}start/{trackId}/', allow_redirects=False, timeout=5)
+            self.assertEqual(zibal_apis.server_apis.verify(trackId), {
+                'result': 202, 'message': ZibalServerAPIs().result_code_translator(202), 'status': 3})
+            self.assertEqual(zibal_apis.server_apis.inquiry(trackId)['result'], 203)
+
+    def test_invalid_weights_are_rejected(self):
+        with self.assertRaisesMessage(CommandError, 'Unknown codes for --verify-results: [999]'):
+            call_command('fakezibal', verify_results='999:1')
+
+    def test_loadcheckout(self):
+        user = User.objects.create_user('load@test.com', 'load@test.com', 'Pass-12345-word')
+        product = Product.objects.create(name='Load', price=100, countInStock=10, image='products/sample.jpg')
+        out = io.StringIO()
+        with fake_gateway() as gateway, self.settings(BACKEND_DOMAIN=self.live_server_url), \
+                mock.patch('base.strConst.ZIBAL_DOMAIN_IPG_START_PAY', f'{gateway.url}start/'):
+            call_command('loadcheckout', base_url=self.live_server_url, email=user.email,
+                         password='Pass-12345-word', product=product._id, concurrency=1, iterations=3, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['outcomes'], {'paid': 3})
+        self.assertEqual(report['latencyMs']['inquiryPay']['count'], 3)
+        self.assertEqual(Order.objects.filter(user=user, isPaid=True).count(), 3)
+        self.assertEqual(Product.objects.get(pk=product.pk).countInStock, 7)
+
+
+# Signed payment result tokens resolve only unaltered, unexpired and for their own user; stored
+# tokens are purged once past PAYMENT_TOKEN_MAX_AGE
+@override_settings(DATABASE_REPLICAS=[])
+class PaymentTokenTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('token@test.com', 'token@test.com', 'Pass-12345-word')
+        cls.order = Order.objects.create(user=cls.user, paymentMethod='Zibal', totalPrice=200)
+        cls.transaction = Zibal.objects.create(trackId=3000, lastStatus=0, amountCreated=2000,
+                                               order=cls.order, user=cls.user)
+
+    def resolve(self, token: str, user: User = None):
+        return zibal_apis.database_apis.get_payment_transaction(token, user or self.user)
+
+    def test_signed_token_writes_nothing(self):
+        with self.settings(PAYMENT_TOKEN_MODE='signed'):
+            token = zibal_apis.database_apis.generate_payment_token(self.order, self.transaction)
+        self.assertFalse(PaymentToken.objects.exists())
+        self.assertEqual(self.resolve(token), self.transaction)
+
+    def test_tampered_signed_token_is_rejected(self):
+        with self.settings(PAYMENT_TOKEN_MODE='signed'):
+            token = zibal_apis.database_apis.generate_payment_token(self.order, self.transaction)
+        payload, timestamp, signature = token.rsplit(':', 2)
+        # An altered payload, a mangled signature, a token signed for another purpose and garbage
+        forged = signing.TimestampSigner(salt='other').sign_object([self.order._id, self.transaction.trackId])
+        for altered in (f'{payload}x:{timestamp}:{signature}', f'{payload}:{timestamp}:{signature[::-1]}',
+                        forged, 'not:a:token'):
+            with self.subTest(token=altered):
+                self.assertIsNone(self.resolve(altered))
+        # A valid token only resolves for the buyer
+        other = User.objects.create_user('other@test.com')
+        self.assertIsNone(self.resolve(token, other))
+
+    def test_signed_token_expires(self):
+        with self.settings(PAYMENT_TOKEN_MODE='signed'):
+            token = zibal_apis.database_apis.generate_payment_token(self.order, self.transaction)
+        later = time.time() + settings.PAYMENT_TOKEN_MAX_AGE.total_seconds() + 1
+        with mock.patch('django.core.signing.time.time', return_value=later):
+            self.assertIsNone(self.resolve(token))
+        self.assertEqual(self.resolve(token), self.transaction)
+
+    def test_purgepaymenttokens(self):
+        with self.settings(PAYMENT_TOKEN_MODE='db'):
+            expired = zibal_apis.database_apis.generate_payment_token(self.order, self.transaction)
+            fresh = zibal_apis.database_apis.generate_payment_token(self.order, self.transaction)
+        PaymentToken.objects.filter(token=expired).update(
+            createdAt=timezone.now() - settings.PAYMENT_TOKEN_MAX_AGE - timedelta(seconds=1))
+        self.assertIsNone(self.resolve(expired))
+        out = io.StringIO()
+        call_command('purgepaymenttokens', stdout=out)
+        self.assertIn('Deleted 1 expired payment token(s).', out.getvalue())
+        self.assertEqual(list(PaymentToken.objects.values_list('token', flat=True)), [fresh])
+        self.assertEqual(self.resolve(fresh), self.transaction)
+
+
+# Data migrations carry existing rows over (run against this test database, then migrated back up)
+class MigrationTests(TransactionTestCase):
+
+    def migrate(self, target: tuple):
+        executor = MigrationExecutor(connection)
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def test_payment_tokens_are_linked_to_their_own_order(self):
+        self.addCleanup(lambda: call_command('migrate', 'base', verbosity=0))
+        apps = self.migrate(('base', '0005_paymenttoken'))
+        user = apps.get_model('auth', 'User').objects.create(username='buyer@test.com')
+        Order = apps.get_model('base', 'Order')
+        mine, other = Order.objects.create(user=user), Order.objects.create(user=user)
+        apps.get_model('base', 'Zibal').objects.create(trackId=4000, order=mine, user=user)
+        tokens = apps.get_model('base', 'PaymentToken').objects
+        tokens.create(token='linked', orderId=str(mine._id), trackId='4000')
+        tokens.create(token='mismatched', orderId=str(other._id), trackId='4000')
+        tokens.create(token='gone', orderId=str(mine._id), trackId='4001')
+
+        apps = self.migrate(('base', '0006_paymenttoken_foreign_keys'))
+        linked = apps.get_model('base', 'PaymentToken').objects.values_list('token', 'order_id', 'transaction__trackId')
+        self.assertEqual(list(linked), [('linked', mine._id, 4000)])
+
+
+# The benchmark drives every route of base/urls through the in-process app, against a generated
+# dataset (a transaction test case: the driver's client threads must see the committed rows)
+@override_settings(BACKEND_DOMAIN='http://testserver', DATABASE_REPLICAS=[])
+class BenchmarkTests(TransactionTestCase):
+
+    def test_every_route_is_driven(self):
+        with fake_gateway() as gateway:
+            dataset = generate(users=3, products=4, orders=6, items=2, reviews=3, ledger=gateway.ledger)
+            self.assertEqual(dataset.counts(), {'users': 4, 'products': 4, 'orders': 6,
+                                                'paidOrders': 3, 'pendingPayments': 3})
+            report = run_routes(RouteContext(dataset), list(ROUTES), concurrency=1, requests=1, warmup=0)
+        self.assertEqual(set(report), set(ROUTES))
+        for name, result in report.items():
+            with self.subTest(route=name):
+                self.assertEqual(result['requests'], 1)
+                self.assertTrue(set(result['statuses']) <= {'200', '201', '302'}, result['statuses'])
+                self.assertIsNotNone(result['queriesPerRequest']['max'])
+
+
+# Checkouts and payment callbacks stay consistent when they race: stock is decremented only when
+# there is enough of it, and a transaction is verified with the gateway once and never downgraded
+@override_settings(DATABASE_REPLICAS=[])
+class ConcurrencyTests(TestCase):
+    VERIFY = {'result': 100, 'status': 1, 'amount': 2000, 'refNumber': 1234,
+              'paidAt': '2025-01-01T10:00:00.000000', 'cardNumber': '603799******1234'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer@test.com', 'buyer@test.com', 'Pass-12345-word')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        self.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=100, countInStock=stock, image='products/sample.jpg')
+            for i, stock in enumerate((5, 1)))
+        self.order = Order.objects.create(user=self.user, paymentMethod='Zibal', totalPrice=200)
+        self.transaction = Zibal.objects.create(trackId=2000, lastStatus=0, amountCreated=2000,
+                                                order=self.order, user=self.user)
+
+    def add_order(self, quantities: list):
+        payload = {
+            'orderItems': [{'product': p._id, 'qty': qty, 'price': '100'} for p, qty in zip(self.products, quantities)],
+            'paymentMethod': 'Zibal',
+            'shippingAddress': {'address': 'Street', 'city': 'Tehran', 'country': 'Iran', 'postalCode': '1'},
+            'taxPrice': 0, 'shippingPrice': 0, 'totalPrice': 200,
+        }
+        return self.client.post(reverse('addOrderItems'), payload, format='json')
+
+    def stock(self) -> list:
+        return [Product.objects.get(_id=product._id).countInStock for product in self.products]
+
+    def test_out_of_stock_order_is_rolled_back(self):
+        orders = Order.objects.count()
+        response = self.add_order([2, 2])
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(response.data['detail'], ERROR_OUT_OF_STOCK)
+        self.assertEqual(self.stock(), [5, 1])
+        self.assertEqual(Order.objects.count(), orders)
+        self.assertFalse(OrderItem.objects.exists())
+
+        self.assertEqual(self.add_order([2, 1]).status_code, 200)
+        self.assertEqual(self.stock(), [3, 0])
+
+    def test_duplicate_callback_verifies_once(self):
+        url = reverse('zibalCallback') + (
+            f'?success=1&trackId={self.transaction.trackId}&orderId={self.order._id}&status=2')
+        with mock.patch.object(zibal_apis.server_apis, 'verify', return_value=self.VERIFY) as verify:
+            for _ in range(3):
+                self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(verify.call_count, 1)
+        self.transaction.refresh_from_db()
+        self.assertEqual((self.transaction.lastStatus, self.transaction.refNumber), (1, 1234))
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.isPaid)
+        self.assertTrue(timezone.is_aware(self.order.paidAt))
+
+    def test_failed_verification_is_retried(self):
+        url = reverse('zibalCallback') + (
+            f'?success=1&trackId={self.transaction.trackId}&orderId={self.order._id}&status=2')
+        failures = (RequestException('gateway down'), {'result': 104})
+        for failure in failures:
+            with mock.patch.object(zibal_apis.server_apis, 'verify', side_effect=[failure]):
+                self.assertEqual(self.client.get(url).status_code, 302)
+            self.transaction.refresh_from_db()
+            self.assertEqual(self.transaction.lastStatus, 0)
+
+        with mock.patch.object(zibal_apis.server_apis, 'verify', return_value=self.VERIFY) as verify:
+            self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(verify.call_count, 1)
+        self.transaction.refresh_from_db()
+        self.assertEqual((self.transaction.lastStatus, self.transaction.refNumber), (1, 1234))
+
+    def test_declined_payment_is_recorded(self):
+        url = reverse('zibalCallback') + (
+            f'?success=1&trackId={self.transaction.trackId}&orderId={self.order._id}&status=2')
+        with mock.patch.object(zibal_apis.server_apis, 'verify',
+                               return_value={'result': 202, 'status': 5}) as verify:
+            for _ in range(2):
+                self.assertEqual(self.client.get(url).status_code, 302)
+        self.assertEqual(verify.call_count, 1)
+        self.transaction.refresh_from_db()
+        self.assertEqual(self.transaction.lastStatus, 5)
+        self.assertNotIn(self.transaction.lastStatus, OPEN_STATUSES)
+
+    def test_previously_confirmed_payment_is_completed_from_inquiry(self):
+        url = reverse('zibalCallback') + (
+            f'?success=1&trackId={self.transaction.trackId}&orderId={self.order._id}&status=2')
+        with mock.patch.object(zibal_apis.server_apis, 'verify', return_value={'result': 201}), \
+                mock.patch.object(zibal_apis.server_apis, 'inquiry', return_value=self.VERIFY) as inquiry:
+            self.assertEqual(self.client.get(url).status_code, 302)
+        inquiry.assert_called_once_with(self.transaction.trackId)
+        self.transaction.refresh_from_db()
+        self.assertEqual((self.transaction.lastStatus, self.transaction.refNumber), (1, 1234))
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.isPaid)
+
+    def test_confirmed_payment_is_never_downgraded(self):
+        database_apis = zibal_apis.database_apis
+        self.assertTrue(database_apis.complete(self.transaction, self.VERIFY))
+        late = Zibal.objects.get(pk=self.transaction.pk)
+        late.lastStatus = 2
+        self.assertTrue(database_apis.complete(late, {**self.VERIFY, 'status': 2}))
+        self.assertTrue(database_apis.update(late, 3))
+        self.assertFalse(database_apis.claim(late))
+        self.assertEqual(late.lastStatus, 1)
+        self.assertEqual(Zibal.objects.get(pk=self.transaction.pk).lastStatus, 1)
+
+
+# Log records are stamped with the request and trace ids, rate-limited per message template,
+# and written as JSON lines by a background thread
+class LoggingTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = f'{directory.name}/app.log'
+        self.handler = BackgroundHandler(self.path, capacity=100)
+        self.handler.addFilter(RequestContextFilter())
+        self.addCleanup(self.handler.close)
+        self.logger = logging.getLogger('base.tests.logs')
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+        self.logger.propagate = False  # Only the handler under test writes the records
+        self.addCleanup(setattr, self.logger, 'propagate', True)
+
+    def entries(self) -> list:
+        self.handler.stop()
+        with open(self.path) as file:
+            return [json.loads(line) for line in file]
+
+    def test_records_are_written_as_json_by_a_thread(self):
+        writers = []
+        self.handler.target.emit = lambda record, emit=self.handler.target.emit: (
+            writers.append(threading.current_thread()), emit(record))
+        details = {'e': 'timeout'}
+        self.logger.error(ERROR_UPDATE_TRANSACTION + MORE_DETAILS, details)
+        details['e'] = 'changed after logging'
+        try:
+            raise ValueError('bad status')
+        except ValueError:
+            self.logger.exception('verify failed')
+        first, second = self.entries()
+        self.assertEqual(first['message'], ERROR_UPDATE_TRANSACTION + '\nMore details:timeout')
+        self.assertEqual((first['level'], first['logger']), ('ERROR', 'base.tests.logs'))
+        self.assertIn('ValueError: bad status', second['exception'])
+        self.assertNotIn(threading.current_thread(), writers)
+
+    def test_request_and_trace_ids_are_attached(self):
+        def view(request):
+            self.logger.error('inside the request')
+            return HttpResponse()
+
+        request = RequestFactory().get('/api/products/', HTTP_X_REQUEST_ID='abc-123')
+        with override_settings(TRACE_FILE=f'{self.path}.spans'):
+            with trace('request') as root:
+                response = RequestIdMiddleware(view)(request)
+            exporter.flush()
+        self.assertEqual(response['X-Request-ID'], 'abc-123')
+        [entry] = self.entries()
+        self.assertEqual((entry['requestId'], entry['traceId'], entry['spanId']), ('abc-123', root.trace_id, root.span_id))
+
+        # Ids that do not look like one are replaced
+        response = RequestIdMiddleware(lambda request: HttpResponse())(
+            RequestFactory().get('/', HTTP_X_REQUEST_ID='<script>'))
+        self.assertRegex(response['X-Request-ID'], r'^[0-9a-f]{32}$')
+
+    def test_async_request_keeps_its_id(self):
+        async def view(request):
+            return HttpResponse(request_id())
+
+        middleware = RequestIdMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(RequestFactory().get('/', HTTP_X_REQUEST_ID='abc-123'))
+        self.assertEqual((response.content, response['X-Request-ID']), (b'abc-123', 'abc-123'))
+        self.assertIsNone(request_id())
+
+    def test_repeated_errors_are_rate_limited(self):
+        now = [0.0]
+        self.handler.addFilter(RateLimitFilter(burst=3, window=60, clock=lambda: now[0]))
+        for i in range(10):
+            self.logger.error(ERROR_UPDATE_TRANSACTION + MORE_DETAILS, {'e': i})
+        self.logger.error('another message')
+        now[0] = 61
+        self.logger.error(ERROR_UPDATE_TRANSACTION + MORE_DETAILS, {'e': 'later'})
+        messages = [(entry['message'].rsplit(':', 1)[-1], entry.get('suppressed')) for entry in self.entries()]
+        self.assertEqual(messages, [('0', None), ('1', None), ('2', None), ('another message', None), ('later', 7)])
+
+    def test_full_queue_drops_records(self):
+        self.handler.capacity = 2
+        with mock.patch.object(self.handler.target, 'emit', side_effect=lambda record: time.sleep(0.05)):
+            for i in range(20):
+                self.logger.error('flood %(i)s', {'i': i})
+            self.handler.stop()
+        self.assertGreater(self.handler.dropped, 0)
+
+
+# Workers boot from a preloaded master; heavy, rarely used modules are imported on first use
+class BootTests(SimpleTestCase):
+
+    def test_server_config(self):
+        config = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        self.assertTrue(config['preload_app'])
+        self.assertEqual(config['autotune_workers']('wsgi', cores=4), 9)
+        self.assertEqual(config['autotune_workers']('asgi', cores=4), 4)
+
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            metrics.flush(force=True)
+            config['on_starting'](None)
+            self.assertEqual(os.listdir(directory), [])
+
+    def test_boot_does_not_import_deferred_modules(self):
+        stdout = io.StringIO()
+        call_command('importtime', runs=1, top=5, stdout=stdout)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['deferredImported'], [])
+        self.assertGreater(report['totalMs'], 0)
+        self.assertEqual(len(report['slowestModules']), 5)
+        with self.assertRaises(CommandError):
+            call_command('importtime', runs=1, deferred='django.urls', stdout=io.StringIO())
+
+
+# Each route class has its own concurrency limit and wait queue: a saturated class answers
+# 503 + Retry-After while the others keep being served
+@override_settings(ADMISSION_CONTROL=True, DATABASE_REPLICAS=[])
+class AdmissionControlTests(TestCase):
+
+    def test_gate_queues_then_sheds(self):
+        gate = Gate('test', limit=1, queue=1, wait=5)
+        self.assertTrue(gate.acquire())
+        results = []
+        waiter = threading.Thread(target=lambda: results.append(gate.acquire()))
+        waiter.start()
+        while not gate.occupancy()['queued']:
+            time.sleep(0.001)
+        self.assertEqual(gate.occupancy(), {'limit': 1, 'inFlight': 1, 'queue': 1, 'queued': 1})
+        self.assertFalse(gate.acquire())  # The queue is full too
+        gate.release()  # Hands the slot to the waiter
+        waiter.join()
+        self.assertEqual(results, [True])
+        self.assertEqual(gate.occupancy()['inFlight'], 1)
+        gate.release()
+        self.assertEqual(gate.occupancy()['inFlight'], 0)
+
+    def test_waiter_gives_up_after_wait(self):
+        gate = Gate('test', limit=1, queue=1, wait=0.01)
+        self.assertTrue(gate.acquire())
+        self.assertFalse(gate.acquire())
+        self.assertEqual(gate.occupancy()['queued'], 0)
+
+    def test_default_limits_leave_threads_to_other_classes(self):
+        config = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+        self.assertEqual(config['threads'], 4)
+        self.assertEqual(thread_budget_errors(settings.ADMISSION_LIMITS, config['threads']), [])
+        self.assertEqual(len(thread_budget_errors({'catalog': '64/128/2', 'payment': '1/1/1'}, 4)), 1)
+
+        # Payment requests stuck on the gateway take every slot and queue place of their class:
+        # the next one is shed at once and the threads left serve the catalog
+        Product.objects.create(name='p', price=1)
+        payment = admission_gate('payment')
+        limit, queue, _ = parse_limit(settings.ADMISSION_LIMITS['payment'])
+        self.assertTrue(all(payment.acquire() for _ in range(limit)))
+        queued = [threading.Thread(target=payment.acquire) for _ in range(queue)]
+        for thread in queued:
+            thread.start()
+        while payment.occupancy()['queued'] < queue:
+            time.sleep(0.001)
+        try:
+            self.assertLess(limit + queue, config['threads'])
+            shed = self.client.get(reverse('zibalCallback') + '?success=1&trackId=1&orderId=1&status=2')
+            catalog = self.client.get(reverse('getProducts'))
+        finally:
+            for _ in range(limit + queue):
+                payment.release()
+            for thread in queued:
+                thread.join()
+        self.assertEqual((shed.status_code, catalog.status_code), (503, 200))
+        self.assertEqual(payment.occupancy()['inFlight'], 0)
+
+    def test_shed_response_is_readable_cross_origin(self):
+        with self.settings(ADMISSION_LIMITS={**settings.ADMISSION_LIMITS, 'payment': '1/0/0'}):
+            payment = admission_gate('payment')
+            self.assertTrue(payment.acquire())
+            try:
+                shed = self.client.get(reverse('zibalCallback') + '?success=1&trackId=1&orderId=1&status=2',
+                                       HTTP_ORIGIN='https://django-react-eshop.ir')
+            finally:
+                payment.release()
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed['Access-Control-Allow-Origin'], '*')
+        self.assertIn('retry-after', shed['Access-Control-Expose-Headers'].lower())
+
+    def test_async_waiter_waits_in_the_event_loop(self):
+        gate = Gate('test', limit=1, queue=1, wait=5)
+        self.assertTrue(gate.acquire())
+
+        async def queue_up(release):
+            waiting = asyncio.ensure_future(gate.aacquire())
+            while not gate.occupancy()['queued']:
+                await asyncio.sleep(0.001)
+            if release:
+                threading.Thread(target=gate.release).start()  # A request served by another thread ends
+                return await waiting
+            waiting.cancel()  # The client went away
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+
+        self.assertTrue(async_to_sync(queue_up)(True))
+        self.assertEqual(gate.occupancy(), {'limit': 1, 'inFlight': 1, 'queue': 1, 'queued': 0})
+        async_to_sync(queue_up)(False)
+        self.assertEqual(gate.occupancy(), {'limit': 1, 'inFlight': 1, 'queue': 1, 'queued': 0})
+        gate.release()
+        self.assertEqual(gate.occupancy()['inFlight'], 0)
+
+    def test_async_requests_are_shed(self):
+        async def view(request):
+            return HttpResponse()
+
+        middleware = AdmissionControlMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = RequestFactory().get(reverse('zibalCallback'))
+        with self.settings(ADMISSION_LIMITS={**settings.ADMISSION_LIMITS, 'payment': '1/0/0'}):
+            payment = admission_gate('payment')
+            self.assertTrue(payment.acquire())
+            try:
+                self.assertEqual(async_to_sync(middleware)(request).status_code, 503)
+            finally:
+                payment.release()
+            self.assertEqual(async_to_sync(middleware)(request).status_code, 200)
+            self.assertEqual(payment.occupancy()['inFlight'], 0)
+
+    def test_saturated_class_does_not_block_others(self):
+        Product.objects.create(name='p', price=1)
+        with self.settings(ADMISSION_LIMITS={**settings.ADMISSION_LIMITS, 'payment': '1/0/0'}):
+            payment = admission_gate('payment')
+            self.assertTrue(payment.acquire())  # A payment call stuck on the gateway
+            try:
+                shed = self.client.get(reverse('zibalCallback') + '?success=1&trackId=1&orderId=1&status=2')
+                catalog = self.client.get(reverse('getProducts'))
+            finally:
+                payment.release()
+        self.assertEqual(shed.status_code, 503)
+        self.assertEqual(shed['Retry-After'], str(settings.ADMISSION_RETRY_AFTER))
+        self.assertEqual(shed.json(), {'detail': ERROR_OVERLOADED})
+        self.assertEqual(catalog.status_code, 200)
+
+        exposed = render(collect())
+        self.assertIn('admission_rejected_total{class="payment"}', exposed)
+        self.assertIn('admission_in_flight{class="payment"} 0', exposed)
+        self.assertIn('http_requests_total{method="GET",status="503",view="zibalCallback"}', exposed)
+
+
+# The payment status is pushed to Server-Sent Events streams when it is written, and re-read
+# periodically for writes made by other worker processes
+@override_settings(DATABASE_REPLICAS=[], PAYMENT_EVENTS_POLL_SECONDS=30, PAYMENT_EVENTS_TIMEOUT=60)
+class PaymentEventsTests(TestCase):
+    VERIFY = {'result': 100, 'status': 1, 'amount': 2000, 'refNumber': 1234,
+              'paidAt': '2025-01-01T10:00:00.000000', 'cardNumber': '603799******1234'}
+
+    def setUp(self):
+        self.user = User.objects.create_user('buyer@test.com', 'buyer@test.com', 'Pass-12345-word')
+        self.order = Order.objects.create(user=self.user, paymentMethod='Zibal', totalPrice=200)
+        self.transaction = Zibal.objects.create(trackId=3000, lastStatus=0, amountCreated=2000,
+                                                order=self.order, user=self.user)
+
+    def event(self, chunk: str) -> tuple:
+        fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n'))
+        return fields['event'], json.loads(fields['data'])
+
+    def test_status_is_pushed_when_written(self):
+        stream = iter(StatusStream(self.transaction))
+        self.assertEqual(next(stream), 'retry: 30000\n\n')
+        self.assertEqual(self.event(next(stream)), ('status', {
+            'success': False, 'message': zibal_apis.server_apis.payment_status_code_translator(0), 'trackId': 3000,
+            'orderId': self.order._id, 'status': 0, 'refNumber': 'N/A'}))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            zibal_apis.database_apis.complete(self.transaction, self.VERIFY)
+        start = time.perf_counter()
+        name, data = self.event(next(stream))
+        self.assertLess(time.perf_counter() - start, 5)  # Woken, not polled
+        self.assertEqual((name, data['success'], data['status'], data['refNumber']), ('status', True, 1, 1234))
+        with self.assertRaises(StopIteration):
+            next(stream)
+        self.assertEqual(payment_events.listeners, {})
+
+    def test_changes_of_other_processes_are_polled(self):
+        with self.settings(PAYMENT_EVENTS_POLL_SECONDS=0.01):
+            stream = iter(StatusStream(self.transaction))
+            next(stream), next(stream)
+            # Written without publishing, as another worker would
+            Zibal.objects.filter(pk=self.transaction.pk).update(lastStatus=2)
+            self.assertEqual(self.event(next(stream))[1]['status'], 2)
+            # A blocking stream (WSGI) is a long poll: it ends after a change, the client reconnects
+            self.assertEqual(list(stream), [])
+
+    def test_long_poll_timeout_counts_from_first_connection(self):
+        with self.settings(PAYMENT_EVENTS_POLL_SECONDS=0.01, PAYMENT_EVENTS_LONGPOLL_SECONDS=0.05):
+            chunks = list(StatusStream(self.transaction))
+            self.assertIn(': keepalive\n\n', chunks)
+            self.assertEqual(chunks[-1], ': reconnect\n\n')
+
+            # Reconnecting (Last-Event-ID) after PAYMENT_EVENTS_TIMEOUT passed since the first connection
+            first = f'{time.time() - 61:.3f}'
+            chunks = list(StatusStream(self.transaction, first))
+            self.assertTrue(chunks[1].startswith(f'id: {first}\n'))
+            self.assertEqual(self.event(chunks[-1]), ('timeout', {}))
+        for last_event_id in ('not a time', f'{time.time() + 3600}', 'nan'):
+            self.assertAlmostEqual(StatusStream(self.transaction, last_event_id).started, time.time(), delta=1)
+
+    def test_open_streams_are_capped(self):
+        with self.settings(ADMISSION_LIMITS={**settings.ADMISSION_LIMITS, 'events': '1/0/0'}):
+            first = iter(StatusStream(self.transaction))
+            next(first), next(first)  # Open, holding the only slot
+            # The status once, then the client reconnects after the retry delay
+            chunks = list(StatusStream(self.transaction))
+            self.assertEqual(len(chunks), 2)
+            self.assertEqual(self.event(chunks[1])[1]['status'], 0)
+            first.close()
+            self.assertEqual(admission_gate('events').occupancy()['inFlight'], 0)
+
+    def test_endpoint_streams_events(self):
+        zibal_apis.database_apis.complete(self.transaction, self.VERIFY)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        token = zibal_apis.database_apis.generate_payment_token(self.order, self.transaction)
+
+        response = client.get(reverse('payEvents', args=[token]), HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        self.assertEqual(self.event(chunks[1])[1]['status'], 1)
+
+        missing = client.get(reverse('payEvents', args=['unknown']), HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(self.event(missing.content.decode()), ('error', {'detail': ERROR_TRANSACTION_DETAILS_NOT_FOUND}))
+
+    def test_async_stream(self):
+        zibal_apis.database_apis.complete(self.transaction, self.VERIFY)
+
+        async def consume():
+            return [chunk async for chunk in StatusStream(self.transaction)]
+
+        chunks = async_to_sync(consume)()
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(self.event(chunks[1])[1]['status'], 1)
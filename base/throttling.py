@@ -0,0 +1,121 @@
+import os
+import random
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# Seconds per period unit of a DRF style rate ("5/min")
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+# Buckets idle for longer than this are deleted from the store
+IDLE_BUCKET_SECONDS = 60 * 60 * 24
+
+
+# Token buckets shared by every worker process through one SQLite file
+class TokenBucketStore:
+    def __init__(self):
+        self.local = threading.local()
+
+    # One connection per thread (and per path, so tests can point elsewhere)
+    def connection(self) -> sqlite3.Connection:
+        path = str(settings.THROTTLE_DB_PATH)
+        connections = self.local.__dict__.setdefault('connections', {})
+        if path not in connections:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                         '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+            connections[path] = conn
+        return connections[path]
+
+    # Take one token from the bucket; return 0 on success or the seconds until a token is available
+    def consume(self, key: str, capacity: float, refill_rate: float) -> float:
+        conn = self.connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / refill_rate
+            conn.execute('INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) '
+                         'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                         (key, tokens, now))
+            # Now and then forget buckets nobody used for a day
+            if random.random() < 0.001:
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - IDLE_BUCKET_SECONDS,))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+
+throttle_store = TokenBucketStore()
+
+
+# Turn a DRF style rate ("5/min") into (bucket capacity, tokens refilled per second)
+def parse_rate(rate: str) -> tuple[float, float]:
+    num, period = rate.split('/')
+    capacity = float(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+# Token-bucket throttle; `scope` picks its rate from DEFAULT_THROTTLE_RATES
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+
+    def __init__(self):
+        self.wait_time = None
+
+    # Bucket key for this request, or None to skip throttling
+    def get_key(self, request, view) -> str | None:
+        raise NotImplementedError('.get_key() must be overridden')
+
+    def allow_request(self, request, view):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        key = self.get_key(request, view)
+        if rate is None or key is None:
+            return True
+        capacity, refill_rate = parse_rate(rate)
+        self.wait_time = throttle_store.consume(f'{self.scope}:{key}', capacity, refill_rate)
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+# Per client IP bucket for the password hashing endpoints (REMOTE_ADDR, or the address NUM_PROXIES
+# trusted proxies put in X-Forwarded-For)
+class AuthIPThrottle(TokenBucketThrottle):
+    scope = 'auth_ip'
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+
+# Per account bucket for the password hashing endpoints (user ID, or the email/username posted
+# together with the client IP: a stranger guessing at an account can't lock its owner out)
+class AuthAccountThrottle(TokenBucketThrottle):
+    scope = 'auth_account'
+
+    def get_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return str(request.user.pk)
+        try:
+            account = request.data.get('username') or request.data.get('email')
+        except AttributeError:
+            return None
+        return f'{str(account).strip().lower()}:{self.get_ident(request)}' if account else None
+
+
+# Throttles applied to login, register and profile/password update
+AUTH_THROTTLES = [AuthIPThrottle, AuthAccountThrottle]
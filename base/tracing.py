@@ -0,0 +1,249 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from base.strConst import ERROR_TRACE_EXPORT, MORE_DETAILS
+
+# W3C Trace Context header: version-trace id-parent span id-flags
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+# Longest SQL statement stored on a query span
+MAX_STATEMENT_LENGTH = 500
+
+
+# One timed operation of a trace; spans of a trace point at their parent span
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.error = None
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    # Header value making a downstream service's spans children of this span
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def as_dict(self) -> dict:
+        return {
+            'trace': self.trace_id,
+            'span': self.span_id,
+            'parent': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration': self.duration,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+_current_span: ContextVar[Span | None] = ContextVar('current_span', default=None)
+
+
+# Span of the code being run (None outside a sampled trace)
+def current_span() -> Span | None:
+    return _current_span.get()
+
+
+# Buffers finished spans and appends them to TRACE_FILE (one JSON object per line) from a
+# background thread; spans are dropped rather than slowing requests when the buffer is full
+class SpanExporter:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.dropped = 0
+
+    def export(self, span: Span):
+        self.start()
+        try:
+            self.queue.put_nowait(span.as_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    # Start the writer (on first use, and again in a forked child process)
+    def start(self):
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid() or not self.thread.is_alive():
+                self.queue = queue.Queue(maxsize=settings.TRACE_BUFFER_SIZE)
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self.run, name='span-exporter', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception as e:
+                logging.error(ERROR_TRACE_EXPORT + MORE_DETAILS, {'e': e})
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            time.sleep(settings.TRACE_FLUSH_SECONDS)
+
+    # One append per batch: lines of several workers sharing the file are never interleaved
+    def write(self, batch: list):
+        directory = os.path.dirname(settings.TRACE_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = ''.join(json.dumps(span, default=str) + '\n' for span in batch).encode()
+        fd = os.open(settings.TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    # Wait until every exported span is written
+    def flush(self):
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.join()
+
+
+exporter = SpanExporter()
+atexit.register(exporter.flush)
+
+
+# (trace id, parent span id, sampled) of a traceparent header, or None if it is missing or invalid
+def parse_traceparent(header: str | None):
+    match = TRACEPARENT.match((header or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+@contextmanager
+def _activate(span: Span):
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        _current_span.reset(token)
+        span.duration = time.perf_counter() - span.started
+        exporter.export(span)
+
+
+# Start a trace (the root span of a request or a background job), continuing the caller's trace
+# when a traceparent is given; yields None when tracing is off or the trace is not sampled
+@contextmanager
+def trace(name: str, traceparent: str = None, **attributes):
+    if not settings.TRACE_FILE:
+        yield None
+        return
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        # The caller decided whether this trace is sampled
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+        sampled = random.random() < settings.TRACE_SAMPLE_RATE
+    if not sampled:
+        yield None
+        return
+    with _activate(Span(name, trace_id, parent_id, attributes)) as root:
+        yield root
+
+
+# Child span of the current span; does nothing outside a sampled trace
+@contextmanager
+def span(name: str, **attributes):
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    with _activate(Span(name, parent.trace_id, parent.span_id, attributes)) as child:
+        yield child
+
+
+# Add the traceparent header of the current span to outbound request headers
+def inject(headers: dict) -> dict:
+    current = _current_span.get()
+    if current is not None:
+        headers['traceparent'] = current.traceparent()
+    return headers
+
+
+# execute_wrapper giving every ORM query its own span
+def query_span(execute, sql, params, many, context):
+    with span('db', statement=sql[:MAX_STATEMENT_LENGTH], alias=context['connection'].alias):
+        return execute(sql, params, many, context)
+
+
+# Middleware opening the root span of every request (continuing an incoming traceparent),
+# with a child span per ORM query; the trace is returned in the traceresponse header
+class TracingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.trace(request) as root:
+            if root is None:
+                return self.get_response(request)
+            with ExitStack() as stack:
+                self.trace_queries(stack)
+                response = self.get_response(request)
+            return self.finish(request, response, root)
+
+    # Under ASGI the ORM runs in the request's sync thread (sync_to_async): the query spans are
+    # installed there, and take their parent from the context each call copies from the request
+    async def __acall__(self, request):
+        with self.trace(request) as root:
+            if root is None:
+                return await self.get_response(request)
+            stack = ExitStack()
+            await sync_to_async(self.trace_queries)(stack)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+            return self.finish(request, response, root)
+
+    def trace(self, request):
+        name = f'{request.method} {request.path}'
+        return trace(name, request.headers.get('traceparent'), method=request.method, path=request.path)
+
+    # Give the queries run on the connections of the current thread their own span
+    def trace_queries(self, stack: ExitStack):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(query_span))
+
+    def finish(self, request, response, root: Span):
+        match = getattr(request, 'resolver_match', None)
+        root.set(view=match.view_name if match else None, status=response.status_code)
+        response['traceresponse'] = root.traceparent()
+        return response
@@ -17,4 +17,7 @@ urlpatterns = [
 
     # URL for inquiring about the payment status using a specific token
     path('<str:token>/inquiry-pay/', views.inquiryPay, name='inquiryPay'),
+
+    # URL for streaming the payment status (Server-Sent Events) using a specific token
+    path('<str:token>/pay-events/', views.payEvents, name='payEvents'),
 ]
@@ -1,11 +1,16 @@
+from django.conf import settings
 from django.urls import path
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 from base.views import user_views as views
+from base.views import async_user_views
+
+# Login, register and profile update hash passwords; the async variants do it in a bounded pool
+auth_views = async_user_views if settings.ASYNC_AUTH_VIEWS else views
 
 # Define URL patterns specifically for user-related operations
 urlpatterns = [
     # URL for obtaining access and refresh tokens for user login
-    path('login/', TokenObtainPairView.as_view(), name='token-obtain-pair'),
+    path('login/', auth_views.MyTokenObtainPairView.as_view(), name='token-obtain-pair'),
 
     # URL for refreshing the JWT access token using a valid refresh token
     path('token/refresh/', TokenRefreshView.as_view(), name='token-refresh'),
@@ -14,13 +19,13 @@ urlpatterns = [
     path('profile/', views.getUserProfile, name='users-profile'),
 
     # URL for updating the profile information of the currently authenticated user
-    path('profile/update/', views.updateUserProfile, name='user-profile-update'),
+    path('profile/update/', auth_views.updateUserProfile, name='user-profile-update'),
 
     # URL for retrieving a list of all users
     path('', views.getUsers, name='users'),
 
     # URL for registering a new user
-    path('register/', views.registerUser, name='register'),
+    path('register/', auth_views.registerUser, name='register'),
 
     # URL for verifying a user's email using a token
     path('verify-email/<str:token>/', views.verifyEmail, name='verifyEmail'),
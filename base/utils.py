@@ -1,16 +1,33 @@
 import logging
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth.models import User
+from django.core import signing
 from django.urls import reverse
 from django.conf import settings
-from django.core.mail import EmailMessage
-from base.strConst import EMAIL_SUBJECT, EMAIL_BODY, ERROR_ON_SENDING_EMAIL, MORE_DETAILS
+from base import mailqueue
+from base.strConst import (
+    EMAIL_SUBJECT, EMAIL_BODY, ERROR_ON_SENDING_EMAIL, MORE_DETAILS, ACTIVATION_TOKEN_SALT
+)
+
+
+# Function to create a signed, expiring account activation token (no database write)
+def createActivationToken(user: User) -> str:
+    signer = signing.TimestampSigner(salt=ACTIVATION_TOKEN_SALT)
+    return signer.sign_object({'user_id': user.id})
+
+
+# Function to read the user ID back from an activation token (None if invalid or expired)
+def readActivationToken(token: str) -> int | None:
+    signer = signing.TimestampSigner(salt=ACTIVATION_TOKEN_SALT)
+    try:
+        return signer.unsign_object(token, max_age=settings.ACCOUNT_ACTIVATION_TOKEN_MAX_AGE)['user_id']
+    except (signing.BadSignature, KeyError, TypeError):
+        return None
 
 
 # Function to create an activation link for user email verification
 def createActivationLink(user: User) -> str:
-    # Generate a refresh token for the user and extract the access token as a string
-    token: str = str(RefreshToken.for_user(user).access_token)
+    # Generate an activation token for the user
+    token: str = createActivationToken(user)
     # Build the activation link using the backend domain and the 'verifyEmail' route with the token as a parameter
     link: str = f'{settings.BACKEND_DOMAIN}{reverse("verifyEmail", kwargs={"token": token})}'
     return link  # Return the generated activation link
@@ -26,22 +43,20 @@ def createEmail(status: str, activationLink: str, user: User) -> dict:
     email['to'] = user.email  # Set the recipient's email address
     return email  # Return the constructed email dictionary
 
-# Function to send an email using the provided data
+# Function to queue an email using the provided data (delivered by the mail worker, see base/mailqueue.py)
 
 
 def sendEmail(data: dict) -> bool:
     try:
-        # Create an email message with the specified subject, body, sender, and recipient
-        email = EmailMessage(
+        # Queue an email message with the specified subject, body and recipient;
+        # the sender's email address is configured in settings
+        mailqueue.enqueue(
             subject=data['subject'],
             body=data['body'],
-            # Sender's email address (configured in settings)
-            from_email=settings.EMAIL_HOST_USER,
             to=[data['to']]  # Recipient's email address (as a list)
         )
-        email.send()  # Send the email
-        return True  # Return True if the email was sent successfully
+        return True  # Return True if the email was queued successfully
     except Exception as e:
-        # Log an error message if email sending fails
-        logging.error(ERROR_ON_SENDING_EMAIL + MORE_DETAILS % {'e': e})
+        # Log an error message if queueing the email fails
+        logging.error(ERROR_ON_SENDING_EMAIL + MORE_DETAILS, {'e': e})
         return False  # Return False to indicate failure
@@ -6,6 +6,7 @@ from rest_framework.response import Response
 from rest_framework.decorators import (api_view, permission_classes, authentication_classes,)  
 from base.zibal import zibal_apis  
 from base.models import Zibal, Order 
+from base.routers import use_primary
 from base.strConst import (  
     SUCCESS, TRACK_ID, ORDER_ID, STATUS, DETAIL, MORE_DETAILS,
     ERROR_TRANSACTION_PROCESSING, PAY_RESULT_REDIRECT, RESULT
@@ -16,6 +17,7 @@ from base.strConst import (
 @api_view(["GET"])  # API view supports GET requests
 @permission_classes([])  # No specific permissions are required for this view
 @authentication_classes([])  # No authentication is required for this view
+@use_primary  # Writes the payment outcome; never read from a replica
 def zibalCallback(request):
     try:
         # Extract and validate callback parameters from the GET request
@@ -29,35 +31,51 @@ def zibalCallback(request):
         transaction = Zibal.objects.get(order=order, trackId=_trackId)  # Retrieve the transaction based on the order and track ID
     except Exception as e:
         # Log any errors during parameter extraction or object retrieval
-        logging.error(ERROR_TRANSACTION_PROCESSING + MORE_DETAILS % {"e": e})
+        logging.error(ERROR_TRANSACTION_PROCESSING + MORE_DETAILS, {"e": e})
         # Return a response indicating a bad request
         return Response({DETAIL: ERROR_TRANSACTION_PROCESSING}, status=status.HTTP_400_BAD_REQUEST)
     else:
         # Handle a successful payment callback
         if _success:
+            # Duplicate callbacks (browser retries, resent redirects) do not verify again
+            if not zibal_apis.database_apis.claim(transaction):
+                token: str = zibal_apis.database_apis.generate_payment_token(order, transaction)  # Generate a payment token
+                return HttpResponseRedirect(PAY_RESULT_REDIRECT(token, True))  # Redirect to the payment result page
             try:
                 # Verify the transaction with the Zibal server
                 res: dict = zibal_apis.server_apis.verify(transaction.trackId)
             except RequestException:
-                # Handle verification request failure
-                db_status: bool = zibal_apis.database_apis.update(transaction, _status)  # Update the transaction in the database
-                token: str = zibal_apis.database_apis.generate_payment_token(str(order._id), str(transaction.trackId))  # Generate a payment token
+                # Handle verification request failure: release the claim so a retried callback verifies again
+                db_status: bool = zibal_apis.database_apis.release(transaction)  # Update the transaction in the database
+                token: str = zibal_apis.database_apis.generate_payment_token(order, transaction)  # Generate a payment token
                 # Redirect to the payment result page with the token and database status
                 return HttpResponseRedirect(PAY_RESULT_REDIRECT(token, db_status))
             else:
                 # Process the response from the Zibal server
                 result: int = res.get(RESULT)  # Extract the result code from the response
+                if result == 201:  # Previously confirmed (an earlier verify whose outcome was not saved)
+                    try:
+                        # Fetch the confirmed payment's details to complete the transaction with
+                        res = zibal_apis.server_apis.inquiry(transaction.trackId)
+                    except RequestException:
+                        res = {}  # Released below: a retried callback verifies again
+                    result = res.get(RESULT)
                 if result == 100:  # Transaction verified successfully
                     db_status: bool = zibal_apis.database_apis.complete(transaction, res)  # Mark the transaction as completed
-                    token: str = zibal_apis.database_apis.generate_payment_token(str(order._id), str(transaction.trackId))  # Generate a payment token
+                    token: str = zibal_apis.database_apis.generate_payment_token(order, transaction)  # Generate a payment token
                     return HttpResponseRedirect(PAY_RESULT_REDIRECT(token, db_status) )  # Redirect to the payment result page
+                elif zibal_apis.server_apis.is_declined(result):
+                    # Handle a declined payment: record the status reported by Zibal (or the callback's)
+                    db_status: bool = zibal_apis.database_apis.update(transaction, res.get(STATUS) or _status)  # Update the transaction in the database
+                    token: str = zibal_apis.database_apis.generate_payment_token(order, transaction)  # Generate a payment token
+                    return HttpResponseRedirect(PAY_RESULT_REDIRECT(token, db_status))  # Redirect to the payment result page
                 else:
-                    # Handle unsuccessful transaction verification
-                    db_status: bool = zibal_apis.database_apis.update(transaction, _status)  # Update the transaction in the database
-                    token: str = zibal_apis.database_apis.generate_payment_token(str(order._id), str(transaction.trackId))  # Generate a payment token
+                    # Handle a transient verification failure: release the claim so a retried callback verifies again
+                    db_status: bool = zibal_apis.database_apis.release(transaction)  # Update the transaction in the database
+                    token: str = zibal_apis.database_apis.generate_payment_token(order, transaction)  # Generate a payment token
                     return HttpResponseRedirect(PAY_RESULT_REDIRECT(token, db_status))  # Redirect to the payment result page
         else:
             # Handle unsuccessful payment status
             db_status: bool = zibal_apis.database_apis.update(transaction, _status)  # Update the transaction in the database
-            token: str = zibal_apis.database_apis.generate_payment_token(str(order._id), str(transaction.trackId))  # Generate a payment token
+            token: str = zibal_apis.database_apis.generate_payment_token(order, transaction)  # Generate a payment token
             return HttpResponseRedirect(PAY_RESULT_REDIRECT(token, db_status))  # Redirect to the payment result page
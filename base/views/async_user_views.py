@@ -0,0 +1,90 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from base.hashing import amake_password, acheck_password
+from base.serializers import MyTokenObtainPairSerializer
+from base.throttling import AUTH_THROTTLES
+from base.views import user_views
+
+
+# APIView whose handlers are coroutines: authentication, permissions and throttles run
+# in a worker thread, password work runs in the password pool, the event loop never blocks
+class AsyncAPIView(APIView):
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # OPTIONS (and method not allowed) are answered synchronously
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+# Async login: the user is loaded from the database, the password is verified in the pool
+class MyTokenObtainPairView(AsyncAPIView):
+    authentication_classes = ()
+    permission_classes = ()
+    throttle_classes = AUTH_THROTTLES
+
+    # Failed logins answer 401 with a WWW-Authenticate header, like simplejwt's TokenObtainPairView
+    def get_authenticate_header(self, request):
+        return f'{jwt_settings.AUTH_HEADER_TYPES[0]} realm="api"'
+
+    async def post(self, request):
+        serializer = MyTokenObtainPairSerializer(context={'request': request})
+        # Field validation only (missing username/password gives 400)
+        attrs = serializer.to_internal_value(request.data)
+
+        user = await User.objects.filter(username=attrs[serializer.username_field]).afirst()
+        if user is None:
+            # Hash anyway so unknown usernames take as long as wrong passwords
+            await amake_password(attrs['password'])
+        elif await acheck_password(user, attrs['password']) and jwt_settings.USER_AUTHENTICATION_RULE(user):
+            return Response(await sync_to_async(serializer.issueTokens)(user))
+
+        raise AuthenticationFailed(serializer.error_messages['no_active_account'], 'no_active_account')
+
+
+# Async registration: the password is hashed in the pool, the rest runs like registerUser
+class RegisterUserView(AsyncAPIView):
+    throttle_classes = AUTH_THROTTLES
+
+    async def post(self, request):
+        passwordHash = await amake_password(request.data['password'])
+        return await sync_to_async(user_views.register)(request.data, passwordHash)
+
+
+# Async profile update: a new password is hashed in the pool, the rest runs like updateUserProfile
+class UpdateUserProfileView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+    throttle_classes = AUTH_THROTTLES
+
+    async def put(self, request):
+        password = request.data['password']
+        passwordHash = await amake_password(password) if password != '' else None
+        return await sync_to_async(user_views.saveProfile)(request, passwordHash)
+
+
+# Same names as user_views, so user_urls can pick either module
+registerUser = RegisterUserView.as_view()
+updateUserProfile = UpdateUserProfileView.as_view()
@@ -0,0 +1,132 @@
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+from base.storage import HASHED_NAME
+
+# Single byte range: "bytes=START-END", "bytes=START-" or "bytes=-SUFFIX"
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Content-addressed files never change, anything else may be replaced under the same name
+CACHE_IMMUTABLE = 'public, max-age=31536000, immutable'
+CACHE_DEFAULT = 'public, max-age=3600'
+
+
+# Read at most `length` bytes of an open file from its current position; fileno() is kept so
+# servers with a sendfile() file wrapper (gunicorn) can send the range with zero copies
+class RangeFile:
+    def __init__(self, file, length: int):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+# Parse a Range header against the file size: (start, end) inclusive, None for the whole file,
+# or False if the range cannot be satisfied. Multiple ranges are answered with the whole file.
+def parse_range(header: str, size: int):
+    match = BYTE_RANGE.match(header.replace(' ', ''))
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the last N bytes
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+# Validators and caching headers of a stored file
+def file_headers(name: str, stat) -> dict:
+    basename = os.path.basename(name)
+    if HASHED_NAME.match(basename):
+        etag, cache_control = basename.split('.')[0], CACHE_IMMUTABLE
+    else:
+        etag, cache_control = f'{int(stat.st_mtime):x}-{stat.st_size:x}', CACHE_DEFAULT
+    return {
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+        'Accept-Ranges': 'bytes',
+    }
+
+
+# Define a view to serve media files: Django checks the request, then (MEDIA_SERVE_MODE)
+# the front proxy sends the file (x-accel, x-sendfile) or Django streams it (direct)
+@require_safe
+def serveMedia(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    # Hidden files and directories are never served
+    if any(part.startswith('.') for part in path.split('/')) or not os.path.isfile(fullpath):
+        raise Http404
+
+    stat = os.stat(fullpath)
+    headers = file_headers(path, stat)
+    content_type = mimetypes.guess_type(fullpath)[0] or 'application/octet-stream'
+
+    # 304 Not Modified (or 412) from If-None-Match / If-Modified-Since
+    conditional = get_conditional_response(request, etag=headers['ETag'], last_modified=stat.st_mtime)
+    if conditional is not None:
+        for header, value in headers.items():
+            conditional[header] = value
+        return conditional
+
+    mode = settings.MEDIA_SERVE_MODE
+    if mode == 'x-accel':
+        # nginx serves the file from an internal location (ranges included)
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Accel-Redirect'] = f'{settings.MEDIA_ACCEL_PREFIX}{path}'
+        return response
+    if mode == 'x-sendfile':
+        # Apache mod_xsendfile / lighttpd serve the file by its absolute path
+        response = HttpResponse(content_type=content_type, headers=headers)
+        response['X-Sendfile'] = fullpath
+        return response
+
+    size = stat.st_size
+    byte_range = None
+    # If-Range: only honour the range if the client still has this version
+    if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', headers['ETag']) == headers['ETag']:
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416, headers=headers)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, headers=headers)
+    else:
+        file = open(fullpath, 'rb')
+        file.seek(start)
+        response = FileResponse(RangeFile(file, length), content_type=content_type, headers=headers)
+    response['Content-Length'] = str(length)
+    if byte_range:
+        response.status_code = 206
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
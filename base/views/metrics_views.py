@@ -0,0 +1,11 @@
+from django.http import HttpResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from base.instrumentation import collect, render
+
+
+# Define an API endpoint exposing the metrics of all workers in Prometheus text format (staff only)
+@api_view(['GET'])  # Endpoint supports GET requests
+@permission_classes([IsAdminUser])  # Requires admin-level permissions
+def getMetrics(request):
+    return HttpResponse(render(collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
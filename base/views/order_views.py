@@ -1,12 +1,20 @@
+from collections import Counter
 from requests import RequestException
+from django.db.models import Case, F, Value, When
+from django.core.handlers.asgi import ASGIRequest
+from django.db.transaction import atomic, set_rollback
+from django.http import StreamingHttpResponse
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from base.signals import order_created
 from base.zibal import zibal_apis
-from base.models import Product, Order, OrderItem, ShippingAddress, PaymentToken, Zibal
+from base.zibal.events import EventStreamRenderer, StatusStream
+from base.models import Product, Order, OrderItem, ShippingAddress
 from base.serializers import OrderSerializer
+from base.routers import use_primary
 from base.strConst import (
     DETAIL, ORDER_ITEMS, PAYMENT_METHOD, QTY, PRICE,
     PRODUCT, SHIPPING_ADDRESS, ADDRESS, CITY, COUNTRY,
@@ -15,6 +23,7 @@ from base.strConst import (
     REQUIRED_SHIPPING_FIELDS,
     RESULT, TRACK_ID, LINK, MAKE_PAYMENT_LINK,
     ERROR_ORDER_ITEMS,
+    ERROR_OUT_OF_STOCK,
     ERROR_PAYMENT_METHOD,
     ERROR_SHIPPING_ADDRESS_FIELD,
     ERROR_PRICES,
@@ -65,42 +74,54 @@ def addOrderItems(request):
         # Return an error response if any price value is missing
         return Response({DETAIL: ERROR_PRICES})
 
-    # [1] Create the order object
-    order = Order.objects.create(
-        user=user,  # Associate the order with the authenticated user
-        paymentMethod=paymentMethod,  # Set the payment method
-        taxPrice=taxPrice,  # Set the tax price
-        shippingPrice=shippingPrice,  # Set the shipping price
-        totalPrice=totalPrice,  # Set the total price
-    )
-
-    # [2] Create the shipping address associated with the order
-    ShippingAddress.objects.create(
-        order=order,  # Link the shipping address to the order
-        address=shippingAddress.get(ADDRESS),  # Set the address field
-        city=shippingAddress.get(CITY),  # Set the city field
-        country=shippingAddress.get(COUNTRY),  # Set the country field
-        postalCode=shippingAddress.get(
-            POSTAL_CODE),  # Set the postal code field
-    )
-
-    # [3] Create order items and associate them with the order
-    for item in orderItems:
-        # Retrieve the product by its ID
-        product = Product.objects.get(_id=item[PRODUCT])
-        orderItem = OrderItem.objects.create(
-            product=product,  # Associate the order item with the product
-            order=order,  # Associate the order item with the order
-            name=product.name,  # Set the name of the product
-            qty=item.get(QTY),  # Set the quantity of the product
-            price=item.get(PRICE),  # Set the price of the product
-            image=product.image.url  # Set the product image URL
+    # Steps [1]-[4] succeed or fail together: an order is never left without its items or stock
+    with atomic():
+        # [1] Create the order object
+        order = Order.objects.create(
+            user=user,  # Associate the order with the authenticated user
+            paymentMethod=paymentMethod,  # Set the payment method
+            taxPrice=taxPrice,  # Set the tax price
+            shippingPrice=shippingPrice,  # Set the shipping price
+            totalPrice=totalPrice,  # Set the total price
         )
 
+        # [2] Create the shipping address associated with the order
+        ShippingAddress.objects.create(
+            order=order,  # Link the shipping address to the order
+            address=shippingAddress.get(ADDRESS),  # Set the address field
+            city=shippingAddress.get(CITY),  # Set the city field
+            country=shippingAddress.get(COUNTRY),  # Set the country field
+            postalCode=shippingAddress.get(
+                POSTAL_CODE),  # Set the postal code field
+        )
+
+        # [3] Create order items and associate them with the order
+        # Retrieve all ordered products with one query
+        products = Product.objects.in_bulk([item[PRODUCT] for item in orderItems])
+        items = []
+        quantities = Counter()  # Product ID -> total quantity ordered
+        for item in orderItems:
+            product = products[int(item[PRODUCT])]  # Retrieve the product by its ID
+            items.append(OrderItem(
+                product=product,  # Associate the order item with the product
+                order=order,  # Associate the order item with the order
+                name=product.name,  # Set the name of the product
+                qty=item.get(QTY),  # Set the quantity of the product
+                price=item.get(PRICE),  # Set the price of the product
+                image=product.image.url  # Set the product image URL
+            ))
+            quantities[product._id] += int(item.get(QTY))
+        OrderItem.objects.bulk_create(items)  # Insert all order items with one query
+
         # [4] Update the product stock
-        # Decrease the product's stock by the ordered quantity
-        product.countInStock -= orderItem.qty
-        product.save()  # Save the updated product object
+        # Decrease every product's stock by the ordered quantity in one conditional UPDATE: a product
+        # without enough stock (e.g. sold by a concurrent checkout) does not match, and the order is undone
+        ordered = Case(*(When(_id=productId, then=Value(qty)) for productId, qty in quantities.items()))
+        updated = Product.objects.filter(_id__in=quantities, countInStock__gte=ordered).update(
+            countInStock=F('countInStock') - ordered)
+        if updated != len(quantities):
+            set_rollback(True)
+            return Response({DETAIL: ERROR_OUT_OF_STOCK}, status=status.HTTP_400_BAD_REQUEST)
 
     # Notify admin new order on e-shop
     order_created.send(sender=Order, order=order, user=user)
@@ -115,12 +136,13 @@ def addOrderItems(request):
 # Define an API endpoint to retrieve the details of a specific order by its ID
 @api_view(['GET'])  # Endpoint supports GET requests
 @permission_classes([IsAuthenticated])  # Requires user authentication
+@use_primary  # Opened right after checkout; a lagging replica would miss the order
 def getOrderById(request, pk):
     user = request.user  # Retrieve the currently authenticated user
 
     try:
-        # Attempt to retrieve the order by its primary key (ID)
-        order = Order.objects.get(_id=pk)
+        # Attempt to retrieve the order by its primary key (ID), with everything OrderSerializer reads
+        order = Order.objects.select_related('user', 'shippingaddress').prefetch_related('orderitem_set').get(_id=pk)
     except Order.DoesNotExist:
         # Return a 404 response if the order does not exist
         return Response({DETAIL: ERROR_ORDER_NOT_FOUND}, status=status.HTTP_404_NOT_FOUND)
@@ -146,7 +168,9 @@ def getMyOrders(request):
 
     # Query to fetch all orders associated with the authenticated user
     # Alternative: You can use user.order_set.all() if there's a reverse relation defined
-    orders = Order.objects.filter(user=user)
+    # (user, shipping address and items are loaded up front, not once per order)
+    orders = Order.objects.filter(user=user).select_related(
+        'user', 'shippingaddress').prefetch_related('orderitem_set')
 
     if not orders:
         # Return a 404 response if no orders are found for the user
@@ -161,6 +185,7 @@ def getMyOrders(request):
 # Define an API endpoint to handle payment processing for an order
 @api_view(['GET'])  # Endpoint supports GET requests
 @permission_classes([IsAuthenticated])  # Requires user authentication
+@use_primary  # Reads isPaid before creating the transaction
 def payOrder(request, pk):
     user = request.user  # Retrieve the authenticated user
 
@@ -205,16 +230,13 @@ def payOrder(request, pk):
 @api_view(['GET'])  # Endpoint supports GET requests
 # Requires user authentication to access
 @permission_classes([IsAuthenticated])
+@use_primary  # Reads the status the payment callback just wrote
 def inquiryPay(request, token):
     user = request.user  # Retrieve the authenticated user making the request
 
-    try:
-        # Fetch the payment token, order, and transaction associated with the provided token
-        payment_token = PaymentToken.objects.get(token=token)
-        order = Order.objects.get(_id=payment_token.orderId, user=user)
-        transaction = Zibal.objects.get(trackId=int(
-            payment_token.trackId), order=order, user=user)
-    except (PaymentToken.DoesNotExist, Order.DoesNotExist, Zibal.DoesNotExist):
+    # Resolve the token, order, and transaction in a single query (signed tokens skip the token table)
+    transaction = zibal_apis.database_apis.get_payment_transaction(token, user)
+    if transaction is None:
         # Handle case where any of the required objects do not exist
         return Response({DETAIL: ERROR_TRANSACTION_DETAILS_NOT_FOUND}, status=status.HTTP_404_NOT_FOUND)
     else:
@@ -247,3 +269,25 @@ def inquiryPay(request, token):
                     # Translate the result code into a meaningful message and respond with an error
                     MSG = zibal_apis.server_apis.result_code_translator(result)
                     return Response({DETAIL: MSG}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Define an API endpoint streaming the payment status as Server-Sent Events (replaces polling inquiryPay)
+@api_view(['GET'])  # Endpoint supports GET requests
+@renderer_classes([EventStreamRenderer, *api_settings.DEFAULT_RENDERER_CLASSES])  # Accept: text/event-stream
+# Requires user authentication to access
+@permission_classes([IsAuthenticated])
+def payEvents(request, token):
+    # Resolve the token into the user's transaction, like inquiryPay
+    transaction = zibal_apis.database_apis.get_payment_transaction(token, request.user)
+    if transaction is None:
+        # Handle case where any of the required objects do not exist
+        return Response({DETAIL: ERROR_TRANSACTION_DETAILS_NOT_FOUND}, status=status.HTTP_404_NOT_FOUND)
+
+    # Pushed as the callback (or an inquiry) writes the status; under ASGI the stream waits in the
+    # event loop, under WSGI it is a long poll holding a worker thread for one change at most
+    stream = StatusStream(transaction, request.headers.get('Last-Event-ID'))
+    content = aiter(stream) if isinstance(request._request, ASGIRequest) else iter(stream)
+    response = StreamingHttpResponse(content, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Ask proxies (nginx) not to buffer the events
+    return response
@@ -25,7 +25,7 @@ def getProducts(request):
         return Response(serializer.data)
     except Exception as e:
         # Log an error if something goes wrong during product retrieval
-        logging.error(ERROR_PRODUCTS_NOT_REGISTERED + MORE_DETAILS % {'e': e})
+        logging.error(ERROR_PRODUCTS_NOT_REGISTERED + MORE_DETAILS, {'e': e})
 
         # Return an error response indicating that products could not be registered
         return Response({DETAIL: ERROR_PRODUCTS_NOT_REGISTERED})
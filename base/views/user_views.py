@@ -1,14 +1,16 @@
 from django.db import IntegrityError
-import logging
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import make_password
 from django.conf import settings
 from django.http import HttpResponseRedirect
 from base.serializers import UserSerializer, UserSerializerWithToken
+from base.routers import use_primary
+from base.throttling import AUTH_THROTTLES
 from base.strConst import (
     NEW_REGISTER, DETAIL,
     IS_NOT_ACTIVE,
@@ -19,7 +21,11 @@ from base.strConst import (
     ERROR_UNEXPECTED
 )
 from base import utils
-import jwt
+
+
+# Login endpoint (TokenObtainPairView) rate limited before the password hash is checked
+class MyTokenObtainPairView(TokenObtainPairView):
+    throttle_classes = AUTH_THROTTLES
 
 
 # Define an API endpoint to retrieve the profile of the authenticated user
@@ -44,11 +50,16 @@ def getUsers(request):
 
 
 @api_view(['POST'])  # Specifies that this view only handles POST requests
+@throttle_classes(AUTH_THROTTLES)  # Rate limit before any password hashing happens
 def registerUser(request):
-    # Extract user registration data from the request body
-    data = request.data
+    # Hash the password for security (once, it is reused if the user already exists)
+    return register(request.data, make_password(request.data['password']))
+
+
+# Register a user from the request data and an already hashed password
+# (shared with the async view, which hashes in the password pool)
+def register(data, passwordHash):
     username = data['email']  # Email is used as the username
-    password = data['password']  # Password provided by the user
 
     try:
         # Attempt to create a new user with the provided data
@@ -56,8 +67,7 @@ def registerUser(request):
             first_name=data['name'],  # First name of the user
             username=data['email'],  # Username is set to the email
             email=data['email'],  # Email address
-            # Hash the password for security
-            password=make_password(data['password']),
+            password=passwordHash,  # Hashed password
             is_active=False  # Set the user as inactive until email verification
         )
 
@@ -81,8 +91,7 @@ def registerUser(request):
 
         if user and not user.is_active:
             # If the user exists but is inactive, update their password
-            # Hash and set the new password
-            user.password = make_password(password)
+            user.password = passwordHash
             user.save()  # Save the user object to the database
 
             # Generate a new activation link and email content
@@ -109,7 +118,16 @@ def registerUser(request):
 # Define an API endpoint to update the profile of the authenticated user
 @api_view(['PUT'])  # Endpoint supports PUT requests
 @permission_classes([IsAuthenticated])  # Requires user authentication
+@throttle_classes(AUTH_THROTTLES)  # Rate limit before any password hashing happens
 def updateUserProfile(request):
+    # Hash the new password if one is provided
+    passwordHash = make_password(request.data['password']) if request.data['password'] != '' else None
+    return saveProfile(request, passwordHash)
+
+
+# Save the authenticated user's profile from the request data and an already hashed password (or None)
+# (shared with the async view, which hashes in the password pool)
+def saveProfile(request, passwordHash):
     user = request.user  # Retrieve the authenticated user
     data = request.data  # Extract profile update data from the request body
 
@@ -117,32 +135,28 @@ def updateUserProfile(request):
     user.first_name = data['name']
     user.email = data['email']
     user.username = data['email']
-    if data['password'] != '':  # Update the password if provided
-        user.password = make_password(data['password'])
+    if passwordHash is not None:  # Update the password if provided
+        user.password = passwordHash
     user.save()  # Save the updated user object
 
-    # Serialize the updated user object with a token
-    serializer = UserSerializerWithToken(user, many=False)
+    # Serialize the updated user object with the access token of this request
+    serializer = UserSerializerWithToken(user, many=False, context={'token': str(request.auth)})
     # Return the serialized data as a response
     return Response(serializer.data)
 
 
 # Define an API endpoint to verify a user's email using a token
 @api_view(['GET'])  # Endpoint supports GET requests
+@use_primary  # The user was just created on the primary
 def verifyEmail(request, token):
-    try:
-        # Decode the JWT token to retrieve the user payload
-        payload = jwt.decode(
-            jwt=token,
-            key=settings.SECRET_KEY,
-            algorithms=[settings.SIMPLE_JWT['ALGORITHM']]
-        )
-    except:
-        # Redirect to the frontend login page with an invalid token message if decoding fails
+    # Read the user ID from the signed activation token
+    user_id = utils.readActivationToken(token)
+    user = User.objects.filter(id=user_id).first() if user_id is not None else None
+    if user is None:
+        # Redirect to the frontend login page with an invalid token message if the token is invalid
         return HttpResponseRedirect(f'{settings.FRONTEND_DOMAIN}/login?token=invalid')
     else:
         # Activate the user if the token is valid
-        user = User.objects.get(id=payload['user_id'])
         user.is_active = True
         user.save()
         # Redirect to the frontend login page with a valid token message
@@ -1,13 +1,19 @@
-# Import the ZibalDatabaseAPIs and ZibalServerAPIs classes from the respective modules
-# Handles database interactions for Zibal
-from .database_apis import ZibalDatabaseAPIs
-# Handles server-side API interactions for Zibal
-from .server_apis import ZibalServerAPIs
+from functools import cached_property
 
 
 # Define the ZibalAPIs class to encapsulate Zibal server and database operations
 class ZibalAPIs:
-    def __init__(self):
-        # Initialize instances of server and database APIs as attributes of the class
-        self.server_apis = ZibalServerAPIs()  # API for interacting with the Zibal server
-        self.database_apis = ZibalDatabaseAPIs()  # API for managing Zibal-related database operations
+    # The clients are created (and their modules, with the HTTP client, imported) on first use:
+    # most workers and management commands never talk to the gateway
+
+    @cached_property
+    def server_apis(self):
+        # Handles server-side API interactions for Zibal
+        from .server_apis import ZibalServerAPIs
+        return ZibalServerAPIs()  # API for interacting with the Zibal server
+
+    @cached_property
+    def database_apis(self):
+        # Handles database interactions for Zibal
+        from .database_apis import ZibalDatabaseAPIs
+        return ZibalDatabaseAPIs()  # API for managing Zibal-related database operations
@@ -1,13 +1,19 @@
 import logging
-import pytz
 from datetime import datetime
+from zoneinfo import ZoneInfo
 from django.conf import settings
+from django.core import signing
+from django.db.models import F
+from django.db.transaction import atomic, on_commit
+from django.utils import timezone
 from django.contrib.auth.models import User
 from base.models import Order, Zibal, PaymentToken
+from base.zibal.events import payment_events
 from base.strConst import (
     TRACK_ID, ERROR_TRANSACTION_CREATE_DB, MORE_DETAILS,
     ERROR_UPDATE_TRANSACTION, STATUS, AMOUNT, DESCRIPTION, CARD_NO, PAID_AT,
-    REF_NO, VERIFIED_AT, CREATED_AT_Z, ERROR_COMPLETE_TRANSACTION_INFO
+    REF_NO, VERIFIED_AT, CREATED_AT_Z, ERROR_COMPLETE_TRANSACTION_INFO,
+    PAYMENT_TOKEN_SALT, PAYMENT_TOKEN_SIGNED
 )
 
 
@@ -29,19 +35,44 @@ class ZibalDatabaseAPIs:
         except Exception as e:
             # Log an error if transaction creation fails
             logging.error(ERROR_TRANSACTION_CREATE_DB +
-                          MORE_DETAILS % {'e': e})
+                          MORE_DETAILS, {'e': e})
+            return False  # Return False to indicate failure
+
+    # Method to claim a new transaction for verification: only the first of several concurrent
+    # or repeated callbacks moves it from "created" (0) to "paid - unconfirmed" (2) and verifies it
+    def claim(self, transaction: Zibal) -> bool:
+        if Zibal.objects.filter(pk=transaction.pk, lastStatus=0).update(lastStatus=2):
+            transaction.lastStatus = 2
+            self.publish(transaction)
+            return True
+        # Claimed by another callback: continue from the stored state
+        transaction.refresh_from_db()
+        return False
+
+    # Method to release a claim whose verification failed (gateway unreachable or a transient result):
+    # the transaction goes back to "created" (0), so a retried callback verifies it again
+    def release(self, transaction: Zibal) -> bool:
+        try:
+            if Zibal.objects.filter(pk=transaction.pk, lastStatus=2).update(lastStatus=0):
+                transaction.lastStatus = 0
+                self.publish(transaction)
+            return True  # Return True if the release is successful
+        except Exception as e:
+            # Log an error if releasing the claim fails
+            logging.error(ERROR_UPDATE_TRANSACTION + MORE_DETAILS, {'e': e})
             return False  # Return False to indicate failure
 
     # Method to update the status of a Zibal transaction
     def update(self, transaction: Zibal, lastStatus: int) -> bool:
         try:
-            # Update the last status of the transaction
-            transaction.lastStatus = lastStatus
-            transaction.save()  # Save the changes to the database
+            # Update the last status of the transaction (a confirmed payment is never downgraded)
+            if Zibal.objects.filter(pk=transaction.pk).exclude(lastStatus=1).update(lastStatus=lastStatus):
+                transaction.lastStatus = lastStatus
+                self.publish(transaction)
             return True  # Return True if the update is successful
         except Exception as e:
             # Log an error if transaction update fails
-            logging.error(ERROR_UPDATE_TRANSACTION + MORE_DETAILS % {'e': e})
+            logging.error(ERROR_UPDATE_TRANSACTION + MORE_DETAILS, {'e': e})
             return False  # Return False to indicate failure
 
     # Method to complete a Zibal transaction by updating its details
@@ -57,57 +88,107 @@ class ZibalDatabaseAPIs:
             verified_at = data.get(VERIFIED_AT)
             created_at_z = data.get(CREATED_AT_Z)
 
-            # Update the transaction fields based on the extracted data
+            # Collect the transaction fields to update from the extracted data
+            fields = {}
             if status:
-                transaction.lastStatus = status
+                fields['lastStatus'] = status
             if amount:
-                transaction.amountPaid = amount
+                fields['amountPaid'] = amount
             if description:
-                transaction.description = description
+                fields['description'] = description
             if card_no:
-                transaction.cardNumber = card_no
+                fields['cardNumber'] = card_no
             if paid_at:
-                transaction.paidAt = paid_at
+                fields['paidAt'] = self.make_aware(paid_at)
             if ref_no:
-                transaction.refNumber = ref_no
-            # else:
-            #     # Generate a mock reference number for testing
-            #     transaction.refNumber = int(str(transaction._id) * 3)
+                fields['refNumber'] = ref_no
             if verified_at:
-                transaction.verifiedAt = self.make_aware(verified_at)
+                fields['verifiedAt'] = self.make_aware(verified_at)
             if created_at_z:
-                transaction.createdAt_Z = self.make_aware(created_at_z)
+                fields['createdAt_Z'] = self.make_aware(created_at_z)
 
-            transaction.save()  # Save the updated transaction details
+            # Save the transaction and mark its order as paid together (concurrent callbacks and
+            # inquiries may complete the same transaction; each write is a conditional UPDATE)
+            with atomic():
+                rows = Zibal.objects.filter(pk=transaction.pk)
+                if fields.get('lastStatus') != 1:
+                    # A confirmed payment is never downgraded by a late inquiry
+                    rows = rows.exclude(lastStatus=1)
+                if rows.update(**fields):
+                    for field, value in fields.items():
+                        setattr(transaction, field, value)
+                    self.publish(transaction)
+                else:
+                    transaction.refresh_from_db()
 
-            # Mark the associated order as paid
-            if paid_at:
-                transaction.order.paidAt = self.make_aware(paid_at)
-                transaction.order.isPaid = True
-                transaction.order.save()
+                if paid_at:
+                    Order.objects.filter(pk=transaction.order_id).update(isPaid=True, paidAt=fields['paidAt'])
+                    if Zibal.order.is_cached(transaction):
+                        transaction.order.isPaid, transaction.order.paidAt = True, fields['paidAt']
 
             return True  # Return True if the transaction is successfully completed
         except Exception as e:
             # Log an error if transaction completion fails
             logging.error(ERROR_COMPLETE_TRANSACTION_INFO +
-                          MORE_DETAILS % {'e': e})
+                          MORE_DETAILS, {'e': e})
             return False  # Return False to indicate failure
 
+    # Helper method to notify the payment's event streams once the new status is committed
+    def publish(self, transaction: Zibal):
+        on_commit(lambda trackId=transaction.trackId: payment_events.publish(trackId))
+
     # Helper method to convert a naive datetime string into an aware datetime object
     def make_aware(self, raw_datetime: str) -> datetime:
         # Parse the raw datetime string into a naive datetime object
         naive_datetime = datetime.strptime(raw_datetime, "%Y-%m-%dT%H:%M:%S.%f")
         # Localize the naive datetime object to the timezone specified in settings
-        aware_datetime = pytz.timezone(
-            settings.TIME_ZONE).localize(naive_datetime)
+        aware_datetime = timezone.make_aware(naive_datetime, ZoneInfo(settings.TIME_ZONE))
         return aware_datetime
 
     # Method to generate a payment token for a transaction
-    def generate_payment_token(self, orderId: str, trackId: str) -> str:
+    def generate_payment_token(self, order: Order, transaction: Zibal) -> str:
+        if settings.PAYMENT_TOKEN_MODE == PAYMENT_TOKEN_SIGNED:
+            # Stateless token: HMAC-signed and timestamped, nothing is written to the database
+            signer = signing.TimestampSigner(salt=PAYMENT_TOKEN_SALT)
+            return signer.sign_object([order._id, transaction.trackId])
+
         # Create a new PaymentToken object
         payment_token = PaymentToken.objects.create(
-            orderId=orderId,  # Associated order ID
-            trackId=trackId   # Associated transaction track ID
+            order=order,  # Associated order
+            transaction=transaction  # Associated transaction
         )
         # Return the generated token
         return payment_token.token
+
+    # Method to resolve a payment token into the user's transaction (with its order) in one query
+    def get_payment_transaction(self, token: str, user: User) -> Zibal | None:
+        max_age = settings.PAYMENT_TOKEN_MAX_AGE
+
+        # Signed tokens always contain the ':' separator, stored tokens (token_urlsafe) never do
+        if ':' in token:
+            signer = signing.TimestampSigner(salt=PAYMENT_TOKEN_SALT)
+            try:
+                orderId, trackId = signer.unsign_object(token, max_age=max_age)
+            except (signing.BadSignature, ValueError, TypeError):
+                return None
+            return Zibal.objects.select_related('order').filter(
+                trackId=trackId, order___id=orderId, order__user=user, user=user).first()
+
+        # Tokens issued before signed mode (or in 'db' mode) are still read from the table
+        payment_token = PaymentToken.objects.select_related(
+            'transaction', 'transaction__order').filter(
+            token=token,
+            createdAt__gte=timezone.now() - max_age,
+            transaction__order=F('order'),
+            transaction__user=user,
+            transaction__order__user=user,
+        ).first()
+        if payment_token is None:
+            return None
+        return payment_token.transaction
+
+    # Method to delete stored payment tokens that are past PAYMENT_TOKEN_MAX_AGE
+    def purge_expired_payment_tokens(self) -> int:
+        deleted, _ = PaymentToken.objects.filter(
+            createdAt__lt=timezone.now() - settings.PAYMENT_TOKEN_MAX_AGE).delete()
+        return deleted
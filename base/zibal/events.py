@@ -0,0 +1,186 @@
+import asyncio
+import json
+import threading
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from asgiref.sync import sync_to_async
+from rest_framework.renderers import BaseRenderer
+from base.admission import Gate, gate
+from base.models import Zibal
+from base.strConst import STATUS
+from base.zibal import zibal_apis
+
+# Statuses a payment still moves on from: created (0), pending (-1), paid and being verified (2)
+OPEN_STATUSES = (0, -1, 2)
+
+
+# In-process publish/subscribe of payment status changes, by trackId: ZibalDatabaseAPIs publishes
+# after writing a status, the event streams of that payment wake up and read it. A write made by
+# another worker process is not published here; the streams find it by re-reading periodically
+class PaymentEvents:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listeners = {}  # trackId -> set of callbacks
+
+    def subscribe(self, trackId: int, callback):
+        with self.lock:
+            self.listeners.setdefault(trackId, set()).add(callback)
+
+    def unsubscribe(self, trackId: int, callback):
+        with self.lock:
+            callbacks = self.listeners.get(trackId)
+            if callbacks is not None:
+                callbacks.discard(callback)
+                if not callbacks:
+                    del self.listeners[trackId]
+
+    # Wake every stream of the payment (any thread)
+    def publish(self, trackId: int):
+        with self.lock:
+            callbacks = list(self.listeners.get(trackId, ()))
+        for callback in callbacks:
+            callback()
+
+
+payment_events = PaymentEvents()
+
+
+# Current status of a transaction, read from the primary (the stream outlives the request's
+# replica pinning, and the callback that wrote the status just committed there)
+def read_status(pk: int) -> dict:
+    transaction = Zibal.objects.using(DEFAULT_DB_ALIAS).select_related('order').get(pk=pk)
+    return zibal_apis.server_apis.generate_inquiry_pay_response(transaction)
+
+
+def message(event: str, data: dict = None, event_id: str = None) -> str:
+    prefix = f'id: {event_id}\n' if event_id else ''
+    return f'{prefix}event: {event}\ndata: {json.dumps(data or {})}\n\n'
+
+
+# When the client first opened the stream: the id of the last event it received (Last-Event-ID,
+# sent on reconnection), or now for a new client
+def started_at(last_event_id: str | None, now: float) -> float:
+    try:
+        started = float(last_event_id)
+    except (TypeError, ValueError):
+        return now
+    return started if 0 < started <= now else now
+
+
+# Gate capping the open streams of this process (admission class "events"), None when disabled
+def stream_gate() -> Gate | None:
+    if settings.ADMISSION_CONTROL and 'events' in settings.ADMISSION_LIMITS:
+        return gate('events')
+    return None
+
+
+# Lets clients ask for text/event-stream; errors raised before the stream starts (authentication,
+# unknown token) are sent as a single "error" event
+class EventStreamRenderer(BaseRenderer):
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return message('error', data).encode()
+
+
+# One Server-Sent Events stream: the status now, then every change, until the payment is settled
+# or PAYMENT_EVENTS_TIMEOUT passes ("timeout" event; the client falls back to inquiryPay). The
+# status is re-read when the payment is published, or every PAYMENT_EVENTS_POLL_SECONDS otherwise.
+# Status events carry the time the client first connected as their id, so the timeout counts
+# from there across reconnections
+class StatusStream:
+    def __init__(self, transaction: Zibal, last_event_id: str = None):
+        self.pk = transaction.pk
+        self.trackId = transaction.trackId
+        now = time.time()
+        self.started = started_at(last_event_id, now)
+        self.deadline = time.monotonic() + self.started + settings.PAYMENT_EVENTS_TIMEOUT - now
+        self.until = None  # End of a long poll (WSGI)
+        self.sent = None
+
+    def start(self) -> str:
+        return f'retry: {int(settings.PAYMENT_EVENTS_POLL_SECONDS * 1000)}\n\n'
+
+    # Next chunk for a freshly read status, and whether the stream ends after it
+    def update(self, status: dict) -> tuple[str, bool]:
+        settled = status[STATUS] not in OPEN_STATUSES
+        if status != self.sent:
+            changed = self.sent is not None
+            self.sent = status
+            # A long poll ends after the first change: the client reconnects for the next one
+            return message('status', status, f'{self.started:.3f}'), settled or (changed and self.until is not None)
+        now = time.monotonic()
+        if now >= self.deadline:
+            return message('timeout'), True
+        if self.until is not None and now >= self.until:
+            return ': reconnect\n\n', True  # The client reconnects after the retry delay
+        return ': keepalive\n\n', False  # Comment line: keeps proxies from closing an idle stream
+
+    def timeout(self) -> float:
+        end = self.deadline if self.until is None else min(self.deadline, self.until)
+        return max(0.0, min(settings.PAYMENT_EVENTS_POLL_SECONDS, end - time.monotonic()))
+
+    # Without a free "events" slot: the status once, the client reconnects after the retry delay
+    def once(self) -> list:
+        return [self.start(), self.update(read_status(self.pk))[0]]
+
+    # Blocking stream (WSGI): it holds a worker thread, so it is a long poll ending after the first
+    # change or PAYMENT_EVENTS_LONGPOLL_SECONDS, and holds an "events" slot while it runs
+    def __iter__(self):
+        self.until = time.monotonic() + settings.PAYMENT_EVENTS_LONGPOLL_SECONDS
+        events_gate = stream_gate()
+        if events_gate is not None and not events_gate.acquire():
+            yield from self.once()
+            return
+        woken = threading.Event()
+        payment_events.subscribe(self.trackId, woken.set)
+        try:
+            yield self.start()
+            while True:
+                woken.clear()
+                chunk, done = self.update(read_status(self.pk))
+                yield chunk
+                if done:
+                    return
+                woken.wait(self.timeout())
+        finally:
+            payment_events.unsubscribe(self.trackId, woken.set)
+            if events_gate is not None:
+                events_gate.release()
+
+    # Non-blocking stream (ASGI: waits in the event loop, the database is read in a thread)
+    async def __aiter__(self):
+        events_gate = stream_gate()
+        if events_gate is not None and not await events_gate.aacquire():
+            for chunk in await sync_to_async(self.once)():
+                yield chunk
+            return
+        loop = asyncio.get_running_loop()
+        woken = asyncio.Event()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(woken.set)
+            except RuntimeError:
+                pass  # The loop is closed: the stream is gone
+
+        payment_events.subscribe(self.trackId, wake)
+        try:
+            yield self.start()
+            while True:
+                woken.clear()
+                chunk, done = self.update(await sync_to_async(read_status)(self.pk))
+                yield chunk
+                if done:
+                    return
+                try:
+                    await asyncio.wait_for(woken.wait(), self.timeout())
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            payment_events.unsubscribe(self.trackId, wake)
+            if events_gate is not None:
+                events_gate.release()
@@ -0,0 +1,300 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode, urlsplit, parse_qs
+import requests
+from base.strConst import (
+    MERCHANT, AMOUNT, ORDER_ID, CALLBACK_URL, TRACK_ID, RESULT, MSG, STATUS,
+    SUCCESS, CARD_NO, PAID_AT, VERIFIED_AT, CREATED_AT_Z, DESCRIPTION, REF_NO,
+    REQUEST_PATH, VERIFY_PATH, INQUIRY_PATH
+)
+from .server_apis import ZibalServerAPIs
+
+
+# Result codes the real gateway can answer with (see ZibalServerAPIs.result_code_translator)
+RESULT_CODES = (100, 102, 103, 104, 105, 106, 113, 114, 201, 202, 203)
+
+# Payment statuses a user can end up with on the payment page
+# 2 = Paid - Unconfirmed (becomes 1 after verify), the rest are failures
+PAY_STATUSES = (2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12)
+
+# Datetime format used by Zibal (parsed by ZibalDatabaseAPIs.make_aware)
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+# Parse "code:weight,code:weight" into a {code: weight} dictionary
+def parse_weights(raw: str | None) -> dict:
+    weights = {}
+    if not raw:
+        return weights
+    for part in raw.split(','):
+        code, _, weight = part.partition(':')
+        weights[int(code)] = float(weight or 1)
+    return weights
+
+
+# Pick a code from a {code: weight} dictionary, or return the default when no weight applies
+def pick_weighted(weights: dict, default: int) -> int:
+    total = sum(weights.values())
+    if total <= 0:
+        return default
+    roll = random.uniform(0, max(total, 1.0))
+    for code, weight in weights.items():
+        roll -= weight
+        if roll <= 0:
+            return code
+    return default
+
+
+# Configuration of the fake gateway behaviour
+class FakeZibalConfig:
+    def __init__(self, latency_ms=(0, 0), error_rate=0.0, request_results=None,
+                 verify_results=None, inquiry_results=None, pay_statuses=None,
+                 callback_timeout=10):
+        self.latency_ms = latency_ms  # (min, max) artificial latency per gateway call
+        self.error_rate = error_rate  # Fraction of calls answered with an HTTP 500 / non-JSON body
+        self.request_results = request_results or {}  # Forced result codes for request/
+        self.verify_results = verify_results or {}  # Forced result codes for verify/
+        self.inquiry_results = inquiry_results or {}  # Forced result codes for inquiry/
+        self.pay_statuses = pay_statuses or {2: 1.0}  # Outcome distribution on the payment page
+        self.callback_timeout = callback_timeout  # Timeout when firing callbacks back at the app
+
+
+# In-memory store of fake transactions keyed by trackId
+class FakeZibalLedger:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.transactions = {}
+        self.next_track_id = int(time.time())  # Track IDs keep growing between restarts
+
+    def create(self, amount: int, orderId: str, callbackUrl: str, description: str | None) -> int:
+        with self.lock:
+            self.next_track_id += 1
+            trackId = self.next_track_id
+            self.transactions[trackId] = {
+                AMOUNT: amount,
+                ORDER_ID: orderId,
+                CALLBACK_URL: callbackUrl,
+                DESCRIPTION: description,
+                STATUS: -1,  # Pending payment
+                CREATED_AT_Z: datetime.now().strftime(DATETIME_FORMAT),
+                PAID_AT: None,
+                VERIFIED_AT: None,
+                CARD_NO: None,
+                REF_NO: None,
+                'verifyCount': 0,
+            }
+            return trackId
+
+    def get(self, trackId) -> dict | None:
+        try:
+            return self.transactions.get(int(trackId))
+        except (TypeError, ValueError):
+            return None
+
+
+# HTTP handler implementing the subset of the Zibal IPG used by the app
+class FakeZibalHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeZibal/1.0'
+
+    # Silence the default per-request stderr logging (it skews load tests)
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload: dict, code: int = 200):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_result(self, result: int, **extra):
+        payload = {RESULT: result, MSG: self.server.apis.result_code_translator(result)}
+        payload.update(extra)
+        self.send_json(payload)
+
+    # Apply the configured latency and decide whether this call fails at the HTTP level
+    def simulate_network(self) -> bool:
+        config = self.server.config
+        low, high = config.latency_ms
+        if high > 0:
+            time.sleep(random.uniform(low, high) / 1000)
+        if config.error_rate and random.random() < config.error_rate:
+            body = b'Internal Server Error'
+            self.send_response(500)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return False
+        return True
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            data = {}
+
+        if not self.simulate_network():
+            return
+
+        if path == f'/v1/{REQUEST_PATH}':
+            self.handle_request(data)
+        elif path == f'/v1/{VERIFY_PATH}':
+            self.handle_verify(data)
+        elif path == f'/v1/{INQUIRY_PATH}':
+            self.handle_inquiry(data)
+        else:
+            self.send_json({MSG: 'Not found'}, code=404)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        segments = [s for s in parts.path.split('/') if s]
+        if len(segments) == 2 and segments[0] == 'start':
+            fire = parse_qs(parts.query).get('fire', ['0'])[0] == '1'
+            self.handle_start(segments[1], fire)
+        else:
+            self.send_json({MSG: 'Not found'}, code=404)
+
+    # POST /v1/request/
+    def handle_request(self, data: dict):
+        forced = pick_weighted(self.server.config.request_results, 100)
+        if forced != 100:
+            return self.send_result(forced)
+        if not data.get(MERCHANT):
+            return self.send_result(102)
+        amount = data.get(AMOUNT)
+        if not isinstance(amount, int) or amount < 1000:
+            return self.send_result(105)
+        callbackUrl = data.get(CALLBACK_URL) or ''
+        if not callbackUrl.startswith(('http://', 'https://')):
+            return self.send_result(106)
+
+        trackId = self.server.ledger.create(
+            amount, str(data.get(ORDER_ID)), callbackUrl, data.get(DESCRIPTION))
+        self.send_result(100, **{TRACK_ID: trackId})
+
+    # POST /v1/verify/
+    def handle_verify(self, data: dict):
+        transaction = self.server.ledger.get(data.get(TRACK_ID))
+        if transaction is None:
+            return self.send_result(203)
+        forced = pick_weighted(self.server.config.verify_results, 100)
+        if forced != 100:
+            return self.send_result(forced)
+
+        with self.server.ledger.lock:
+            transaction['verifyCount'] += 1
+            if transaction[STATUS] == 1:
+                return self.send_result(201)
+            if transaction[STATUS] != 2:
+                return self.send_result(202, **{STATUS: transaction[STATUS]})
+            transaction[STATUS] = 1
+            transaction[VERIFIED_AT] = datetime.now().strftime(DATETIME_FORMAT)
+
+        self.send_result(100, **{
+            PAID_AT: transaction[PAID_AT],
+            CARD_NO: transaction[CARD_NO],
+            STATUS: transaction[STATUS],
+            AMOUNT: transaction[AMOUNT],
+            REF_NO: transaction[REF_NO],
+            DESCRIPTION: transaction[DESCRIPTION],
+            ORDER_ID: transaction[ORDER_ID],
+        })
+
+    # POST /v1/inquiry/
+    def handle_inquiry(self, data: dict):
+        transaction = self.server.ledger.get(data.get(TRACK_ID))
+        if transaction is None:
+            return self.send_result(203)
+        forced = pick_weighted(self.server.config.inquiry_results, 100)
+        if forced != 100:
+            return self.send_result(forced)
+
+        self.send_result(100, **{
+            CREATED_AT_Z: transaction[CREATED_AT_Z],
+            PAID_AT: transaction[PAID_AT],
+            VERIFIED_AT: transaction[VERIFIED_AT],
+            CARD_NO: transaction[CARD_NO],
+            STATUS: transaction[STATUS],
+            AMOUNT: transaction[AMOUNT],
+            REF_NO: transaction[REF_NO],
+            DESCRIPTION: transaction[DESCRIPTION],
+            ORDER_ID: transaction[ORDER_ID],
+        })
+
+    # GET /start/<trackId>/ - the payment page; settles the payment and sends the user back
+    def handle_start(self, trackId: str, fire: bool):
+        transaction = self.server.ledger.get(trackId)
+        if transaction is None:
+            return self.send_json({MSG: 'Invalid track ID.'}, code=404)
+
+        with self.server.ledger.lock:
+            if transaction[STATUS] == -1:
+                status = pick_weighted(self.server.config.pay_statuses, 2)
+                transaction[STATUS] = status
+                if status == 2:
+                    transaction[PAID_AT] = datetime.now().strftime(DATETIME_FORMAT)
+                    transaction[CARD_NO] = f'603799******{random.randint(0, 9999):04d}'
+                    transaction[REF_NO] = random.randint(10 ** 9, 10 ** 10 - 1)
+            status = transaction[STATUS]
+
+        query = urlencode({
+            SUCCESS: 1 if status in (1, 2) else 0,
+            TRACK_ID: trackId,
+            ORDER_ID: transaction[ORDER_ID],
+            STATUS: status,
+        })
+        callback = f'{transaction[CALLBACK_URL]}?{query}'
+
+        if not fire:
+            # Behave like the real payment page: redirect the browser to the callback URL
+            self.send_response(302)
+            self.send_header('Location', callback)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        # Fire the callback ourselves and report what the app answered with
+        try:
+            res = requests.get(callback, allow_redirects=False,
+                               timeout=self.server.config.callback_timeout)
+        except requests.RequestException as e:
+            return self.send_json({MSG: str(e)}, code=502)
+        self.send_json({
+            STATUS: status,
+            'callbackStatus': res.status_code,
+            'location': res.headers.get('Location'),
+        })
+
+
+# Threaded HTTP server holding the fake gateway state
+class FakeZibalServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address: tuple, config: FakeZibalConfig | None = None, verbose: bool = False):
+        super().__init__(address, FakeZibalHandler)
+        self.config = config or FakeZibalConfig()
+        self.ledger = FakeZibalLedger()
+        self.apis = ZibalServerAPIs()  # Reused for the result code messages
+        self.verbose = verbose
+
+    # Base URL to use as ZIBAL_GATEWAY
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    # Serve in a daemon thread (handy for in-process benchmarks)
+    def start_in_thread(self) -> threading.Thread:
+        thread = threading.Thread(target=self.serve_forever, name='fake-zibal', daemon=True)
+        thread.start()
+        return thread
@@ -2,6 +2,8 @@ import requests
 from django.urls import reverse
 from django.conf import settings
 from base.models import Order, Zibal
+from base.instrumentation import timed
+from base.tracing import inject
 from base.strConst import (
     UNKNOWN_ERROR, MERCHANT, AMOUNT, ORDER_ID,
     CALLBACK_URL, ZIBAL_DOMAIN_IPG, REQUEST_PATH,
@@ -92,8 +94,15 @@ class ZibalServerAPIs:
         # Return the translated message or an unknown error
         return code_translator.get(result, UNKNOWN_ERROR)
 
+    # Check whether a verify result settles the payment as not confirmed (any other failing code,
+    # e.g. a merchant error, says nothing about the payment and is verified again on a retried callback)
+    def is_declined(self, result: int) -> bool:
+        return result in (202, 203)
+
     # Send a POST request to a specific Zibal endpoint with given parameters
     def postTo(self, path: str, parameters: dict) -> dict:
         url: str = ZIBAL_DOMAIN_IPG + path  # Construct the full URL for the endpoint
-        response = requests.post(url, json=parameters)  # Send the POST request with JSON payload
+        with timed('zibal', path.strip('/')):  # Record the gateway latency
+            # Send the POST request with JSON payload (and the trace context of the current span)
+            response = requests.post(url, json=parameters, headers=inject({}))
         return response.json()  # Return the response as a JSON object
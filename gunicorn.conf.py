@@ -0,0 +1,78 @@
+# Production server configuration: `gunicorn` (run from this directory) picks it up by default.
+#
+# The app is imported once in the master process (preload) and the workers are forked from it,
+# sharing its memory pages copy-on-write; environment variables:
+#   SERVER_INTERFACE  'wsgi' (sync/threaded workers, default) or 'asgi' (uvicorn workers)
+#   BIND              Address to listen on (default 0.0.0.0:8000)
+#   WEB_CONCURRENCY   Worker processes (default: autotuned from the usable cores)
+#   WORKER_THREADS    Threads per WSGI worker (default 4)
+#   WORKER_TIMEOUT    Seconds before a silent worker is restarted (default 30)
+#   MAX_REQUESTS      Restart a worker after this many requests, 0 never (default 0)
+import gc
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+INTERFACE = os.getenv('SERVER_INTERFACE', 'wsgi')
+
+
+# Cores this process may run on (the container's CPU set, not the host's core count)
+def usable_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Sync workers block on SQLite and the gateway: 2 per core (+1) keeps the cores busy; an ASGI
+# worker runs many requests in its event loop, one per core is enough
+def autotune_workers(interface: str = INTERFACE, cores: int = None) -> int:
+    cores = cores or usable_cores()
+    return cores if interface == 'asgi' else 2 * cores + 1
+
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+preload_app = True
+workers = int(os.getenv('WEB_CONCURRENCY', 0)) or autotune_workers()
+timeout = int(os.getenv('WORKER_TIMEOUT', 30))
+max_requests = int(os.getenv('MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+if INTERFACE == 'asgi':
+    wsgi_app = 'backend.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'backend.wsgi:application'
+    worker_class = 'gthread'
+    threads = int(os.getenv('WORKER_THREADS', 4))
+
+
+# Master, at startup (before any worker runs): drop the metrics snapshots of the previous run's workers
+def on_starting(server):
+    from django.conf import settings
+    from base.instrumentation import clear_snapshots
+    if settings.METRICS_DIR:
+        clear_snapshots()
+
+
+# Master, app loaded, before the first fork
+def when_ready(server):
+    from django.conf import settings
+    from django.urls import get_resolver
+    from base.admission import thread_budget_errors
+    if INTERFACE != 'asgi' and settings.ADMISSION_CONTROL:
+        # Limits that can take every thread never shed: a stuck class would starve the others
+        for error in thread_budget_errors(settings.ADMISSION_LIMITS, server.cfg.threads):
+            server.log.warning('Admission control cannot isolate %s', error)
+    # Import every view (and its serializers) now rather than in each worker on its first request
+    get_resolver().url_patterns
+    # Move everything loaded so far out of the collector's reach: collections in the workers
+    # no longer write to (and so copy) the pages shared with the master
+    gc.collect()
+    gc.freeze()
+
+
+# Master, before every fork: workers must never inherit an open database connection
+def pre_fork(server, worker):
+    from django.db import connections
+    connections.close_all()